@@ -0,0 +1,423 @@
+"""
+Benchmark harness for emotibit_parse_organize.py
+
+Three parts:
+- generate:    synthetic EmotiBit raw recordings (<timestamp>.csv + _info.json)
+- stub-parser: a local stand-in for EmotiBitDataParser.exe that writes <timestamp>_<TAG>.csv files
+- run:         times find / copy / parse / organize over several dataset sizes
+
+    python emotibit_benchmark.py run --minutes 1,10,30 --recordings 3 --json bench.json
+    python emotibit_benchmark.py run --baseline bench.json   # exit code 1 on a regression
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import emotibit_parse_organize as epo
+
+
+# Data streams: typetag -> sample rate in Hz
+# Rates follow the EmotiBit v4+ firmware defaults
+STREAMS = {
+    "EA": 15.0, "EL": 15.0,
+    "PI": 25.0, "PR": 25.0, "PG": 25.0,
+    "AX": 25.0, "AY": 25.0, "AZ": 25.0,
+    "GX": 25.0, "GY": 25.0, "GZ": 25.0,
+    "MX": 25.0, "MY": 25.0, "MZ": 25.0,
+    "T1": 7.5, "TH": 7.5,
+    "B%": 0.1, "BV": 0.1,
+}
+SENSOR_INFO = [
+    ("EDA", ["EA", "EL"], 15),
+    ("PPG", ["PI", "PR", "PG"], 25),
+    ("Accelerometer", ["AX", "AY", "AZ"], 25),
+    ("Gyroscope", ["GX", "GY", "GZ"], 25),
+    ("Magnetometer", ["MX", "MY", "MZ"], 25),
+    ("Temperature", ["T1", "TH"], 7.5),
+]
+PACKET_INTERVAL_MS = 100          # the firmware flushes every stream's buffer about ten times a second
+MARKER_INTERVAL_S = 30            # one LSL marker (LM packet) every 30 s
+RECORDING_GAP = timedelta(minutes=2)
+
+
+
+
+def _sample_value(typetag, t, rng):
+    """Plausible value for one sample of a stream at time t (seconds)"""
+    if typetag in ("EA", "EL"):
+        return f"{1.5 + 0.5 * math.sin(t / 20.0) + rng.gauss(0, 0.01):.6f}"
+    if typetag in ("PI", "PR", "PG"):
+        return str(int(100000 + 2000 * math.sin(2 * math.pi * 1.2 * t) + rng.gauss(0, 50)))
+    if typetag[0] == "A":
+        return f"{(1.0 if typetag == 'AZ' else 0.0) + rng.gauss(0, 0.02):.3f}"
+    if typetag[0] == "G":
+        return f"{rng.gauss(0, 1.5):.3f}"
+    if typetag[0] == "M":
+        return str(int(rng.gauss(0, 40)))
+    if typetag in ("T1", "TH"):
+        return f"{33.0 + 0.2 * math.sin(t / 60.0) + rng.gauss(0, 0.02):.3f}"
+    if typetag == "B%":
+        return str(max(0, 100 - int(t / 60)))
+    return f"{4.1 - t / 36000.0:.3f}"
+
+
+def generate_recording(csv_path, duration_s, seed=0, start_ms=0):
+    """Write one raw recording: interleaved data packets with packet counters, sample rates and LM markers"""
+    rng = random.Random(seed)
+    base_name = os.path.splitext(os.path.basename(csv_path))[0]
+    owed = dict.fromkeys(STREAMS, 0.0)
+    packet_number = 0
+    bytes_written = 0
+
+    with open(csv_path, "w", newline="") as f:
+        def packet(emotibit_ms, typetag, payload):
+            nonlocal packet_number, bytes_written
+            line = f"{emotibit_ms},{packet_number},{len(payload)},{typetag},1,100,{','.join(payload)}\n"
+            packet_number = (packet_number + 1) % 65536
+            bytes_written += len(line)
+            f.write(line)
+
+        packet(start_ms, "RB", [base_name])
+        for step in range(int(duration_s * 1000 / PACKET_INTERVAL_MS)):
+            emotibit_ms = start_ms + (step + 1) * PACKET_INTERVAL_MS
+            t = emotibit_ms / 1000.0
+            for typetag, rate in STREAMS.items():
+                # Each packet carries the samples buffered since the last flush
+                owed[typetag] += rate * PACKET_INTERVAL_MS / 1000.0
+                n_samples = int(owed[typetag])
+                if n_samples:
+                    owed[typetag] -= n_samples
+                    packet(emotibit_ms, typetag, [_sample_value(typetag, t, rng) for _ in range(n_samples)])
+            if (step + 1) * PACKET_INTERVAL_MS % (MARKER_INTERVAL_S * 1000) == 0:
+                packet(emotibit_ms, "LM", ["LSL_MARKER", f"stim{emotibit_ms // 1000}"])
+        packet(start_ms + (step + 1) * PACKET_INTERVAL_MS, "RE", [base_name])
+    return bytes_written
+
+
+def generate_info(json_path, device_id="MD-V5-0000001"):
+    """Write an _info.json in the shape EmotiBit Oscilloscope produces"""
+    info = [{"info": {"name": name, "type": name, "typeTags": typetags, "channel_count": len(typetags),
+                      "nominal_srate": rate, "channel_format": "float", "source_id": device_id}}
+            for name, typetags, rate in SENSOR_INFO]
+    with open(json_path, "w") as f:
+        json.dump(info, f, indent=2)
+
+
+def generate_dataset(directory, recordings=1, minutes=1.0, seed=0, start=None, log=print):
+    """Create a source folder with `recordings` raw recordings of `minutes` each; returns total bytes"""
+    os.makedirs(directory, exist_ok=True)
+    start = start or datetime(2025, 7, 21, 9, 0, 0, 123456)
+    total = 0
+    for i in range(recordings):
+        base_name = start.strftime("%Y-%m-%d_%H-%M-%S-%f")
+        csv_path = os.path.join(directory, base_name + ".csv")
+        total += generate_recording(csv_path, minutes * 60, seed=seed + i, start_ms=1000 + i * 7919)
+        generate_info(os.path.join(directory, base_name + "_info.json"))
+        total += os.path.getsize(os.path.join(directory, base_name + "_info.json"))
+        log(f"Generated {base_name}.csv ({os.path.getsize(csv_path) / 1e6:.1f} MB)")
+        start += timedelta(minutes=minutes) + RECORDING_GAP
+    return total
+
+
+
+
+def stub_parse(csv_file_path, output_folder):
+    """Stand-in parser: route every packet line to <timestamp>_<TAG>.csv, one row per packet"""
+    base_name = os.path.splitext(os.path.basename(csv_file_path))[0]
+    start_epoch = datetime.strptime(base_name, "%Y-%m-%d_%H-%M-%S-%f").timestamp()
+    first_ms = None
+    outputs = {}
+    try:
+        with open(csv_file_path, newline="") as f:
+            for line in f:
+                fields = line.split(",", 4)
+                if len(fields) < 5:
+                    continue
+                typetag = fields[3]
+                out = outputs.get(typetag)
+                if out is None:
+                    out = outputs[typetag] = open(os.path.join(output_folder, f"{base_name}_{typetag}.csv"), "w")
+                    out.write(epo._parsed_header(typetag))
+                if first_ms is None:
+                    first_ms = float(fields[0])
+                out.write(f"{start_epoch + (float(fields[0]) - first_ms) / 1000.0:.6f},{line}")
+    finally:
+        for out in outputs.values():
+            out.close()
+    return sorted(outputs)
+
+
+def write_stub_launcher(directory):
+    """Write an executable that run_parser can call like EmotiBitDataParser.exe"""
+    script = os.path.abspath(__file__)
+    if os.name == "nt":
+        path = os.path.join(directory, "stub_parser.bat")
+        with open(path, "w") as f:
+            f.write(f'@"{sys.executable}" "{script}" stub-parser %*\n')
+    else:
+        path = os.path.join(directory, "stub_parser.sh")
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" stub-parser "$@"\n')
+        os.chmod(path, 0o755)
+    return path
+
+
+
+
+def _children_peak_mb():
+    """Peak RSS of this process's finished child processes (the parser), if the platform reports it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _traced_peak_mb(func):
+    """Peak Python allocations while func runs"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def memory_run(func):
+    """Run func once more for its peak Python allocations and the peak RSS of the processes it starts.
+
+    On POSIX the run happens in a forked child, whose RUSAGE_CHILDREN only covers this run's parsers
+    (in this process it would be the high-water mark of every parser started so far).
+    """
+    if resource is None or not hasattr(os, "fork"):
+        return _traced_peak_mb(func), None
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        try:
+            payload = {"peak_mb": _traced_peak_mb(func), "child_peak_mb": _children_peak_mb()}
+        except BaseException as e:
+            payload = {"error": str(e) or type(e).__name__}
+        with os.fdopen(write_end, "w") as f:
+            json.dump(payload, f)
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        text = f.read()
+    os.waitpid(pid, 0)
+    payload = json.loads(text) if text else {"error": "memory run died"}
+    if "error" in payload:
+        raise RuntimeError(f"Memory run failed: {payload['error']}")
+    return payload["peak_mb"], payload["child_peak_mb"] or None
+
+
+def measure(stage, func, size_bytes, recordings, reset=None):
+    """Run one stage, returning its result and a timing/memory record.
+
+    The timed run is untraced (tracemalloc slows allocation-heavy code down); memory comes from a second run,
+    after reset() when the first run consumed the stage's input.
+    """
+    start_time = time.perf_counter()
+    result = func()
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    if reset is not None:
+        reset()
+    peak_mb, child_peak_mb = memory_run(func)
+    return result, {
+        "stage": stage,
+        "seconds": elapsed,
+        "mb": size_bytes / 1e6,
+        "mb_per_s": size_bytes / 1e6 / elapsed,
+        "recordings_per_min": recordings * 60.0 / elapsed,
+        "peak_mb": peak_mb,
+        "child_peak_mb": child_peak_mb,
+    }
+
+
+def bench_dataset(source_dir, output_dir, parser_exe_path, archive_mode="copy"):
+    """Time the four stages of one session, the way the main script runs them"""
+    quiet = lambda message: None
+    raw_bytes = sum(entry.stat().st_size for entry in os.scandir(source_dir) if entry.is_file())
+    results = []
+
+    (csv_files, json_files), record = measure("find_raw_files", lambda: epo.find_raw_files(source_dir, log=quiet),
+                                              raw_bytes, 0)
+    results.append(record)
+    recordings = len(csv_files)
+    results[-1]["recordings_per_min"] = recordings * 60.0 / record["seconds"]
+
+    raw_folder, parsed_folder = epo.setup_folders(output_dir)
+    _, record = measure("copy_raw_files",
+                        lambda: epo.copy_raw_files(source_dir, raw_folder, csv_files, json_files, log=quiet,
+                                                   archive_mode=archive_mode),
+                        raw_bytes, recordings)
+    results.append(record)
+    recording_folders = epo.create_recording_folders(parsed_folder, csv_files, 0, 0, 0, 0, log=quiet)
+
+    # Parser output lands in each recording's staging folder, which the organize stage commits.
+    # Like the main script, the parser reads the archived copy (run_parser expands gzip/zstd archives first)
+    raw_paths = {csv_file: epo.archived_raw_path(raw_folder, csv_file, archive_mode) for csv_file in csv_files}
+    csv_bytes = sum(epo._file_size(raw_paths[csv_file]) for csv_file in csv_files)
+    parsed = {}
+    staging_folders = {}
+    def parse_all():
+        for recording_folder, csv_file, _ in recording_folders:
+            staging_folders[csv_file] = epo.stage_recording(recording_folder)
+            parsed[csv_file] = epo.run_parser(parser_exe_path, raw_paths[csv_file], staging_folders[csv_file],
+                                              log=quiet)
+    _, record = measure("run_parser", parse_all, csv_bytes, recordings)
+    results.append(record)
+    failed = [csv_file for csv_file, success in parsed.items() if not success]
+    if failed:
+        raise RuntimeError(f"Parser failed on {', '.join(failed)}")
+
+    parsed_bytes = sum(entry.stat().st_size for staging_folder in staging_folders.values()
+                       for entry in os.scandir(staging_folder) if entry.is_file())
+    def organize_all():
+        for recording_folder, csv_file, _ in recording_folders:
+            epo.organize_parsed_files(staging_folders[csv_file], csv_file, log=quiet)
+            epo.commit_recording(staging_folders[csv_file], recording_folder, csv_file)
+    # Organizing commits the staging folders, so the memory run needs a fresh parse first
+    _, record = measure("organize_parsed_files", organize_all, parsed_bytes, recordings, reset=parse_all)
+    results.append(record)
+    return results
+
+
+def run_benchmarks(minutes_list, recordings, work_dir, parser_exe_path=None, archive_mode="copy", seed=0, keep=False):
+    """Benchmark every dataset size; returns a list of {dataset, ..., stages} entries"""
+    own_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="emotibit_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    parser_exe_path = parser_exe_path or write_stub_launcher(work_dir)
+    report = []
+    try:
+        for minutes in minutes_list:
+            label = f"{recordings}x{minutes:g}min"
+            source_dir = os.path.join(work_dir, f"source_{label}")
+            output_dir = os.path.join(work_dir, f"output_{label}")
+            shutil.rmtree(output_dir, ignore_errors=True)
+            if not os.path.isdir(source_dir):
+                print(f"Generating dataset {label}...")
+                generate_dataset(source_dir, recordings, minutes, seed=seed, log=lambda message: None)
+            print(f"Benchmarking {label}...")
+            stages = bench_dataset(source_dir, output_dir, parser_exe_path, archive_mode)
+            report.append({"dataset": label, "minutes": minutes, "recordings": recordings, "stages": stages})
+    finally:
+        if own_work_dir and not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elif keep:
+            print(f"Datasets kept in {work_dir}")
+    return report
+
+
+def print_report(report):
+    """Print one table row per dataset and stage"""
+    print(f"\n{'dataset':<14}{'stage':<24}{'MB':>9}{'seconds':>10}{'MB/s':>10}{'rec/min':>10}{'peak MB':>10}")
+    for entry in report:
+        for stage in entry["stages"]:
+            peak = f"{stage['peak_mb']:.1f}"
+            if stage.get("child_peak_mb") is not None:
+                peak += f" ({stage['child_peak_mb']:.0f})"
+            print(f"{entry['dataset']:<14}{stage['stage']:<24}{stage['mb']:>9.1f}{stage['seconds']:>10.3f}"
+                  f"{stage['mb_per_s']:>10.1f}{stage['recordings_per_min']:>10.0f}{peak:>10}")
+    print("peak MB = Python allocations in an untimed second run of the stage "
+          "(peak RSS of that run's parser processes in brackets)")
+
+
+def compare_reports(report, baseline, tolerance):
+    """Return the (dataset, stage, old, new) throughputs that dropped by more than `tolerance`"""
+    previous = {(entry["dataset"], stage["stage"]): stage["mb_per_s"]
+                for entry in baseline for stage in entry["stages"]}
+    regressions = []
+    for entry in report:
+        for stage in entry["stages"]:
+            old = previous.get((entry["dataset"], stage["stage"]))
+            if old and stage["mb_per_s"] < old * (1 - tolerance):
+                regressions.append((entry["dataset"], stage["stage"], old, stage["mb_per_s"]))
+    return regressions
+
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks and test data for emotibit_parse_organize.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Write synthetic raw recordings to a folder")
+    generate.add_argument("directory")
+    generate.add_argument("--recordings", type=int, default=2, help="Number of recordings (default: 2)")
+    generate.add_argument("--minutes", type=float, default=1.0, help="Length of each recording (default: 1)")
+    generate.add_argument("--seed", type=int, default=0)
+
+    stub = commands.add_parser("stub-parser", help="Stand-in for EmotiBitDataParser.exe: CSV -o OUTPUT_DIR")
+    stub.add_argument("csv_file")
+    stub.add_argument("-o", dest="output_folder", default=None,
+                      help="Output folder (default: next to the input file)")
+
+    run = commands.add_parser("run", help="Time find/copy/parse/organize over several dataset sizes")
+    run.add_argument("--minutes", default="1,10",
+                     help="Comma-separated recording lengths in minutes, one dataset each (default: 1,10)")
+    run.add_argument("--recordings", type=int, default=3, help="Recordings per dataset (default: 3)")
+    run.add_argument("--work-dir", default=None,
+                     help="Where to generate data; reused between runs (default: a temporary folder)")
+    run.add_argument("--keep", action="store_true", help="Keep the temporary work folder")
+    run.add_argument("--parser-exe", default=None, help="Benchmark a real parser instead of the stub")
+    run.add_argument("--archive-mode", choices=epo.ARCHIVE_MODES, default="copy")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--json", default=None, help="Save the results to a JSON file")
+    run.add_argument("--baseline", default=None, help="Compare with an earlier --json file")
+    run.add_argument("--tolerance", type=float, default=0.2,
+                     help="Allowed throughput drop against the baseline (default: 0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "generate":
+        total = generate_dataset(args.directory, args.recordings, args.minutes, seed=args.seed)
+        print(f"Wrote {total / 1e6:.1f} MB to {args.directory}")
+        return 0
+
+    if args.command == "stub-parser":
+        output_folder = args.output_folder or os.path.dirname(os.path.abspath(args.csv_file))
+        typetags = stub_parse(args.csv_file, output_folder)
+        print(f"Wrote {len(typetags)} streams: {', '.join(typetags)}")
+        return 0
+
+    minutes_list = [float(value) for value in args.minutes.split(",") if value.strip()]
+    report = run_benchmarks(minutes_list, args.recordings, args.work_dir, args.parser_exe, args.archive_mode,
+                            args.seed, args.keep)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        for dataset, stage, old, new in regressions:
+            print(f"REGRESSION: {dataset} {stage}: {old:.1f} -> {new:.1f} MB/s")
+        if regressions:
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,407 @@
 import os
+import sys
+import csv
+import json
 import shutil
+import hashlib
+import gzip
+import threading
 import subprocess
 import glob
 import re
+import time
+import asyncio
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
+import importlib.util
+import argparse
+import tempfile
+import sqlite3
+import socket
+import uuid
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from functools import partial
+
+try:
+    import numpy as np
+except ImportError:  # only needed for the optional post-parse stages
+    np = None
+
+
+DEFAULT_PARSER_EXE_PATH = r"C:\Program Files\EmotiBit\EmotiBit DataParser\EmotiBitDataParser.exe"
+
+# Built-in parser settings
+PARSER_BACKENDS = ("exe", "builtin")
+BUILTIN_PARSER_VERSION = "1"
+RAW_CHUNK_BYTES = 16 * 1024 * 1024
+GATHER_ROWS = 100000  # output rows spliced per NumPy gather (bounds the index array)
+SPLIT_MIN_BYTES = 64 * 1024 * 1024  # smaller files are not worth splitting across processes
+PARSED_HEADER = "LocalTimestamp,EmotiBitTimestamp,PacketNumber,DataLength,TypeTag,ProtocolVersion,DataReliability"
+TYPETAG_PATTERN = re.compile(r'^[A-Z0-9%]{2}$')
+ASCII_ZEROS = 0x3030303030303030  # eight '0' bytes, for parsing digit fields a uint64 word at a time
+
+# Parser job scheduling: timeouts grow with the raw file size, transient failures are retried with backoff,
+# and jobs only start while their estimated memory fits in the RAM budget
+PARSER_TIMEOUT_BASE = 60.0          # seconds, plus PARSER_TIMEOUT_PER_MB for every MB of raw input
+PARSER_TIMEOUT_PER_MB = 2.0
+PARSER_RETRIES = 2
+PARSER_RETRY_BACKOFF = 5.0          # seconds before the first retry, doubled for each further one
+PARSER_JOB_MEMORY_BASE = 128 * 1024 * 1024
+PARSER_JOB_MEMORY_FACTOR = 1.0      # estimated parser memory per byte of raw input
+MEMORY_HEADROOM = 0.75              # share of the available RAM that parser jobs may use
+TRANSIENT_FAILURES = ("timeout", "out-of-memory", "os-error")
+
+# File name patterns, e.g. 2025-07-21_16-51-58-669857.csv, ..._info.json and ..._EA.csv
+RAW_CSV_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6})\.csv$')
+RAW_JSON_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6})_info\.json$')
+PARSED_CSV_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6})_(.+)\.csv$')
+
+# How raw files are placed in Raw: "copy" always copies, hardlink/reflink avoid writing the data twice,
+# gzip/zstd store raw CSVs as independently compressed frames with a seek index
+ARCHIVE_MODES = ("copy", "auto", "hardlink", "reflink", "gzip", "zstd")
+ARCHIVE_METHODS = {
+    "copy": ("copy",),
+    "auto": ("reflink", "hardlink", "copy"),
+    "hardlink": ("hardlink", "copy"),
+    "reflink": ("reflink", "copy"),
+    "gzip": ("gzip",),
+    "zstd": ("zstd",),
+}
+ARCHIVE_LABELS = {"copy": "Copied", "hardlink": "Hardlinked", "reflink": "Reflinked", "gzip": "Compressed (gzip)",
+                  "zstd": "Compressed (zstd)"}
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+ARCHIVE_INDEX_SUFFIX = ".idx.json"
+ARCHIVE_FRAME_BYTES = 1024 * 1024  # uncompressed bytes per frame: the unit of a partial read
+CHECKSUM_SUFFIX = ".sha256"
+COPY_BUFFER_BYTES = 4 * 1024 * 1024
+FICLONE = 0x40049409  # Linux ioctl for copy-on-write clones (btrfs, xfs, ...)
+
+# Each recording is parsed into Parsed/.staging/<folder> and then swapped into place with one rename
+STAGING_FOLDER = ".staging"
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2  # renameat2() flag (Linux 3.15+): atomically exchange two paths
+_renameat2 = None
+
+# Post-parse columnar copies of the <timestamp>_<TAG>.csv streams
+COLUMNAR_FORMATS = ("npy", "parquet", "both")
+SCHEMA_SUFFIX = ".schema.json"
+
+# Pre-flight raw file checks: "flag" only warns, "quarantine" sets bad files aside instead of parsing them
+PREFLIGHT_MODES = ("flag", "quarantine", "off")
+PREFLIGHT_BLOCK_BYTES = 4 * 1024 * 1024
+PREFLIGHT_MAX_MALFORMED = 0.01      # a file with more malformed lines than this fraction is bad
+PACKET_NUMBER_MODULUS = 65536       # packet numbers are 16-bit and wrap around
+QUARANTINE_FOLDER = "Quarantine"
+RAW_QC_NAME = "raw_qc.json"
+
+# Post-parse QC summary per recording folder, rolled up at the Parsed/ level
+QC_SUMMARY_NAME = "qc_summary"
+QC_GAP_FACTOR = 2.0  # an interval longer than this many expected intervals counts as a dropout
+QC_RATE_WINDOW = 10
+QC_FIELDS = ("stream", "samples", "empty_packets", "duration_s", "effective_rate_hz", "expected_rate_hz", "gaps", "dropout_pct",
+             "max_gap_s", "min", "max", "mean", "std", "start", "end")
+_qc_rollup_lock = threading.Lock()
+
+# Post-parse alignment of the numeric streams onto one common timebase
+ALIGNED_SUFFIX = "_aligned"
+
+# Min/max/mean decimation pyramids for plotting long streams (--pyramid)
+PYRAMID_FACTORS = (10, 100, 1000)
+PYRAMID_SUFFIX = "_pyramid"
+PYRAMID_COLUMNS = ("LocalTimestamp", "min", "max", "mean")
+
+# Watch-folder daemon: inotify event mask (close after write, moved in, created, modified)
+INOTIFY_MASK = 0x00000008 | 0x00000080 | 0x00000100 | 0x00000002
+WATCH_IDLE_SECONDS = 60  # safety rescan interval when inotify reports nothing
+
+# Per-output-directory record of what has already been copied and parsed
+PROCESSING_MANIFEST_NAME = "processing_manifest.json"
+FAST_HASH_BYTES = 1024 * 1024
+_processing_manifest_lock = threading.Lock()
+
+# SQLite catalog of every processed recording (--catalog), shared by all output directories of a study
+RECORDING_FOLDER_PATTERN = re.compile(r'^P(\d+)E(\d+)_W(\d+)D(\d+)_REC(\d+)-(\d+)_(\d{4}-\d{2}-\d{2})$')
+CATALOG_TIMEOUT = 30  # seconds to wait for another process holding the catalog's write lock
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    output_dir TEXT NOT NULL,
+    csv_file TEXT NOT NULL,
+    participant INTEGER NOT NULL,
+    emotibit INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    rec_index INTEGER,
+    rec_count INTEGER,
+    date TEXT,
+    folder_name TEXT,
+    source_path TEXT,
+    raw_path TEXT,
+    recording_folder TEXT,
+    start_time REAL,
+    end_time REAL,
+    duration_s REAL,
+    raw_bytes INTEGER,
+    parsed_bytes INTEGER,
+    status TEXT NOT NULL,
+    parser TEXT,
+    stages TEXT,
+    updated TEXT NOT NULL,
+    UNIQUE (output_dir, csv_file)
+);
+CREATE INDEX IF NOT EXISTS recordings_by_session ON recordings (participant, week, day);
+CREATE INDEX IF NOT EXISTS recordings_by_week ON recordings (week, day);
+CREATE INDEX IF NOT EXISTS recordings_by_date ON recordings (date);
+CREATE INDEX IF NOT EXISTS recordings_by_status ON recordings (status);
+CREATE TABLE IF NOT EXISTS streams (
+    recording_id INTEGER NOT NULL REFERENCES recordings (id) ON DELETE CASCADE,
+    stream TEXT NOT NULL,
+    file TEXT NOT NULL,
+    rows INTEGER,
+    bytes INTEGER,
+    start_time REAL,
+    end_time REAL,
+    PRIMARY KEY (recording_id, stream)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS streams_by_stream ON streams (stream, recording_id);
+"""
+CATALOG_FILTERS = {
+    "participant": ("participant", "P"),
+    "emotibit": ("emotibit", "E"),
+    "week": ("week", "W"),
+    "day": ("day", "D"),
+    "date": ("date",),
+    "status": ("status",),
+    "stream": ("stream", "streams"),
+}
+CATALOG_COLUMNS = ("participant", "emotibit", "week", "day", "rec_index", "rec_count", "date", "folder_name", "status",
+                   "duration_s", "raw_bytes", "parsed_bytes", "streams", "recording_folder")
+
+# Content fingerprints of archived raw files (--dedup): a recording offloaded from an SD card twice is linked, not re-parsed
+DEDUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS raw_files (
+    id INTEGER PRIMARY KEY,
+    output_dir TEXT NOT NULL,
+    csv_file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fast_hash TEXT NOT NULL,
+    sha256 TEXT,
+    participant INTEGER NOT NULL,
+    emotibit INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    folder_name TEXT,
+    source_path TEXT,
+    updated TEXT NOT NULL,
+    UNIQUE (output_dir, csv_file)
+);
+CREATE INDEX IF NOT EXISTS raw_files_by_fingerprint ON raw_files (size, fast_hash);
+"""
+
+# Shared work queue (--queue): workers on several hosts claim sessions from one SQLite file on a shared filesystem
+QUEUE_TIMEOUT = 60        # seconds to wait for another worker holding the queue's write lock
+QUEUE_LEASE_SECONDS = 120  # a job whose worker stops renewing its lease for this long is handed to another worker
+QUEUE_MAX_ATTEMPTS = 3    # claims before a job that keeps losing its worker is marked failed
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    source_dir TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    participant INTEGER NOT NULL,
+    emotibit INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    token TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_expires REAL,
+    heartbeat REAL,
+    claimed TEXT,
+    finished TEXT,
+    report TEXT,
+    UNIQUE (source_dir, output_dir, participant, emotibit, week, day)
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, lease_expires);
+"""
+
+# Manifest columns for batch mode, with the short P/E/W/D aliases people tend to use
+MANIFEST_FIELDS = {
+    "source_dir": ("source_dir", "source"),
+    "output_dir": ("output_dir", "output"),
+    "participant": ("participant", "P"),
+    "emotibit": ("emotibit", "E"),
+    "week": ("week", "W"),
+    "day": ("day", "D"),
+}
+
+# Typetags whose payload is a list of samples (written as one row per sample)
+DATA_TYPETAGS = {
+    "EA", "EL", "ER", "SA", "SR", "SF",     # EDA and skin conductance response
+    "PI", "PR", "PG", "HR", "BI",           # PPG, heart rate, inter-beat interval
+    "T0", "T1", "TH", "H0",                 # temperature and humidity
+    "AX", "AY", "AZ", "GX", "GY", "GZ",     # accelerometer and gyroscope
+    "MX", "MY", "MZ",                       # magnetometer
+    "B%", "BV", "DC", "DO",                 # battery, data clipping/overflow
+}
+
+
+
+
+# Console output levels (-q / default / -v) and the counters every run log record carries
+VERBOSITY_QUIET, VERBOSITY_NORMAL, VERBOSITY_DEBUG = 0, 1, 2
+RUN_LOG_COUNTERS = ("cpu_s", "subprocess_cpu_s", "bytes_read", "bytes_written", "files")
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+
+
+class RunLog:
+    """Per-stage timings (wall time, CPU time, bytes, file counts) written as one JSON object per line"""
+   
+    def __init__(self, path=None, verbosity=VERBOSITY_NORMAL):
+        self.path = path
+        self.verbosity = verbosity
+        self.run_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+        self.totals = {}
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+   
+    def echo(self, message):
+        """Console output for progress lines: hidden with -q unless it reports a problem"""
+        if self.verbosity >= VERBOSITY_NORMAL or message.lstrip().startswith(("ERROR", "WARNING", "✗")):
+            print(message)
+   
+    def write(self, record):
+        """Append a record to the run log and add it to the per-stage totals"""
+        record = {"run": self.run_id, **record}
+        with self._lock:
+            stage = record.get("stage")
+            if stage:
+                totals = self.totals.setdefault(stage, dict.fromkeys(("count", "wall_s") + RUN_LOG_COUNTERS, 0))
+                totals["count"] += 1
+                for key in ("wall_s",) + RUN_LOG_COUNTERS:
+                    totals[key] += record.get(key) or 0
+            if self._file:
+                self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+   
+    @contextmanager
+    def stage(self, stage, track_cpu=True, **fields):
+        """Time a block of work; counters can be added to the yielded record, or via add() further down the stack"""
+        record = {"stage": stage, **fields, "start": datetime.now().isoformat(), **dict.fromkeys(RUN_LOG_COUNTERS, 0)}
+        token = _current_stage.set(record)
+        start_time = time.perf_counter()
+        # CPU time of the calling thread, so concurrent recordings don't count each other's work
+        start_cpu = time.thread_time() if track_cpu else None
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            _current_stage.reset(token)
+            record["wall_s"] = round(time.perf_counter() - start_time, 6)
+            if start_cpu is not None:
+                record["cpu_s"] += round(time.thread_time() - start_cpu, 6)
+            self.write(record)
+   
+    def note(self, **fields):
+        """Set fields on the innermost open stage, e.g. a failure class (no-op outside a stage)"""
+        record = _current_stage.get()
+        if record is not None:
+            record.update(fields)
+   
+    def add(self, **counters):
+        """Add to the counters of the innermost open stage (no-op outside a stage)"""
+        record = _current_stage.get()
+        if record is not None:
+            for key, value in counters.items():
+                record[key] = (record.get(key) or 0) + (value or 0)
+   
+    def print_summary(self):
+        """Console table of where the run spent its time"""
+        if not self.totals or self.verbosity < VERBOSITY_NORMAL:
+            return
+        print(f"\n{'stage':<16}{'count':>7}{'wall s':>10}{'CPU s':>9}{'child CPU s':>13}{'MB read':>10}{'MB written':>12}{'files':>7}")
+        for stage, totals in self.totals.items():
+            print(f"{stage:<16}{totals['count']:>7}{totals['wall_s']:>10.2f}{totals['cpu_s']:>9.2f}"
+                  f"{totals['subprocess_cpu_s']:>13.2f}{totals['bytes_read'] / 1e6:>10.1f}"
+                  f"{totals['bytes_written'] / 1e6:>12.1f}{totals['files']:>7}")
+        if self.path:
+            print(f"Run log: {self.path}")
+   
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+
+
+# Replaced by main() according to --run-log / -q / -v
+_run_log = RunLog()
+
+
+
+
+class ParserScheduler:
+    """Per-run policy for parser jobs: size-scaled timeouts, retries with backoff and a shared RAM budget"""
+   
+    def __init__(self, timeout_base=PARSER_TIMEOUT_BASE, timeout_per_mb=PARSER_TIMEOUT_PER_MB, retries=PARSER_RETRIES,
+                 retry_backoff=PARSER_RETRY_BACKOFF, memory_limit=None):
+        self.timeout_base = timeout_base
+        self.timeout_per_mb = timeout_per_mb
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.memory_limit = memory_limit
+        self.reserved = 0
+        self._condition = threading.Condition()
+   
+    def timeout(self, size):
+        """Seconds a parse of a raw file of this size may take"""
+        return self.timeout_base + self.timeout_per_mb * size / 1e6
+   
+    def memory_estimate(self, size):
+        return PARSER_JOB_MEMORY_BASE + int(PARSER_JOB_MEMORY_FACTOR * size)
+   
+    def acquire(self, size):
+        """Block until a job's estimated memory fits the budget; returns the reservation and the seconds waited.
+
+        A job always starts when no other job is running, however large it is.
+        """
+        need = self.memory_estimate(size)
+        start_time = time.perf_counter()
+        with self._condition:
+            while self.memory_limit and self.reserved and self.reserved + need > self.memory_limit:
+                self._condition.wait()
+            self.reserved += need
+        return need, time.perf_counter() - start_time
+   
+    def release(self, need):
+        with self._condition:
+            self.reserved -= need
+            self._condition.notify_all()
+   
+    def should_retry(self, failure, attempt):
+        return failure in TRANSIENT_FAILURES and attempt <= self.retries
+   
+    def backoff(self, attempt):
+        """Delay before retry number `attempt`"""
+        return self.retry_backoff * 2 ** (attempt - 1)
+
+
+
+
+# Replaced by main() according to --timeout-base / --timeout-per-mb / --retries / --retry-backoff / --memory-limit
+_scheduler = ParserScheduler()
 
 
 
@@ -19,171 +417,4226 @@ def get_user_input():
 
 
 
-def find_raw_files(source_dir):
-    """Find ALL CSV and JSON files sorted by timestamp"""
-    # Updated to match 6-digit microseconds format like: 2025-07-21_16-51-58-669857.csv
-    csv_files = sorted([f for f in os.listdir(source_dir) if re.match(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6}\.csv', f)])
-    json_files = sorted([f for f in os.listdir(source_dir) if re.match(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6}_info\.json', f)])
-   
-    print(f"Found {len(csv_files)} CSV files: {csv_files}")
-    print(f"Found {len(json_files)} JSON files: {json_files}")
+def build_dir_index(directory):
+    """Scan a directory once and group raw CSVs, _info.json files and parsed outputs by timestamp prefix"""
+    index = {}
+    if not os.path.isdir(directory):
+        return index
+   
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            match = RAW_CSV_PATTERN.match(name) or RAW_JSON_PATTERN.match(name) or PARSED_CSV_PATTERN.match(name)
+            if not match or not entry.is_file():
+                continue
+            group = index.get(match.group(1))
+            if group is None:
+                group = index[match.group(1)] = {"csv": None, "json": None, "parsed": []}
+            if match.re is RAW_CSV_PATTERN:
+                group["csv"] = name
+            elif match.re is RAW_JSON_PATTERN:
+                group["json"] = name
+            else:
+                group["parsed"].append(name)
+   
+    return index
+
+
+
+
+def find_raw_files(source_dir, log=print, index=None):
+    """Find ALL CSV and JSON files sorted by timestamp"""
+    # Updated to match 6-digit microseconds format like: 2025-07-21_16-51-58-669857.csv
+    if index is None:
+        index = build_dir_index(source_dir)
+    csv_files = sorted(group["csv"] for group in index.values() if group["csv"])
+    json_files = sorted(group["json"] for group in index.values() if group["json"])
+   
+    log(f"Found {len(csv_files)} CSV files: {csv_files}")
+    log(f"Found {len(json_files)} JSON files: {json_files}")
+   
+    # Return ALL files, not just first 2
+    return csv_files, json_files
+
+
+
+
+def setup_folders(output_dir):
+    """Create Raw and Parsed folders if they don't exist"""
+    raw_folder = os.path.join(output_dir, "Raw")
+    parsed_folder = os.path.join(output_dir, "Parsed")
+    os.makedirs(raw_folder, exist_ok=True)
+    os.makedirs(parsed_folder, exist_ok=True)
+    return raw_folder, parsed_folder
+
+
+
+
+def file_sha256(path):
+    """SHA-256 of a file, read in large blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_BUFFER_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+
+def _copy_with_checksum(source_path, dest_path):
+    """Copy a file while hashing it, so the source is only read once"""
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+        while True:
+            chunk = source.read(COPY_BUFFER_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dest.write(chunk)
+    shutil.copystat(source_path, dest_path)
+    return digest.hexdigest()
+
+
+
+
+def _reflink(source_path, dest_path):
+    """Clone a file with copy-on-write (raises OSError where the filesystem does not support it)"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, source.fileno())
+    shutil.copystat(source_path, dest_path)
+
+
+
+
+def _codec(method):
+    """(compress, decompress) functions for a compressed archive method"""
+    if method == "gzip":
+        return partial(gzip.compress, compresslevel=6, mtime=0), gzip.decompress
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd archives need the zstandard package (pip install zstandard)")
+    return zstandard.ZstdCompressor(level=10).compress, zstandard.ZstdDecompressor().decompress
+
+
+
+
+def _line_position(line):
+    """(timestamp, packet number) of a raw line, or None if it is malformed"""
+    fields = line.split(b",", 2)
+    try:
+        return float(fields[0]), int(fields[1])
+    except (ValueError, IndexError):
+        return None
+
+
+
+
+def _unwrap_packet(number, previous):
+    """Packet counter of a 16-bit packet number that keeps counting past the wrap, given the previous counter (or None)"""
+    if previous is None:
+        return number
+    step = (number - previous) % PACKET_NUMBER_MODULUS
+    # Steps of more than half the range are packets arriving slightly out of order
+    if step >= PACKET_NUMBER_MODULUS // 2:
+        step -= PACKET_NUMBER_MODULUS
+    return previous + step
+
+
+
+
+def _frame_position(lines, counter=None):
+    """First and last (timestamp, packet counter) among a frame's lines, continuing from the previous frame's counter"""
+    first = last = (None, None)
+    for line in lines:
+        position = _line_position(line)
+        if position is None:
+            continue
+        counter = _unwrap_packet(position[1], counter)
+        last = (position[0], counter)
+        if first[0] is None:
+            first = last
+    return first, last
+
+
+
+
+def _compress_raw_file(source_path, dest_path, method):
+    """Write a raw CSV as independently compressed frames of whole lines; returns (checksum, seek index).
+
+    Concatenated gzip members / zstd frames are still one valid .gz / .zst file, so standard tools can
+    decompress the whole archive, while the index lets a reader decompress only the frames it needs.
+    """
+    compress, _ = _codec(method)
+    raw_digest, digest = hashlib.sha256(), hashlib.sha256()
+    frames = []
+    offset = raw_offset = 0
+    counter = None
+    with open(source_path, "rb") as source, open(dest_path, "wb") as dest:
+        while True:
+            lines = source.readlines(ARCHIVE_FRAME_BYTES)
+            if not lines:
+                break
+            block = b"".join(lines)
+            frame = compress(block)
+            raw_digest.update(block)
+            digest.update(frame)
+            dest.write(frame)
+            (first_time, first_packet), (last_time, last_packet) = _frame_position(lines, counter)
+            counter = last_packet if last_packet is not None else counter
+            frames.append([offset, len(frame), raw_offset, len(block), first_time, last_time, first_packet, last_packet])
+            offset += len(frame)
+            raw_offset += len(block)
+    shutil.copystat(source_path, dest_path)
+    index = {
+        "source": os.path.basename(source_path),
+        "compression": method,
+        "size": raw_offset,
+        "sha256": raw_digest.hexdigest(),
+        "fields": ["offset", "length", "raw_offset", "raw_length", "first_timestamp", "last_timestamp",
+                   "first_packet", "last_packet"],
+        "frames": frames,
+    }
+    return digest.hexdigest(), index
+
+
+
+
+def is_compressed_archive(path):
+    """True for a raw archive written by --archive-mode gzip/zstd"""
+    return path.endswith(tuple(COMPRESSED_SUFFIXES.values()))
+
+
+
+
+def strip_archive_suffix(name):
+    """Name of the raw CSV inside a compressed archive (unchanged for other names)"""
+    for suffix in COMPRESSED_SUFFIXES.values():
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+
+
+def archived_raw_path(raw_folder, csv_file, archive_mode="copy"):
+    """Path a raw CSV is archived at in Raw (with the .gz / .zst suffix in compressed modes)"""
+    path = os.path.join(raw_folder, csv_file)
+    if archive_mode in COMPRESSED_SUFFIXES and RAW_CSV_PATTERN.search(csv_file):
+        path += COMPRESSED_SUFFIXES[archive_mode]
+    return path
+
+
+
+
+def load_archive_index(archive_path):
+    """Read the seek index of a compressed raw archive"""
+    with open(archive_path + ARCHIVE_INDEX_SUFFIX, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+
+
+def iter_archive_frames(archive_path, frames=None):
+    """Yield the decompressed bytes of the given index frames (default: all) of a compressed raw archive"""
+    index = load_archive_index(archive_path)
+    _, decompress = _codec(index["compression"])
+    with open(archive_path, "rb") as f:
+        for frame in index["frames"] if frames is None else frames:
+            f.seek(frame[0])
+            yield decompress(f.read(frame[1]))
+
+
+
+
+def read_raw_window(archive_path, start=None, end=None, first_packet=None, last_packet=None):
+    """Raw lines of a compressed archive within a timestamp and/or packet counter window (bounds inclusive).
+
+    Packet bounds are counters as in the seek index, where the 16-bit packet numbers keep counting past the
+    wrap (the packet after 65535 is 65536). Only frames whose range overlaps the window are decompressed (plus
+    one neighbour on each side, in case timestamps step back slightly across a frame boundary).
+    """
+    frames = load_archive_index(archive_path)["frames"]
+   
+    def overlaps(frame):
+        _, _, _, _, first_time, last_time, first_number, last_number = frame
+        if first_time is None:
+            return True
+        return not ((start is not None and last_time < start) or (end is not None and first_time > end)
+                    or (first_packet is not None and last_number < first_packet)
+                    or (last_packet is not None and first_number > last_packet))
+   
+    selected = [i for i, frame in enumerate(frames) if overlaps(frame)]
+    if not selected:
+        return []
+    first_frame = max(0, selected[0] - 1)
+    wanted = frames[first_frame:selected[-1] + 2]
+   
+    lines = []
+    # Counted on from the frames before, the same way the index was written
+    counter = next((frame[7] for frame in reversed(frames[:first_frame]) if frame[7] is not None), None)
+    for block in iter_archive_frames(archive_path, wanted):
+        for line in block.splitlines():
+            position = _line_position(line)
+            if position is None:
+                continue
+            timestamp, number = position[0], _unwrap_packet(position[1], counter)
+            counter = number
+            if (start is None or timestamp >= start) and (end is None or timestamp <= end) \
+                    and (first_packet is None or number >= first_packet) and (last_packet is None or number <= last_packet):
+                lines.append(line.decode("utf-8", "replace"))
+    return lines
+
+
+
+
+def expand_archive(archive_path, dest_folder):
+    """Decompress a raw archive into dest_folder under its original name; returns the plain CSV's path"""
+    dest_path = os.path.join(dest_folder, strip_archive_suffix(os.path.basename(archive_path)))
+    with open(dest_path, "wb") as f:
+        for block in iter_archive_frames(archive_path):
+            f.write(block)
+    return dest_path
+
+
+
+
+def archived_size(raw_folder, file):
+    """Original size of a file archived in Raw (plain or compressed), or None if it is not there"""
+    path = os.path.join(raw_folder, file)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        pass
+    for suffix in COMPRESSED_SUFFIXES.values():
+        if os.path.exists(path + suffix + ARCHIVE_INDEX_SUFFIX):
+            return load_archive_index(path + suffix)["size"]
+    return None
+
+
+
+
+def write_checksum_sidecar(path, checksum):
+    """Write a file's .sha256 sidecar"""
+    # Same format as sha256sum, so `sha256sum -c` works on the sidecar too
+    with open(path + CHECKSUM_SUFFIX, "w", encoding="utf-8") as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+
+
+
+
+def archive_file(source_path, dest_path, mode="copy", checksum=None):
+    """Place a raw file in Raw by reflink, hardlink, copy or compression and write its .sha256 sidecar; returns the method used.
+
+    Copies and compressed archives are hashed as they are written. A reflink or hardlink writes nothing, so instead
+    of reading the whole file just for its sidecar it takes the SHA-256 the pre-flight check computed as `checksum`;
+    without one, archived_sha256() writes the sidecar when it is first needed. The trade-off: such a sidecar records
+    the file as it was read then (before archiving, or later), not as it was at archive time.
+    """
+    methods = ARCHIVE_METHODS[mode]
+    if mode in COMPRESSED_SUFFIXES and not RAW_CSV_PATTERN.search(os.path.basename(source_path)):
+        # Only the raw CSVs are worth compressing; _info.json files are copied as they are
+        methods = ("copy",)
+   
+    # Build under a temporary name and swap it in, so an existing hardlink to the source is never written through
+    temp_path = f"{dest_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    index = None
+    for method in methods:
+        try:
+            if method in COMPRESSED_SUFFIXES:
+                checksum, index = _compress_raw_file(source_path, temp_path, method)
+                dest_path += COMPRESSED_SUFFIXES[method]
+            elif method == "reflink":
+                _reflink(source_path, temp_path)
+            elif method == "hardlink":
+                os.link(source_path, temp_path)
+            else:
+                checksum = _copy_with_checksum(source_path, temp_path)
+        except OSError:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+            if method == methods[-1]:
+                raise
+            continue
+        os.replace(temp_path, dest_path)
+        break
+   
+    if index is not None:
+        with open(dest_path + ARCHIVE_INDEX_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+    if checksum is not None:
+        write_checksum_sidecar(dest_path, checksum)
+    elif os.path.exists(dest_path + CHECKSUM_SUFFIX):
+        # A sidecar left from an earlier version of the file would no longer match
+        os.remove(dest_path + CHECKSUM_SUFFIX)
+    return method
+
+
+
+
+def verify_raw_files(raw_folder, log=print):
+    """Check every file in a Raw folder against its .sha256 sidecar; returns the names that do not match"""
+    mismatched = []
+    checked = 0
+    for sidecar in sorted(f for f in os.listdir(raw_folder) if f.endswith(CHECKSUM_SUFFIX)):
+        file = sidecar[:-len(CHECKSUM_SUFFIX)]
+        path = os.path.join(raw_folder, file)
+        with open(os.path.join(raw_folder, sidecar), "r", encoding="utf-8") as f:
+            expected = f.read().split()[0]
+        checked += 1
+        if not os.path.exists(path) or file_sha256(path) != expected:
+            log(f"  ✗ {file}")
+            mismatched.append(file)
+    # Files linked without a pre-flight checksum only get a sidecar once something needs their hash
+    for file in sorted(os.listdir(raw_folder)):
+        if not file.endswith((CHECKSUM_SUFFIX, ARCHIVE_INDEX_SUFFIX, ".tmp")) \
+                and not os.path.exists(os.path.join(raw_folder, file + CHECKSUM_SUFFIX)):
+            log(f"  ? {file}: no sidecar yet")
+    log(f"Verified {checked - len(mismatched)}/{checked} raw files in {raw_folder}")
+    return mismatched
+
+
+
+
+def _eight_digits(words):
+    """Value of eight ASCII digits packed little-endian into uint64 words (first character most significant)"""
+    words = words - np.uint64(ASCII_ZEROS)
+    words = (words * np.uint64(10) + (words >> np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    words = (words * np.uint64(100) + (words >> np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    return (words * np.uint64(10000) + (words >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+
+
+
+
+def _all_digits(words):
+    """True where all eight bytes of a uint64 word are ASCII digits"""
+    high = words & np.uint64(0xF0F0F0F0F0F0F0F0)
+    carried = ((words + np.uint64(0x0606060606060606)) & np.uint64(0xF0F0F0F0F0F0F0F0)) >> np.uint64(4)
+    return (high | carried) == np.uint64(0x3333333333333333)
+
+
+
+
+def _parse_digit_fields(buf, starts, ends, width=15):
+    """Parse plain digit fields of up to min(width, 15) characters eight at a time; returns (values, parsed mask)"""
+    lengths = ends - starts
+    parsed = (lengths > 0) & (lengths <= min(width, 15))
+    values = np.zeros(len(starts), dtype=np.uint64)
+    if len(buf) < 8:
+        return values.astype(np.float64), np.zeros(len(starts), dtype=bool)
+    # Unaligned little-endian uint64 word starting at every byte of the block
+    words = np.ndarray(shape=(len(buf) - 7,), dtype="<u8", buffer=buf, strides=(1,))
+    low_bytes = np.array([(1 << (8 * n)) - 1 for n in range(9)], dtype=np.uint64)
+    for k in range(2 if lengths[parsed].max(initial=0) > 8 else 1):
+        # The k-th word back from the field end, with the bytes before the field start read as '0';
+        # fields too close to the block start for a whole word are left to the caller
+        offsets = ends - 8 * (k + 1)
+        parsed &= (offsets >= 0) | (lengths <= 8 * k)
+        word = words[np.maximum(offsets, 0)]
+        fill = low_bytes[8 - np.clip(lengths - 8 * k, 0, 8)]
+        word = (word & ~fill) | (np.uint64(ASCII_ZEROS) & fill)
+        parsed &= _all_digits(word)
+        values += _eight_digits(word) * np.uint64(10 ** (8 * k))
+    return values.astype(np.float64), parsed
+
+
+
+
+def _parse_number_fields(buf, starts, ends, width=20):
+    """Vectorized float parse of unsigned decimal fields buf[start:end]; returns (values, valid mask)"""
+    values, valid = _parse_digit_fields(buf, starts, ends, width)
+    rest = np.flatnonzero(~valid)
+    if not len(rest):
+        return values, valid
+    # Decimals and long fields: one pass per character position (fields are short), each over the rest at once
+    starts, lengths = starts[rest], ends[rest] - starts[rest]
+    ok = (lengths > 0) & (lengths <= width)
+    mantissa = np.zeros(len(rest))
+    decimals = np.zeros(len(rest), dtype=np.int64)
+    digits = np.zeros(len(rest), dtype=np.int64)
+    dots = np.zeros(len(rest), dtype=np.int64)
+   
+    for k in range(min(width, int(lengths.max(initial=0)))):
+        inside = k < lengths
+        chars = buf[np.minimum(starts + k, len(buf) - 1)]
+        is_digit = (chars >= 48) & (chars <= 57) & inside
+        is_dot = (chars == 46) & inside
+        ok &= ~inside | is_digit | is_dot
+        mantissa = np.where(is_digit, mantissa * 10 + (chars - 48), mantissa)
+        decimals += is_digit & (dots > 0)
+        digits += is_digit
+        dots += is_dot
+    valid[rest] = ok & (dots <= 1) & (digits > 0)
+    values[rest] = mantissa / np.power(10.0, decimals)
+    return values, valid
+
+
+
+
+def _check_raw_block(block, qc, carry):
+    """Check one block of complete raw lines, updating the QC counters"""
+    buf = np.frombuffer(block, dtype=np.uint8)
+    # One scan for newlines and commas; a line's commas are the separators between its newline and the previous one
+    separators = np.flatnonzero((buf == 10) | (buf == 44))
+    newlines = np.flatnonzero(buf[separators] == 10)
+    line_ends = separators[newlines]
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    first = np.concatenate(([0], newlines[:-1] + 1))
+    qc["lines"] += len(line_ends)
+   
+    # Blank lines (including a lone \r) are ignored, like the parser does
+    blank = (line_ends - line_starts) <= (buf[np.maximum(line_ends - 1, 0)] == 13)
+    complete = (newlines - first >= 5) & ~blank
+   
+    # timestamp,packet#,length,typetag,... -> the first two fields must be numbers and the typetag two characters
+    rows = np.flatnonzero(complete)
+    c = separators[first[rows][:, None] + np.arange(4)] if len(rows) else np.empty((0, 4), dtype=np.int64)
+    timestamps, ok_time = _parse_number_fields(buf, line_starts[rows], c[:, 0])
+    packets, ok_packet = _parse_number_fields(buf, c[:, 0] + 1, c[:, 1], width=10)
+    ok = ok_time & ok_packet & (c[:, 3] - c[:, 2] == 3)
+    timestamps, packets = timestamps[ok], packets[ok].astype(np.int64)
+    qc["packets"] += len(packets)
+    qc["malformed_lines"] += int((~blank).sum()) - len(packets)
+    if not len(packets):
+        return
+   
+    if carry["packet"] is not None:
+        timestamps = np.concatenate(([carry["timestamp"]], timestamps))
+        packets = np.concatenate(([carry["packet"]], packets))
+    else:
+        qc["first_timestamp"] = float(timestamps[0])
+    carry["timestamp"], carry["packet"] = float(timestamps[-1]), int(packets[-1])
+    qc["last_timestamp"] = carry["timestamp"]
+   
+    steps = np.diff(packets) % PACKET_NUMBER_MODULUS
+    forward = (steps > 1) & (steps < PACKET_NUMBER_MODULUS // 2)
+    qc["packet_gaps"] += int(forward.sum())
+    qc["missing_packets"] += int((steps[forward] - 1).sum())
+    qc["duplicate_packets"] += int((steps == 0).sum())
+    qc["out_of_order_packets"] += int((steps >= PACKET_NUMBER_MODULUS // 2).sum())
+    qc["timestamp_reversals"] += int((np.diff(timestamps) < 0).sum())
+
+
+
+
+def check_raw_file(csv_path, block_bytes=PREFLIGHT_BLOCK_BYTES):
+    """Pre-flight check of a raw CSV: packet continuity, timestamp order, malformed rows and truncation (CPU bound, ~100 MB/s)"""
+    _require_numpy("Pre-flight checks")
+    qc = dict.fromkeys(("lines", "packets", "malformed_lines", "packet_gaps", "missing_packets", "duplicate_packets",
+                        "out_of_order_packets", "timestamp_reversals"), 0)
+    qc.update(file=os.path.basename(csv_path), size=os.path.getsize(csv_path), first_timestamp=None,
+              last_timestamp=None, truncated_final_line=False)
+    carry = {"timestamp": None, "packet": None}
+    # Hashed on the way, so the link archive modes need not read the file again for its .sha256 sidecar
+    digest = hashlib.sha256()
+   
+    with open(csv_path, "rb") as f:
+        remainder = b""
+        while True:
+            chunk = f.read(block_bytes)
+            if not chunk:
+                break
+            digest.update(chunk)
+            # Only complete lines are checked; the tail is carried into the next block
+            cut = chunk.rfind(b"\n") + 1
+            if cut == 0:
+                remainder += chunk
+                continue
+            _check_raw_block(remainder + chunk[:cut], qc, carry)
+            remainder = chunk[cut:]
+        if remainder.strip():
+            # The recording stopped mid-line (battery, card removed): check what is there
+            qc["truncated_final_line"] = True
+            _check_raw_block(remainder + b"\n", qc, carry)
+    qc["sha256"] = digest.hexdigest()
+   
+    if qc["first_timestamp"] is not None:
+        qc["duration_s"] = round((qc["last_timestamp"] - qc["first_timestamp"]) / 1000.0, 3)
+    problems = [f"{qc[key]} {label}" for key, label in (
+        ("malformed_lines", "malformed lines"), ("missing_packets", "missing packets"),
+        ("duplicate_packets", "duplicate packets"), ("out_of_order_packets", "out-of-order packets"),
+        ("timestamp_reversals", "timestamp reversals")) if qc[key]]
+    if qc["truncated_final_line"]:
+        problems.append("truncated final line")
+    qc["problems"] = problems
+    if not qc["packets"] or qc["malformed_lines"] > PREFLIGHT_MAX_MALFORMED * qc["lines"]:
+        qc["status"] = "bad"
+    else:
+        qc["status"] = "warning" if problems else "ok"
+    return qc
+
+
+
+
+def preflight_raw_files(session, csv_files, json_files, mode="flag", log=print, skip=(), archive_mode="copy"):
+    """Check new raw CSVs before they are copied; with mode="quarantine" bad recordings are moved aside.
+
+    Returns (csv_files, json_files, qc by CSV name) with quarantined recordings removed from the file lists.
+    """
+    if mode == "off" or not csv_files:
+        return csv_files, json_files, {}
+    if np is None:
+        log("WARNING: Skipping pre-flight checks (needs NumPy: pip install numpy)")
+        return csv_files, json_files, {}
+   
+    source_dir = session["source_dir"]
+    results = {}
+    quarantined = set()
+    with _run_log.stage("preflight", session=session_label(session)) as record:
+        for csv_file in csv_files:
+            if csv_file in skip:
+                continue
+            csv_path = os.path.join(source_dir, csv_file)
+            qc = results[csv_file] = check_raw_file(csv_path)
+            record["files"] += 1
+            record["bytes_read"] += qc["size"]
+            if qc["status"] == "ok":
+                continue
+            log(f"WARNING: {csv_file} failed pre-flight checks ({qc['status']}): {', '.join(qc['problems']) or 'no packets'}")
+            if qc["status"] == "bad" and mode == "quarantine":
+                quarantined.add(csv_file[:-4])
+   
+    if quarantined:
+        # Bad recordings are copied aside with their QC result; the source folder is never modified
+        quarantine_folder = os.path.join(session["output_dir"], QUARANTINE_FOLDER)
+        os.makedirs(quarantine_folder, exist_ok=True)
+        for file in csv_files + json_files:
+            prefix = file[:-4] if file.endswith(".csv") else file[:-len("_info.json")]
+            if prefix in quarantined:
+                archive_file(os.path.join(source_dir, file), os.path.join(quarantine_folder, file), archive_mode,
+                             results[file]["sha256"] if file in results else None)
+                log(f"  Quarantined: {file}")
+        for prefix in quarantined:
+            with open(os.path.join(quarantine_folder, prefix + ".qc.json"), "w", encoding="utf-8") as f:
+                json.dump(results[prefix + ".csv"], f, indent=2)
+        csv_files = [file for file in csv_files if file[:-4] not in quarantined]
+        json_files = [file for file in json_files if file[:-len("_info.json")] not in quarantined]
+    return csv_files, json_files, results
+
+
+
+
+def _record_archived(source_path, dest_path, method):
+    """Run log counters for one archived file: read and written unless linked"""
+    read = written = 0
+    if method == "copy" or method in COMPRESSED_SUFFIXES:
+        read = os.path.getsize(source_path)
+        written = os.path.getsize(dest_path + COMPRESSED_SUFFIXES.get(method, ""))
+    _run_log.add(files=1, bytes_read=read, bytes_written=written)
+
+
+
+
+def copy_raw_files(source_dir, raw_folder, csv_files, json_files, log=print, unchanged_files=(), archive_mode="copy",
+                   checksums=None):
+    """Copy original files to Raw folder WITHOUT renaming them (files in unchanged_files are already there)"""
+    checksums = checksums or {}
+    copied_files = []
+   
+    log("Copying raw files to Raw folder (preserving original names)...")
+   
+    for csv_file in csv_files:
+        # Copy CSV file with original name
+        if csv_file in unchanged_files:
+            log(f"  Unchanged: {csv_file}")
+        else:
+            method = archive_file(os.path.join(source_dir, csv_file), os.path.join(raw_folder, csv_file), archive_mode,
+                                  checksums.get(csv_file))
+            log(f"  {ARCHIVE_LABELS[method]}: {csv_file}")
+            _record_archived(os.path.join(source_dir, csv_file), os.path.join(raw_folder, csv_file), method)
+        copied_files.append(os.path.join(raw_folder, csv_file))
+   
+    for json_file in json_files:
+        # Copy JSON file with original name  
+        if json_file in unchanged_files:
+            log(f"  Unchanged: {json_file}")
+            continue
+        method = archive_file(os.path.join(source_dir, json_file), os.path.join(raw_folder, json_file), archive_mode)
+        log(f"  {ARCHIVE_LABELS[method]}: {json_file}")
+        _record_archived(os.path.join(source_dir, json_file), os.path.join(raw_folder, json_file), method)
+   
+    return copied_files
+
+
+
+
+class LabelConflictError(ValueError):
+    """A raw file is already organized under a different participant/EmotiBit/week/day label"""
+
+
+
+
+def recording_folder_name(participant_num, emotibit_num, week_num, day_num, index, count, csv_file):
+    """P#E#_W#D#_REC<index>-<count>_<date> name of a recording folder"""
+    # The date comes from the file name (the first 10 characters are YYYY-MM-DD)
+    return f"P{participant_num}E{emotibit_num}_W{week_num}D{day_num}_REC{index}-{count}_{csv_file[:10]}"
+
+
+
+
+def create_recording_folders(parsed_folder, csv_files, participant_num, emotibit_num, week_num, day_num, log=print,
+                             previous_folders=None, exclude=()):
+    """Create recording folders based on actual number of CSV files found (excluded files are numbered, not created)"""
+    label = (participant_num, emotibit_num, week_num, day_num)
+   
+    # A previous run's folder is only reused for the same P/E/W/D label; check them all before renaming anything
+    reusable = {}
+    for csv_file in csv_files:
+        previous_name = (previous_folders or {}).get(csv_file) if csv_file not in exclude else None
+        if not previous_name or not os.path.isdir(os.path.join(parsed_folder, previous_name)):
+            continue
+        match = RECORDING_FOLDER_PATTERN.match(previous_name)
+        if match and tuple(int(number) for number in match.groups()[:4]) != label:
+            raise LabelConflictError(
+                f"Label conflict: {csv_file} is already organized as {previous_name} in {parsed_folder}, "
+                f"not as P{participant_num}E{emotibit_num}_W{week_num}D{day_num} "
+                f"(move that folder away first if the new label is right)")
+        if match:
+            reusable[csv_file] = previous_name
+   
+    recording_folders = []
+    for i, csv_file in enumerate(csv_files, 1):
+        folder_name = recording_folder_name(participant_num, emotibit_num, week_num, day_num, i, len(csv_files), csv_file)
+        if csv_file in exclude:
+            continue
+       
+        folder_path = os.path.join(parsed_folder, folder_name)
+       
+        # Adding a late file changes REC{i}-{n}, so reuse the folder a previous run created for this CSV
+        previous_name = reusable.get(csv_file)
+        if previous_name and previous_name != folder_name and not os.path.exists(folder_path):
+            os.rename(os.path.join(parsed_folder, previous_name), folder_path)
+            log(f"Renamed recording folder: {previous_name} -> {folder_name}")
+        else:
+            os.makedirs(folder_path, exist_ok=True)
+            log(f"Created recording folder: {folder_name}")
+       
+        recording_folders.append((folder_path, csv_file, folder_name))
+   
+    return recording_folders
+
+
+
+
+def available_memory():
+    """Bytes of RAM currently available to new processes, or None where that cannot be determined"""
+    if sys.platform == "win32":
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [("length", ctypes.c_ulong), ("load", ctypes.c_ulong), ("total_phys", ctypes.c_ulonglong),
+                        ("avail_phys", ctypes.c_ulonglong), ("total_page", ctypes.c_ulonglong),
+                        ("avail_page", ctypes.c_ulonglong), ("total_virtual", ctypes.c_ulonglong),
+                        ("avail_virtual", ctypes.c_ulonglong), ("avail_extended", ctypes.c_ulonglong)]
+        status = MemoryStatus(length=ctypes.sizeof(MemoryStatus))
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.avail_phys
+        return None
+    try:
+        # MemAvailable counts reclaimable page cache, which free pages alone would miss
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+
+
+def classify_parser_exit(returncode):
+    """Failure class of a non-zero parser exit code (POSIX signals, shell 128+N codes, Windows NTSTATUS codes)"""
+    if returncode in (-9, 128 + 9) or returncode & 0xFFFFFFFF == 0xC0000017:
+        # SIGKILL is what the OOM killer sends; 0xC0000017 is STATUS_NO_MEMORY
+        return "out-of-memory"
+    if returncode < 0 or 128 < returncode < 160 or returncode & 0xFFFFFFFF >= 0xC0000000:
+        return "crashed"
+    return "parser-error"
+
+
+
+
+def classify_parser_exception(error):
+    """Failure class of an exception raised while running a parser"""
+    if isinstance(error, (subprocess.TimeoutExpired, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, MemoryError):
+        return "out-of-memory"
+    if isinstance(error, OSError):
+        return "os-error"
+    return "parser-error"
+
+
+
+
+def _run_command(cmd, timeout):
+    """subprocess.run(cmd) that also adds the child's CPU time to the current run log stage.
+
+    cmd is an argument list run without a shell, so a timeout kills the command itself rather than a shell
+    that would leave it running.
+    """
+    if not hasattr(os, "wait4"):
+        # Windows: no per-child resource usage
+        return subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+   
+    # Output goes to temporary files so the child can be reaped with wait4, which reports its CPU time
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr)
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() > deadline:
+                process.kill()
+                process.wait()
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        _run_log.add(subprocess_cpu_s=usage.ru_utime + usage.ru_stime)
+       
+        stdout.seek(0)
+        stderr.seek(0)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout.read().decode(errors="replace"),
+                                           stderr.read().decode(errors="replace"))
+
+
+
+
+def parse_stream_selection(allow=None, deny=None):
+    """Turn --streams / --exclude-streams (comma-separated typetags) into a (keep, drop) selection; None keeps all"""
+    keep = frozenset(tag.strip() for tag in allow.split(",") if tag.strip()) if allow else None
+    drop = frozenset(tag.strip() for tag in deny.split(",") if tag.strip()) if deny else frozenset()
+    for tag in (keep or frozenset()) | drop:
+        if not TYPETAG_PATTERN.match(tag):
+            raise ValueError(f"'{tag}' is not a typetag (two characters, e.g. EA, PG, AX)")
+    if keep is not None:
+        # An allow list already excludes everything else, so the same selection always looks the same
+        keep, drop = keep - drop, frozenset()
+    elif not drop:
+        return None
+    return keep, drop
+
+
+
+
+def stream_selected(typetag, streams):
+    """True if a typetag passes a parse_stream_selection() selection"""
+    if streams is None:
+        return True
+    keep, drop = streams
+    return (keep is None or typetag in keep) and typetag not in drop
+
+
+
+
+def describe_stream_selection(streams):
+    """Short stable text for a selection, e.g. EA+PG-AX (part of the parser version, so a change re-parses)"""
+    if streams is None:
+        return "all"
+    keep, drop = streams
+    return ("+".join(sorted(keep)) if keep is not None else "all") + "".join(f"-{tag}" for tag in sorted(drop))
+
+
+
+
+def drop_unselected_streams(output_folder, csv_file_path, streams, log=print):
+    """Delete the parsed files of deselected streams from a parser's output folder (for parsers that write all of them)"""
+    if streams is None:
+        return 0
+    prefix = os.path.splitext(strip_archive_suffix(os.path.basename(csv_file_path)))[0]
+    group = build_dir_index(output_folder).get(prefix)
+    dropped = 0
+    for file in group["parsed"] if group else []:
+        if not stream_selected(file[len(prefix) + 1:-4], streams):
+            os.remove(os.path.join(output_folder, file))
+            dropped += 1
+    if dropped:
+        log(f"Dropped {dropped} deselected streams")
+    return dropped
+
+
+
+
+def run_parser(parser_exe_path, csv_file_path, output_folder, log=print, streams=None):
+    """Run EmotiBit DataParser.exe on a CSV file with output directory"""
+    if not os.path.exists(parser_exe_path):
+        log(f"ERROR: Parser executable not found at {parser_exe_path}")
+        _run_log.note(failure="missing-parser")
+        return False
+   
+    if is_compressed_archive(csv_file_path):
+        # DataParser only reads plain CSVs, so the archive is expanded next to the output folder for this run
+        try:
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(output_folder)) as temp_folder:
+                return run_parser(parser_exe_path, expand_archive(csv_file_path, temp_folder), output_folder, log, streams)
+        except OSError as e:
+            log(f"✗ Could not expand {os.path.basename(csv_file_path)}: {str(e)}")
+            _run_log.note(failure="os-error")
+            return False
+   
+    csv_filename = os.path.basename(csv_file_path)
+    timeout = _scheduler.timeout(_file_size(csv_file_path))
+    _run_log.note(timeout_s=round(timeout, 1))
+    log(f"Running parser on: {csv_filename}")
+    log(f"Output folder: {output_folder}")
+   
+    try:
+        # Arguments are passed directly, so paths with spaces need no quoting
+        cmd = [parser_exe_path, csv_file_path, "-o", output_folder]
+        result = _run_command(cmd, timeout=timeout)
+       
+        log(f"Return code: {result.returncode}")
+        if result.stdout:
+            log(f"Output: {result.stdout}")
+        if result.stderr:
+            log(f"Errors: {result.stderr}")
+       
+        if result.returncode == 0:
+            log(f"✓ Successfully parsed {csv_filename}")
+            drop_unselected_streams(output_folder, csv_file_path, streams, log)
+            return True
+        else:
+            failure = classify_parser_exit(result.returncode)
+            log(f"✗ Parser failed with return code {result.returncode} ({failure})")
+            _run_log.note(failure=failure)
+            return False
+           
+    except subprocess.TimeoutExpired:
+        log(f"✗ Parser timed out after {timeout:.0f}s")
+        _run_log.note(failure="timeout")
+        return False
+    except Exception as e:
+        failure = classify_parser_exception(e)
+        log(f"Exception running parser ({failure}): {str(e)}")
+        _run_log.note(failure=failure)
+        return False
+
+
+
+
+def _new_parser_state(streams=None):
+    """Parser state carried from one block of raw lines to the next"""
+    return {"first_timestamp": None, "last_timestamp": {}, "packets": 0, "malformed": 0, "streams": streams, "wanted": {}}
+
+
+
+
+def _iter_raw_blocks(csv_file_path, start=0, end=None, block_bytes=RAW_CHUNK_BYTES):
+    """Yield blocks of complete raw lines (bytes) from a byte range of a raw file (range ends must be line starts)"""
+    if is_compressed_archive(csv_file_path):
+        # Compressed archives are read frame by frame (frames always end on a newline)
+        yield from iter_archive_frames(csv_file_path)
+        return
+    with open(csv_file_path, "rb") as raw_file:
+        raw_file.seek(start)
+        position = start
+        while end is None or position < end:
+            lines = raw_file.readlines(block_bytes)
+            if not lines:
+                break
+            if end is not None:
+                # Drop lines that belong to the next range
+                kept, size = 0, 0
+                for line in lines:
+                    if position + size >= end:
+                        break
+                    size += len(line)
+                    kept += 1
+                lines = lines[:kept]
+            block = b"".join(lines)
+            position += len(block)
+            yield block
+
+
+
+
+def _split_raw_file(csv_file_path, n_chunks):
+    """Split a raw file into up to n_chunks byte ranges that start on packet (line) boundaries"""
+    size = os.path.getsize(csv_file_path)
+    starts = [0]
+    with open(csv_file_path, "rb") as raw_file:
+        for k in range(1, n_chunks):
+            raw_file.seek(max(0, size * k // n_chunks - 1))
+            raw_file.readline()
+            position = raw_file.tell()
+            if starts[-1] < position < size:
+                starts.append(position)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+
+
+def _utf8_block(block):
+    """Raw bytes with undecodable sequences replaced, exactly as decoding and re-encoding the text would write them"""
+    try:
+        block.decode("utf-8")
+        return block
+    except UnicodeDecodeError:
+        return block.decode("utf-8", "replace").encode("utf-8")
+
+
+
+
+def _parse_timestamp_fields(buf, starts, ends):
+    """Vectorized float(buf[start:end]) for timestamp fields; returns (values, valid mask)"""
+    # Up to 15 characters the digits fit a double exactly, so one division by a power of ten rounds like float()
+    values, valid = _parse_number_fields(buf, starts, ends, width=15)
+    for k in np.flatnonzero(~valid):
+        # Signs, exponents, spaces and long fields go through float() itself
+        try:
+            values[k] = float(buf[starts[k]:ends[k]].tobytes().decode("utf-8"))
+            valid[k] = True
+        except ValueError:
+            pass
+    return values, valid
+
+
+
+
+def _pack_digits(values, pairs):
+    """Eight zero-padded ASCII digits of each value (< 10**8) packed into a little-endian uint64"""
+    # Two digits at a time from the right; 32-bit floor division is much faster than % in NumPy
+    values = values.astype(np.uint32)
+    packed = np.zeros(len(values), dtype=np.uint64)
+    for shift in (48, 32, 16, 0):
+        quotient = values // 100
+        packed |= pairs[(values - quotient * 100).astype(np.intp)] << np.uint64(shift)
+        values = quotient
+    return packed
+
+
+
+
+def _format_fixed(values, decimals):
+    """Vectorized f"{value:.{decimals}f}," as right-aligned rows of one buffer; returns (buffer, starts, lengths)"""
+    scale = 10 ** decimals
+    # From 2**(bits of scale - 1) on, fraction * scale is exact, so rounding it half-even matches format()
+    exact = (values >= 2.0 ** (scale.bit_length() - 1)) & (values < 1e15)
+    safe = np.where(exact, values, 0.0)
+    whole = np.floor(safe)
+    fraction = np.rint((safe - whole) * scale).astype(np.int64)
+    carry = fraction == scale
+    whole = whole.astype(np.int64) + carry
+    fraction[carry] = 0
+    n_digits = np.searchsorted(10 ** np.arange(1, 16, dtype=np.int64), whole, side="right") + 1
+   
+    others = np.flatnonzero(~exact)
+    texts = [f"{value:.{decimals}f},".encode("ascii") for value in values[others]]
+    width = max([decimals + 18] + [len(text) for text in texts])
+    buffer = np.zeros((len(values), width), dtype=np.uint8)
+   
+    def words(offset):
+        # One unaligned uint64 per row, starting offset bytes into the row
+        return np.ndarray((len(values),), dtype="<u8", buffer=buffer, offset=offset, strides=(width,))
+   
+    # Each row ends with 16 digits of the whole part, then ".<fraction>,"; the digits before the first are cut off
+    # by the row length (decimals <= 7, so the fraction word's first digit is a padding zero that can be dropped)
+    digits = np.arange(100)
+    pairs = ((digits // 10 + 48) | (digits % 10 + 48) << 8).astype(np.uint64)
+    dot = 8 * (6 - decimals)
+    tail = _pack_digits(fraction, pairs) >> np.uint64(8)
+    tail &= ~np.uint64(0xFF << dot)
+    tail |= np.uint64(46 << dot) | np.uint64(44 << 56)
+    words(width - 8)[:] = tail
+    words(width - decimals - 18)[:] = _pack_digits(whole // 100000000, pairs)
+    words(width - decimals - 10)[:] = _pack_digits(whole % 100000000, pairs)
+   
+    lengths = n_digits + decimals + 2
+    for k, text in zip(others, texts):
+        buffer[k, width - len(text):] = np.frombuffer(text, dtype=np.uint8)
+        lengths[k] = len(text)
+    return buffer.ravel(), np.arange(len(values)) * width + width - lengths, lengths
+
+
+
+
+def _gather_segments(buf, starts, lengths, out):
+    """Fill out with buf[start:start + length] for each segment, in order"""
+    ends = np.cumsum(lengths)
+    index = np.repeat(starts - (ends - lengths), lengths)
+    index += np.arange(len(out))
+    # Indices are always in range; mode="wrap" only skips the buffered bounds check that out= costs
+    np.take(buf, index, out=out, mode="wrap")
+
+
+
+
+def _parse_raw_block(block, state, start_epoch, scan_only=False):
+    """Split a block of raw packet lines into output bytes grouped by typetag, one NumPy pass per field"""
+    if np is None:
+        # Without NumPy fall back to parsing line by line
+        lines = block.decode("utf-8", "replace").split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        rows_by_tag = _parse_raw_lines(lines, state, start_epoch, scan_only)
+        return {typetag: "".join(rows).encode("utf-8") for typetag, rows in rows_by_tag.items()}
+   
+    if not block:
+        return {}
+    buf = np.frombuffer(_utf8_block(block), dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == 10)
+    if len(buf) and buf[-1] != 10:
+        line_ends = np.append(line_ends, len(buf))
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1)).astype(np.int64)
+    ends = line_ends.copy()
+    stripped = np.ones(len(ends), dtype=bool)
+    while stripped.any():
+        # rstrip("\r\n"): drop trailing carriage returns
+        stripped = (ends > line_starts) & (buf[np.maximum(ends - 1, 0)] == 13)
+        ends -= stripped
+   
+    # timestamp,packet#,length,typetag,version,reliability[,payload...] -> at least 5 commas
+    commas = np.flatnonzero(buf == 44)
+    first = np.searchsorted(commas, line_starts)
+    n_commas = np.searchsorted(commas, ends) - first
+    rows = np.flatnonzero(n_commas >= 5)
+    c = commas[first[rows][:, None] + np.arange(5)] if len(rows) else np.empty((0, 5), dtype=np.int64)
+    times, valid = _parse_timestamp_fields(buf, line_starts[rows], c[:, 0])
+    tag_chars = np.zeros(256, dtype=bool)
+    tag_chars[[37] + list(range(48, 58)) + list(range(65, 91))] = True
+    tag_start = np.minimum(c[:, 2] + 1, len(buf) - 2)
+    valid &= (c[:, 3] - c[:, 2] == 3) & tag_chars[buf[tag_start]] & tag_chars[buf[tag_start + 1]]
+    state["malformed"] += len(line_starts) - int(valid.sum())
+    rows, c, times = rows[valid], c[valid], times[valid]
+    if not len(rows):
+        return {}
+   
+    if state["first_timestamp"] is None:
+        state["first_timestamp"] = float(times[0])
+    first_timestamp = state["first_timestamp"]
+    state["packets"] += len(rows)
+    codes = buf[c[:, 2] + 1].astype(np.int64) * 256 + buf[c[:, 2] + 2]
+    typetags = {int(code): chr(code // 256) + chr(code % 256)
+                for code in np.flatnonzero(np.bincount(codes, minlength=65536))}
+   
+    # Deselected streams are skipped before any row is built (local times still count from the first packet)
+    streams, wanted = state["streams"], state["wanted"]
+    if streams is not None:
+        for code, typetag in list(typetags.items()):
+            keep = wanted.get(typetag)
+            if keep is None:
+                keep = wanted[typetag] = stream_selected(typetag, streams)
+            if not keep:
+                del typetags[code]
+        keep = np.isin(codes, list(typetags))
+        rows, c, times, codes = rows[keep], c[keep], times[keep], codes[keep]
+        if not len(rows):
+            return {}
+   
+    # Data packets with a payload: spread the samples evenly back to the previous packet of the same stream
+    n_fields = n_commas[rows] + 1
+    is_data = np.isin(codes, [code for code, typetag in typetags.items() if typetag in DATA_TYPETAGS]) & (n_fields > 6)
+    last_timestamps = state["last_timestamp"]
+    steps = np.zeros(len(rows))
+    for code, typetag in typetags.items():
+        packets = np.flatnonzero(is_data & (codes == code))
+        if not len(packets):
+            continue
+        packet_times = times[packets]
+        if not scan_only:
+            previous = np.concatenate(([last_timestamps.get(typetag, np.nan)], packet_times[:-1]))
+            with np.errstate(invalid="ignore", over="ignore"):
+                steps[packets] = np.where(packet_times > previous,
+                                          (packet_times - previous) / (n_fields[packets] - 6), 0.0)
+        last_timestamps[typetag] = float(packet_times[-1])
+    if scan_only:
+        # First pass of a split parse only needs the timestamps carried between chunks
+        return {}
+   
+    # One output row per sample of a data packet, one per other packet, grouped by typetag (file order within each)
+    n_rows = np.where(is_data, n_fields - 6, 1)
+    row_packet = np.repeat(np.arange(len(rows)), n_rows)
+    sample = np.arange(len(row_packet)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+    order = np.argsort(codes[row_packet], kind="stable")
+    row_packet, sample = row_packet[order], sample[order]
+    row_data = is_data[row_packet]
+    with np.errstate(invalid="ignore", over="ignore"):
+        sample_times = times[row_packet] - np.where(row_data, steps[row_packet] * (n_rows[row_packet] - 1 - sample), 0.0)
+        local_times = start_epoch + (sample_times - first_timestamp) / 1000.0
+    local_text, local_starts, local_lengths = _format_fixed(local_times, 6)
+    data_rows = np.flatnonzero(row_data)
+    sample_text, sample_starts, sample_lengths = _format_fixed(sample_times[data_rows], 3)
+   
+    # Rows are spliced from the raw line and the formatted numbers:
+    # data    -> local, sample time, "packet#,length,typetag,version,reliability" "," value "\n"
+    # others  -> local, (nothing), whole raw line, (nothing), (nothing), "\n"
+    local_offset = len(buf)
+    sample_offset = local_offset + len(local_text)
+    const_offset = sample_offset + len(sample_text)
+    combined = np.concatenate((buf, local_text, sample_text, np.frombuffer(b",\n", dtype=np.uint8)))
+    row_lines = rows[row_packet]
+    seg_starts = np.zeros((len(row_packet), 6), dtype=np.int64)
+    seg_lengths = np.zeros((len(row_packet), 6), dtype=np.int64)
+    seg_starts[:, 0], seg_lengths[:, 0] = local_starts + local_offset, local_lengths
+    seg_starts[data_rows, 1], seg_lengths[data_rows, 1] = sample_starts + sample_offset, sample_lengths
+    seg_starts[:, 2] = np.where(row_data, c[row_packet, 0] + 1, line_starts[row_lines])
+    field_5_end = commas[np.minimum(first[row_lines] + 5, len(commas) - 1)]
+    seg_lengths[:, 2] = np.where(row_data, field_5_end, ends[row_lines]) - seg_starts[:, 2]
+    seg_starts[data_rows, 3], seg_lengths[data_rows, 3] = const_offset, 1
+    value_index = first[row_lines[data_rows]] + 5 + sample[data_rows]
+    value_starts = commas[value_index] + 1
+    last_value = 6 + sample[data_rows] >= n_commas[row_lines[data_rows]]
+    value_ends = np.where(last_value, ends[row_lines[data_rows]], commas[np.minimum(value_index + 1, len(commas) - 1)])
+    seg_starts[data_rows, 4], seg_lengths[data_rows, 4] = value_starts, value_ends - value_starts
+    seg_starts[:, 5], seg_lengths[:, 5] = const_offset + 1, 1
+   
+    row_bytes = seg_lengths.sum(axis=1)
+    row_ends = np.cumsum(row_bytes)
+    output = np.empty(int(row_ends[-1]), dtype=np.uint8)
+    for k in range(0, len(row_bytes), GATHER_ROWS):
+        part = slice(k, k + GATHER_ROWS)
+        _gather_segments(combined, seg_starts[part].ravel(), seg_lengths[part].ravel(),
+                         output[row_ends[k] - row_bytes[k]:row_ends[part][-1]])
+   
+    # Each typetag's rows are one slice of the output
+    row_codes = codes[row_packet]
+    rows_by_tag = {}
+    for code, typetag in sorted(typetags.items()):
+        first_row, end_row = np.searchsorted(row_codes, [code, code + 1])
+        if end_row > first_row:
+            rows_by_tag[typetag] = output[row_ends[first_row] - row_bytes[first_row]:row_ends[end_row - 1]].tobytes()
+    return rows_by_tag
+
+
+
+
+def _parse_raw_lines(lines, state, start_epoch, scan_only=False):
+    """Split a chunk of raw packet lines into output rows grouped by typetag (line by line, without NumPy)"""
+    rows_by_tag = {}
+    last_timestamps = state["last_timestamp"]
+    streams, wanted = state["streams"], state["wanted"]
+   
+    for line in lines:
+        fields = line.rstrip("\r\n").split(",")
+        if len(fields) < 6:
+            state["malformed"] += 1
+            continue
+       
+        timestamp, packet_number, data_length, typetag, version, reliability = fields[:6]
+        payload = fields[6:]
+        try:
+            emotibit_time = float(timestamp)
+        except ValueError:
+            state["malformed"] += 1
+            continue
+        if not TYPETAG_PATTERN.match(typetag):
+            state["malformed"] += 1
+            continue
+       
+        if state["first_timestamp"] is None:
+            state["first_timestamp"] = emotibit_time
+        first_timestamp = state["first_timestamp"]
+        state["packets"] += 1
+       
+        # Deselected streams are skipped before any row is built (local times still count from the first packet)
+        if streams is not None:
+            keep = wanted.get(typetag)
+            if keep is None:
+                keep = wanted[typetag] = stream_selected(typetag, streams)
+            if not keep:
+                continue
+       
+        if scan_only:
+            # First pass of a split parse only needs the timestamps carried between chunks
+            if typetag in DATA_TYPETAGS and payload:
+                last_timestamps[typetag] = emotibit_time
+            continue
+       
+        rows = rows_by_tag.get(typetag)
+        if rows is None:
+            rows = rows_by_tag[typetag] = []
+       
+        if typetag in DATA_TYPETAGS and payload:
+            # Spread the samples of a packet evenly back to the previous packet of the same stream
+            previous_time = last_timestamps.get(typetag)
+            n_samples = len(payload)
+            step = (emotibit_time - previous_time) / n_samples if previous_time is not None and emotibit_time > previous_time else 0.0
+            suffix = f",{packet_number},{data_length},{typetag},{version},{reliability},"
+            for i, value in enumerate(payload):
+                sample_time = emotibit_time - step * (n_samples - 1 - i)
+                local_time = start_epoch + (sample_time - first_timestamp) / 1000.0
+                rows.append(f"{local_time:.6f},{sample_time:.3f}{suffix}{value}\n")
+            last_timestamps[typetag] = emotibit_time
+        else:
+            local_time = start_epoch + (emotibit_time - first_timestamp) / 1000.0
+            rows.append(f"{local_time:.6f},{timestamp},{packet_number},{data_length},{typetag},{version},{reliability}"
+                        + "".join("," + value for value in payload) + "\n")
+   
+    return rows_by_tag
+
+
+
+
+def _parsed_header(typetag):
+    """Header line of a parsed <timestamp>_<TAG>.csv file"""
+    return PARSED_HEADER + (f",{typetag}" if typetag in DATA_TYPETAGS else "") + "\n"
+
+
+
+
+def _write_rows(writers, rows_by_tag, path_prefix, header=True):
+    """Append each typetag's rows (bytes) to its output file, opening each file on first use"""
+    for typetag, rows in rows_by_tag.items():
+        writer = writers.get(typetag)
+        if writer is None:
+            writer = writers[typetag] = open(f"{path_prefix}_{typetag}.csv", "wb")
+            if header:
+                writer.write(_parsed_header(typetag).encode("utf-8"))
+        writer.write(rows)
+
+
+
+
+def _scan_raw_range(csv_file_path, start, end):
+    """Split parse, pass 1: find the first packet time and each stream's last packet time in a byte range"""
+    state = _new_parser_state()
+    for block in _iter_raw_blocks(csv_file_path, start, end):
+        _parse_raw_block(block, state, 0.0, scan_only=True)
+    return state["first_timestamp"], state["last_timestamp"]
+
+
+
+
+def _parse_raw_range(csv_file_path, start, end, state, start_epoch, part_prefix):
+    """Split parse, pass 2: write one byte range's rows to headerless per-typetag part files"""
+    writers = {}
+    try:
+        for block in _iter_raw_blocks(csv_file_path, start, end):
+            _write_rows(writers, _parse_raw_block(block, state, start_epoch), part_prefix, header=False)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return sorted(writers), state["packets"], state["malformed"]
+
+
+
+
+def _parse_raw_file_split(csv_file_path, output_folder, base_name, start_epoch, split_workers, streams=None):
+    """Parse byte ranges of one raw file in parallel and stitch the parts into the same files a serial parse writes"""
+    ranges = _split_raw_file(csv_file_path, split_workers)
+    parts_dir = os.path.join(output_folder, f".{base_name}.parts")
+    os.makedirs(parts_dir, exist_ok=True)
+   
+    try:
+        with ProcessPoolExecutor(max_workers=min(split_workers, len(ranges))) as pool:
+            scans = list(pool.map(_scan_raw_range, [csv_file_path] * len(ranges),
+                                  [start for start, _ in ranges], [end for _, end in ranges]))
+           
+            # Each chunk starts from the state a serial parse would have reached at its first line
+            first_timestamp = next((first for first, _ in scans if first is not None), None)
+            carried = {}
+            futures = []
+            for k, ((start, end), (_, last_timestamps)) in enumerate(zip(ranges, scans)):
+                state = _new_parser_state(streams)
+                state["first_timestamp"] = first_timestamp
+                state["last_timestamp"] = dict(carried)
+                futures.append(pool.submit(_parse_raw_range, csv_file_path, start, end, state, start_epoch,
+                                           os.path.join(parts_dir, str(k))))
+                carried.update(last_timestamps)
+            parts = [future.result() for future in futures]
+       
+        # Stitch the parts back together in time order
+        typetags = sorted(set(typetag for part_typetags, _, _ in parts for typetag in part_typetags))
+        for typetag in typetags:
+            with open(os.path.join(output_folder, f"{base_name}_{typetag}.csv"), "wb") as out:
+                out.write(_parsed_header(typetag).encode("utf-8"))
+                for k, (part_typetags, _, _) in enumerate(parts):
+                    if typetag in part_typetags:
+                        with open(os.path.join(parts_dir, f"{k}_{typetag}.csv"), "rb") as part:
+                            shutil.copyfileobj(part, out, COPY_BUFFER_BYTES)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+   
+    return typetags, sum(packets for _, packets, _ in parts), sum(malformed for _, _, malformed in parts)
+
+
+
+
+def parse_raw_file(csv_file_path, output_folder, log=print, chunk_bytes=RAW_CHUNK_BYTES, split_workers=1,
+                   split_min_bytes=SPLIT_MIN_BYTES, streams=None):
+    """Built-in parser: split a raw EmotiBit CSV into per-typetag <timestamp>_<TAG>.csv files (only the selected streams)"""
+    csv_filename = os.path.basename(csv_file_path)
+    base_name = os.path.splitext(strip_archive_suffix(csv_filename))[0]
+    log(f"Running built-in parser on: {csv_filename}")
+    log(f"Output folder: {output_folder}")
+   
+    try:
+        # Local timestamps are anchored on the recording start time in the file name
+        start_epoch = datetime.strptime(base_name, "%Y-%m-%d_%H-%M-%S-%f").timestamp()
+    except ValueError:
+        log(f"✗ Cannot read the recording start time from {csv_filename}")
+        return False
+   
+    try:
+        if split_workers > 1 and os.path.getsize(csv_file_path) >= split_min_bytes \
+                and not is_compressed_archive(csv_file_path):
+            # Long recordings: parse chunks in parallel processes, output is identical to the serial parse
+            log(f"Splitting {csv_filename} across {split_workers} processes")
+            typetags, packets, malformed = _parse_raw_file_split(csv_file_path, output_folder, base_name,
+                                                                 start_epoch, split_workers, streams)
+        else:
+            state = _new_parser_state(streams)
+            writers = {}
+            try:
+                # Read and write in large chunks so memory stays bounded on multi-GB recordings
+                for block in _iter_raw_blocks(csv_file_path, block_bytes=chunk_bytes):
+                    _write_rows(writers, _parse_raw_block(block, state, start_epoch),
+                                os.path.join(output_folder, base_name))
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            typetags, packets, malformed = sorted(writers), state["packets"], state["malformed"]
+    except Exception as e:
+        failure = classify_parser_exception(e)
+        log(f"Exception running built-in parser ({failure}): {str(e)}")
+        _run_log.note(failure=failure)
+        return False
+   
+    if malformed:
+        log(f"Skipped {malformed} malformed lines")
+    log(f"✓ Successfully parsed {csv_filename} ({packets} packets, {len(typetags)} typetags)")
+    return True
+
+
+
+
+def get_parser(backend, parser_exe_path, split_workers=1, streams=None):
+    """Return a parse function (csv_file_path, output_folder, log) for the selected backend"""
+    if backend == "builtin":
+        return partial(parse_raw_file, split_workers=split_workers, streams=streams)
+    if split_workers > 1:
+        print("WARNING: --split-workers only applies to the built-in parser, ignoring it")
+    return partial(run_parser, parser_exe_path, streams=streams)
+
+
+
+
+def get_parser_version(backend, parser_exe_path, streams=None):
+    """Identify the parser build (and stream selection) so that changing either triggers a re-parse"""
+    # The default keeps the versions recorded before stream selection existed valid
+    suffix = f";streams={describe_stream_selection(streams)}" if streams is not None else ""
+    if backend == "builtin":
+        return f"builtin:{BUILTIN_PARSER_VERSION}{suffix}"
+    try:
+        stat = os.stat(parser_exe_path)
+    except OSError:
+        return f"exe:missing{suffix}"
+    return f"exe:{stat.st_size}:{stat.st_mtime_ns}{suffix}"
+
+
+
+
+def _exchange_paths(path_a, path_b):
+    """Atomically swap two paths with renameat2(RENAME_EXCHANGE); returns False where that is not supported"""
+    global _renameat2
+    if _renameat2 is None:
+        libc_name = ctypes.util.find_library("c") if sys.platform.startswith("linux") else None
+        _renameat2 = getattr(ctypes.CDLL(libc_name, use_errno=True), "renameat2", False) if libc_name else False
+    if not _renameat2:
+        return False
+    return _renameat2(AT_FDCWD, os.fsencode(path_a), AT_FDCWD, os.fsencode(path_b), RENAME_EXCHANGE) == 0
+
+
+
+
+def _is_recording_output(name, prefix):
+    """True for files a parse and its post-parse stages (re)create in a recording folder"""
+    return name.startswith(prefix + "_") or name.startswith(QC_SUMMARY_NAME + ".")
+
+
+
+
+def stage_recording(recording_folder):
+    """Create an empty Parsed/.staging/<folder> for a recording's parse, on the same filesystem as its folder"""
+    parsed_folder, folder_name = os.path.split(os.path.abspath(recording_folder))
+    staging_folder = os.path.join(parsed_folder, STAGING_FOLDER, folder_name)
+   
+    # Leftovers of an interrupted run are never committed, just cleared
+    for path in (staging_folder, staging_folder + ".old"):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    try:
+        os.makedirs(staging_folder)
+    except FileNotFoundError:
+        # Another session sharing this Parsed folder removed the empty .staging in between
+        os.makedirs(staging_folder)
+   
+    # The pre-flight result is read by the QC stage, which runs before the commit
+    raw_qc_path = os.path.join(recording_folder, RAW_QC_NAME)
+    if os.path.exists(raw_qc_path):
+        try:
+            os.link(raw_qc_path, os.path.join(staging_folder, RAW_QC_NAME))
+        except OSError:
+            shutil.copy2(raw_qc_path, os.path.join(staging_folder, RAW_QC_NAME))
+    return staging_folder
+
+
+
+
+def commit_recording(staging_folder, recording_folder, expected_csv_name):
+    """Swap a fully staged recording into place; files of the old folder that a parse does not produce are kept"""
+    if not os.path.exists(recording_folder):
+        os.rename(staging_folder, recording_folder)
+        return
+   
+    if _exchange_paths(staging_folder, recording_folder):
+        # The staging folder now holds the previous contents
+        old_folder = staging_folder
+    else:
+        # Without an atomic swap a crash in between leaves no recording folder, which the next run re-creates and re-parses
+        old_folder = staging_folder + ".old"
+        os.rename(recording_folder, old_folder)
+        os.rename(staging_folder, recording_folder)
+   
+    prefix = os.path.splitext(expected_csv_name)[0]
+    with os.scandir(old_folder) as entries:
+        for entry in entries:
+            dest_path = os.path.join(recording_folder, entry.name)
+            if not _is_recording_output(entry.name, prefix) and not os.path.exists(dest_path):
+                os.rename(entry.path, dest_path)
+    shutil.rmtree(old_folder)
+
+
+
+
+def remove_staging_folder(parsed_folder):
+    """Remove Parsed/.staging once no recording is staged in it; returns True if it is gone"""
+    try:
+        os.rmdir(os.path.join(parsed_folder, STAGING_FOLDER))
+    except FileNotFoundError:
+        return True
+    except OSError:
+        # Not empty: a recording of another session is still being parsed
+        return False
+    return True
+
+
+
+
+def organize_parsed_files(output_folder, expected_csv_name, log=print):
+    """List the parsed datastream files the parser wrote for a recording into its (staging) folder"""
+    prefix = os.path.splitext(expected_csv_name)[0]
+    group = build_dir_index(output_folder).get(prefix)
+    parsed_files = sorted(group["parsed"]) if group else []
+   
+    if parsed_files:
+        log(f"Found {len(parsed_files)} parsed datastream files: {[file[len(prefix) + 1:-4] for file in parsed_files]}")
+    else:
+        log("No parsed datastream files found")
+       
+        # Debug (-v): List the output folder to see what the parser actually created
+        if _run_log.verbosity >= VERBOSITY_DEBUG and os.path.exists(output_folder):
+            log("DEBUG: All files in parser output folder:")
+            for file in sorted(os.listdir(output_folder)):
+                log(f"  {file}")
+   
+    return parsed_files
+
+
+
+
+def _require_numpy(feature):
+    """Fail with a clear message when an optional stage needs NumPy"""
+    if np is None:
+        raise RuntimeError(f"{feature} needs NumPy (pip install numpy)")
+
+
+
+
+def _count_csv_rows(csv_path):
+    """Count the data rows of a CSV without parsing it"""
+    newlines = 0
+    last_byte = b"\n"
+    with open(csv_path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_BUFFER_BYTES)
+            if not chunk:
+                break
+            newlines += chunk.count(b"\n")
+            last_byte = chunk[-1:]
+    lines = newlines + (0 if last_byte == b"\n" else 1)
+    return max(0, lines - 1)
+
+
+
+
+def convert_stream_to_npy(csv_path, npy_path):
+    """Convert a parsed data stream CSV into a column-major float64 .npy plus a JSON schema; returns the row count"""
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+   
+    # TypeTag is constant within a file, so it lives in the schema instead of the array
+    usecols = [i for i, column in enumerate(header) if column != "TypeTag"]
+    columns = [header[i] for i in usecols]
+    rows = _count_csv_rows(csv_path)
+   
+    # Fortran order keeps every column contiguous, so np.load(..., mmap_mode="r")[:, j] is a cheap slice
+    temp_path = npy_path + ".tmp"
+    array = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float64, shape=(rows, len(columns)), fortran_order=True)
+    filled = 0
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        f.readline()
+        while True:
+            lines = f.readlines(RAW_CHUNK_BYTES)
+            if not lines:
+                break
+            block = np.loadtxt(lines, delimiter=",", usecols=usecols, dtype=np.float64, ndmin=2, comments=None)
+            array[filled:filled + len(block)] = block
+            filled += len(block)
+    array.flush()
+   
+    if filled != rows:
+        # Blank lines were skipped; shrink to the rows that were actually read
+        trimmed = np.lib.format.open_memmap(temp_path + "2", mode="w+", dtype=np.float64, shape=(filled, len(columns)), fortran_order=True)
+        trimmed[:] = array[:filled]
+        trimmed.flush()
+        del trimmed
+        del array
+        os.replace(temp_path + "2", temp_path)
+    else:
+        del array
+    os.replace(temp_path, npy_path)
+   
+    schema = {
+        "source": os.path.basename(csv_path),
+        "typetag": header[-1],
+        "rows": filled,
+        "columns": columns,
+        "dtype": "float64",
+        "order": "F",
+    }
+    with open(os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+    return filled
+
+
+
+
+def convert_stream_to_parquet(csv_path, parquet_path):
+    """Stream a parsed data stream CSV into a Parquet file (needs pyarrow); returns the row count"""
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+   
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    column_types = {column: pa.float64() for column in header if column != "TypeTag"}
+    column_types["TypeTag"] = pa.string()
+    for column in ("PacketNumber", "DataLength", "ProtocolVersion", "DataReliability"):
+        if column in column_types:
+            column_types[column] = pa.int64()
+   
+    rows = 0
+    temp_path = parquet_path + ".tmp"
+    reader = pa_csv.open_csv(csv_path, read_options=pa_csv.ReadOptions(block_size=RAW_CHUNK_BYTES),
+                             convert_options=pa_csv.ConvertOptions(column_types=column_types))
+    with pq.ParquetWriter(temp_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    os.replace(temp_path, parquet_path)
+    return rows
+
+
+
+
+def load_stream_array(npy_path, mmap=True):
+    """Open a columnar .npy stream (memory-mapped by default); returns (array, column names)"""
+    _require_numpy("Loading columnar streams")
+    with open(os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX, "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    return np.load(npy_path, mmap_mode="r" if mmap else None), schema["columns"]
+
+
+
+
+def convert_recording_to_columnar(recording_folder, parsed_files, log=print, formats=("npy",)):
+    """Post-parse stage: write typed columnar copies of every numeric data stream in a recording folder"""
+    if "npy" in formats:
+        _require_numpy("Columnar .npy output")
+    written = []
+   
+    for file in sorted(parsed_files):
+        csv_path = os.path.join(recording_folder, file)
+        typetag = file[:-4].rsplit("_", 1)[-1]
+       
+        # Marker, time-sync and other text streams have no single numeric value column
+        if typetag not in DATA_TYPETAGS:
+            continue
+        base_path = csv_path[:-4]
+        try:
+            if "npy" in formats:
+                rows = convert_stream_to_npy(csv_path, base_path + ".npy")
+                written.append(os.path.basename(base_path) + ".npy")
+                _count_stage_files([csv_path], [base_path + ".npy", base_path + SCHEMA_SUFFIX])
+            if "parquet" in formats:
+                rows = convert_stream_to_parquet(csv_path, base_path + ".parquet")
+                written.append(os.path.basename(base_path) + ".parquet")
+                _count_stage_files([csv_path], [base_path + ".parquet"])
+        except Exception as e:
+            log(f"WARNING: Could not convert {file}: {str(e)}")
+            continue
+        log(f"  Converted {typetag}: {rows} rows")
+   
+    return written
+
+
+
+
+def _typical_interval(times):
+    """Typical sample interval of a stream from its first block of timestamps (None for a single sample)"""
+    # Averaged over QC_RATE_WINDOW samples because the parser spreads each packet's samples evenly back to
+    # the previous packet, so neighbouring intervals alternate
+    window = min(QC_RATE_WINDOW, len(times) - 1)
+    if window <= 0:
+        return None
+    return float(np.median((times[window:] - times[:-window]) / window))
+
+
+
+
+def _drop_empty_packets(lines, columns):
+    """Rows of a parsed block that carry a value; returns (rows, number of rows without one)"""
+    kept = [line for line in lines if line.count(",") == columns - 1 and not line.rstrip("\r\n").endswith(",")]
+    return kept, len(lines) - len(kept)
+
+
+
+
+def summarize_stream(csv_path, block_bytes=RAW_CHUNK_BYTES):
+    """QC metrics of one parsed <timestamp>_<TAG>.csv in a single streaming pass"""
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    stream = os.path.basename(csv_path)[:-4].rsplit("_", 1)[-1]
+    numeric = stream in DATA_TYPETAGS and len(header) > len(PARSED_HEADER.split(","))
+    usecols = (0, len(header) - 1) if numeric else (0,)
+   
+    samples = gaps = empty = 0
+    start = end = expected = None
+    dropout = max_gap = 0.0
+    minimum, maximum, mean, m2 = np.inf, -np.inf, 0.0, 0.0
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        f.readline()
+        while True:
+            lines = f.readlines(block_bytes)
+            if not lines:
+                break
+            try:
+                block = np.loadtxt(lines, delimiter=",", usecols=usecols, dtype=np.float64, ndmin=2, comments=None)
+            except ValueError:
+                if not numeric:
+                    raise
+                # Packets with a header but no payload (normal after a dropout) are counted, not read as samples
+                lines, dropped = _drop_empty_packets(lines, len(header))
+                empty += dropped
+                if not lines:
+                    continue
+                block = np.loadtxt(lines, delimiter=",", usecols=usecols, dtype=np.float64, ndmin=2, comments=None)
+            times = block[:, 0]
+            if start is None:
+                start = times[0]
+                expected = _typical_interval(times)
+            else:
+                times = np.concatenate(([end], times))
+            end = times[-1]
+            if expected:
+                intervals = np.diff(times)
+                long = intervals[intervals > QC_GAP_FACTOR * expected]
+                gaps += len(long)
+                dropout += float((long - expected).sum())
+                max_gap = max(max_gap, float(intervals.max(initial=0.0)))
+           
+            if numeric:
+                # Combine block statistics (Chan et al.) so large-valued streams like PPG keep their precision
+                values = block[:, 1]
+                n = len(values)
+                block_mean = float(values.mean())
+                block_m2 = float(((values - block_mean) ** 2).sum())
+                delta = block_mean - mean
+                total = samples + n
+                mean += delta * n / total
+                m2 += block_m2 + delta * delta * samples * n / total
+                minimum = min(minimum, float(values.min()))
+                maximum = max(maximum, float(values.max()))
+            samples += len(block)
+   
+    duration = float(end - start) if samples else 0.0
+    summary = {
+        "stream": stream,
+        "samples": samples,
+        "empty_packets": empty,
+        "duration_s": round(duration, 3),
+        "effective_rate_hz": round((samples - 1) / duration, 3) if duration > 0 else None,
+        "expected_rate_hz": round(1.0 / expected, 3) if expected else None,
+        "gaps": gaps,
+        "dropout_pct": round(100.0 * dropout / duration, 3) if duration > 0 else None,
+        "max_gap_s": round(max_gap, 3),
+        "start": start, "end": end,
+    }
+    if numeric and samples:
+        summary.update(min=minimum, max=maximum, mean=mean, std=(m2 / samples) ** 0.5)
+    return summary
+
+
+
+
+def _write_qc_files(base_path, summary, rows):
+    """Write <base>.json and a flat <base>.csv of QC rows, each replaced atomically"""
+    with open(base_path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(base_path + ".json.tmp", base_path + ".json")
+    with open(base_path + ".csv.tmp", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else QC_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(base_path + ".csv.tmp", base_path + ".csv")
+
+
+
+
+def summarize_recording(recording_folder, parsed_files, log=print):
+    """Post-parse stage: write qc_summary.json/.csv with per-stream QC metrics for a recording folder"""
+    _require_numpy("QC summaries")
+    streams = []
+    for file in sorted(parsed_files):
+        try:
+            streams.append(summarize_stream(os.path.join(recording_folder, file)))
+        except Exception as e:
+            log(f"WARNING: Could not summarize {file}: {str(e)}")
+            continue
+        stream = streams[-1]
+        if stream["dropout_pct"]:
+            log(f"  {stream['stream']}: {stream['samples']} samples, {stream['dropout_pct']}% dropout")
+   
+    summary = {"recording": os.path.basename(recording_folder), "generated": datetime.now().isoformat(),
+               "streams": streams}
+    # Include the pre-flight check of the raw file, when there is one
+    raw_qc_path = os.path.join(recording_folder, RAW_QC_NAME)
+    if os.path.exists(raw_qc_path):
+        with open(raw_qc_path, "r", encoding="utf-8") as f:
+            summary["raw"] = json.load(f)
+    qc_path = os.path.join(recording_folder, QC_SUMMARY_NAME)
+    _write_qc_files(qc_path, summary, [{field: stream.get(field) for field in QC_FIELDS} for stream in streams])
+    _count_stage_files([os.path.join(recording_folder, file) for file in parsed_files] + [raw_qc_path],
+                       [qc_path + ".json", qc_path + ".csv"])
+    log(f"  QC summary: {len(streams)} streams")
+    return summary
+
+
+
+
+def relabel_qc_summary(existing_folder, recording_folder, staging_folder):
+    """Write a linked recording's qc_summary into its staging folder: same stream metrics, its own name and raw QC"""
+    existing_path = os.path.join(existing_folder, QC_SUMMARY_NAME + ".json")
+    if not os.path.exists(existing_path):
+        return None
+    with open(existing_path, "r", encoding="utf-8") as f:
+        summary = json.load(f)
+    summary["recording"] = os.path.basename(os.path.abspath(recording_folder))
+    summary["generated"] = datetime.now().isoformat()
+    summary.pop("raw", None)
+    raw_qc_path = os.path.join(recording_folder, RAW_QC_NAME)
+    if os.path.exists(raw_qc_path):
+        with open(raw_qc_path, "r", encoding="utf-8") as f:
+            summary["raw"] = json.load(f)
+    streams = summary.get("streams") or []
+    _write_qc_files(os.path.join(staging_folder, QC_SUMMARY_NAME), summary,
+                    [{field: stream.get(field) for field in QC_FIELDS} for stream in streams])
+    return summary
+
+
+
+
+def write_qc_rollup(parsed_folder):
+    """Collect every recording's qc_summary.json into Parsed/qc_summary.json/.csv; returns the recording count"""
+    recordings = {}
+    with os.scandir(parsed_folder) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            path = os.path.join(entry.path, QC_SUMMARY_NAME + ".json")
+            if entry.is_dir() and os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    recordings[entry.name] = json.load(f)
+    if not recordings:
+        return 0
+   
+    rows = [{"recording": name, **{field: stream.get(field) for field in QC_FIELDS}}
+            for name, summary in recordings.items() for stream in summary["streams"]]
+    with _qc_rollup_lock:
+        _write_qc_files(os.path.join(parsed_folder, QC_SUMMARY_NAME),
+                        {"generated": datetime.now().isoformat(), "recordings": recordings}, rows)
+    return len(recordings)
+
+
+
+
+def _read_time_range(csv_path):
+    """First and last LocalTimestamp of a parsed stream, read from its first and last lines only"""
+    with open(csv_path, "rb") as f:
+        f.readline()
+        first_line = f.readline()
+        if not first_line.strip():
+            return None
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 4096))
+        last_line = f.read().rstrip(b"\r\n").rsplit(b"\n", 1)[-1]
+    return float(first_line.split(b",", 1)[0]), float(last_line.split(b",", 1)[0])
+
+
+
+
+def _interpolate_stream(csv_path, column, start, rate, block_bytes=RAW_CHUNK_BYTES):
+    """Linearly interpolate a stream's values onto start + k / rate, block by block, into an output column.
+
+    Grid points further than QC_GAP_FACTOR typical intervals from a real sample (dropouts) stay NaN.
+    """
+    previous = None
+    limit = None
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+        while True:
+            lines = f.readlines(block_bytes)
+            if not lines:
+                break
+            block = np.loadtxt(lines, delimiter=",", usecols=(0, len(header) - 1), dtype=np.float64, ndmin=2,
+                               comments=None)
+            block = block[np.argsort(block[:, 0], kind="stable")]
+            if previous is not None:
+                # Carry the last sample over so the grid points between two blocks are covered
+                block = np.concatenate((previous, block))
+            elif len(block) > 1:
+                limit = QC_GAP_FACTOR * (_typical_interval(block[:, 0]) or 0.0)
+            previous = block[-1:]
+            times, values = block[:, 0], block[:, 1]
+           
+            first = max(0, int(np.ceil((times[0] - start) * rate)))
+            last = min(len(column) - 1, int(np.floor((times[-1] - start) * rate)))
+            if last < first:
+                continue
+            grid = start + np.arange(first, last + 1) / rate
+            interpolated = np.interp(grid, times, values)
+            if limit:
+                right = np.clip(np.searchsorted(times, grid), 1, len(times) - 1)
+                interpolated[times[right] - times[right - 1] > limit] = np.nan
+            column[first:last + 1] = interpolated
+
+
+
+
+def align_recording(recording_folder, parsed_files, log=print, rate=25.0, streams=None):
+    """Post-parse stage: resample the numeric streams onto one timebase and write <timestamp>_aligned_<rate>Hz.npy
+
+    The output is a column-major float64 .npy (LocalTimestamp, then one column per stream, NaN where a stream has
+    no data) with a .schema.json, so load_stream_array() memory-maps it.
+    """
+    _require_numpy("Stream alignment")
+    sources = {}
+    for file in sorted(parsed_files):
+        match = PARSED_CSV_PATTERN.match(file)
+        typetag = match.group(2) if match else None
+        if typetag in DATA_TYPETAGS and (streams is None or typetag in streams):
+            time_range = _read_time_range(os.path.join(recording_folder, file))
+            if time_range:
+                sources[typetag] = (file, time_range)
+    if not sources:
+        log("  No numeric streams to align")
+        return None
+   
+    # The grid covers every stream; each stream is NaN outside its own range
+    start = min(first for _, (first, _) in sources.values())
+    end = max(last for _, (_, last) in sources.values())
+    rows = int(np.floor((end - start) * rate)) + 1
+    columns = ["LocalTimestamp"] + list(sources)
+   
+    prefix = PARSED_CSV_PATTERN.match(next(iter(sources.values()))[0]).group(1)
+    npy_path = os.path.join(recording_folder, f"{prefix}{ALIGNED_SUFFIX}_{rate:g}Hz.npy")
+    temp_path = npy_path + ".tmp"
+    array = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float64, shape=(rows, len(columns)), fortran_order=True)
+    array[:, 0] = start + np.arange(rows) / rate
+    for j, (typetag, (file, _)) in enumerate(sources.items(), start=1):
+        # Column-major, so each stream fills one contiguous column of the file
+        array[:, j] = np.nan
+        _interpolate_stream(os.path.join(recording_folder, file), array[:, j], start, rate)
+    array.flush()
+    del array
+    os.replace(temp_path, npy_path)
+   
+    schema = {
+        "source": sorted(file for file, _ in sources.values()),
+        "rate_hz": rate,
+        "start": start,
+        "rows": rows,
+        "columns": columns,
+        "dtype": "float64",
+        "order": "F",
+    }
+    with open(os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+    _count_stage_files([os.path.join(recording_folder, file) for file, _ in sources.values()],
+                       [npy_path, os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX])
+    log(f"  Aligned {len(sources)} streams at {rate:g} Hz: {rows} rows -> {os.path.basename(npy_path)}")
+    return npy_path
+
+
+
+
+def _decimate_block(times, values, factor):
+    """Min/max/mean of every `factor` consecutive samples; rows of (first LocalTimestamp, min, max, mean)"""
+    buckets = len(values) // factor
+    if len(values) > buckets * factor:
+        # A trailing partial bucket only happens at the end of the stream
+        buckets += 1
+        pad = buckets * factor - len(values)
+        times = np.concatenate((times, np.full(pad, np.nan)))
+        values = np.concatenate((values, np.full(pad, np.nan)))
+    times, values = times.reshape(buckets, factor), values.reshape(buckets, factor)
+    return np.column_stack((np.nanmin(times, axis=1), np.nanmin(values, axis=1), np.nanmax(values, axis=1),
+                            np.nanmean(values, axis=1)))
+
+
+
+
+def build_stream_pyramid(csv_path, npy_path, factors=PYRAMID_FACTORS, block_bytes=RAW_CHUNK_BYTES):
+    """Write the min/max/mean decimation levels of one parsed stream into a single .npy with a .schema.json.
+
+    Every level is built from the samples in the same streaming pass; the levels are stacked in the file,
+    finest first, and the schema records each level's factor and row range. Returns the number of samples.
+    """
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    usecols = (0, len(header) - 1)
+   
+    levels = {factor: [] for factor in factors}
+    carry = {factor: np.empty((0, 2)) for factor in factors}
+    samples = 0
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        f.readline()
+        while True:
+            lines = f.readlines(block_bytes)
+            if not lines:
+                break
+            block = np.loadtxt(lines, delimiter=",", usecols=usecols, dtype=np.float64, ndmin=2, comments=None)
+            samples += len(block)
+            for factor in factors:
+                # Samples that do not fill a whole bucket wait for the next block
+                pending = np.concatenate((carry[factor], block))
+                whole = len(pending) // factor * factor
+                if whole:
+                    levels[factor].append(_decimate_block(pending[:whole, 0], pending[:whole, 1], factor))
+                carry[factor] = pending[whole:]
+    for factor in factors:
+        if len(carry[factor]):
+            levels[factor].append(_decimate_block(carry[factor][:, 0], carry[factor][:, 1], factor))
+    if not samples:
+        return 0
+   
+    levels = {factor: np.concatenate(parts) for factor, parts in levels.items()}
+    rows = sum(len(level) for level in levels.values())
+    temp_path = npy_path + ".tmp"
+    array = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.float64, shape=(rows, len(PYRAMID_COLUMNS)),
+                                      fortran_order=True)
+    schema_levels = []
+    offset = 0
+    for factor, level in levels.items():
+        array[offset:offset + len(level)] = level
+        schema_levels.append({"factor": factor, "offset": offset, "rows": len(level)})
+        offset += len(level)
+    array.flush()
+    del array
+    os.replace(temp_path, npy_path)
+   
+    schema = {
+        "source": os.path.basename(csv_path),
+        "samples": samples,
+        "levels": schema_levels,
+        "columns": list(PYRAMID_COLUMNS),
+        "dtype": "float64",
+        "order": "F",
+    }
+    with open(os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+    return samples
+
+
+
+
+def build_pyramids(recording_folder, parsed_files, log=print, factors=PYRAMID_FACTORS):
+    """Post-parse stage: write a <timestamp>_<TAG>_pyramid.npy decimation pyramid for every numeric data stream"""
+    _require_numpy("Decimation pyramids")
+    written = []
+    for file in sorted(parsed_files):
+        match = PARSED_CSV_PATTERN.match(file)
+        if not match or match.group(2) not in DATA_TYPETAGS:
+            continue
+        npy_path = os.path.join(recording_folder, f"{match.group(1)}_{match.group(2)}{PYRAMID_SUFFIX}.npy")
+        samples = build_stream_pyramid(os.path.join(recording_folder, file), npy_path, factors)
+        if samples:
+            written.append(os.path.basename(npy_path))
+            _count_stage_files([os.path.join(recording_folder, file)],
+                               [npy_path, os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX])
+    log(f"  Built decimation pyramids (x{', x'.join(map(str, factors))}) for {len(written)} streams")
+    return written
+
+
+
+
+def load_pyramid(npy_path):
+    """Open a stream's decimation pyramid memory-mapped; returns (array, schema)"""
+    _require_numpy("Loading decimation pyramids")
+    with open(os.path.splitext(npy_path)[0] + SCHEMA_SUFFIX, "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    return np.load(npy_path, mmap_mode="r"), schema
+
+
+
+
+def query_pyramid(npy_path, start=None, end=None, width=1000):
+    """Pick the pyramid level to plot start..end (epoch seconds) at `width` pixels; returns (factor, rows).
+
+    The coarsest level that still has at least `width` buckets in the range is used, so every pixel column
+    gets a min/max pair. When even the finest level is too coarse, its rows are returned and the range is
+    short enough to plot the raw samples instead (fewer than width * factor of them).
+    """
+    array, schema = load_pyramid(npy_path)
+    chosen = None
+    for level in sorted(schema["levels"], key=lambda level: level["factor"], reverse=True):
+        rows = array[level["offset"]:level["offset"] + level["rows"]]
+        times = rows[:, 0]
+        first = np.searchsorted(times, start, side="right") - 1 if start is not None else 0
+        last = np.searchsorted(times, end, side="right") if end is not None else len(times)
+        chosen = level["factor"], rows[max(0, first):last]
+        if last - max(0, first) >= width:
+            break
+    return chosen
+
+
+
+
+def get_post_parse_stages(args):
+    """Build the list of (name, stage function) steps that run after organize_parsed_files"""
+    stages = []
+    if args.columnar:
+        formats = ("npy", "parquet") if args.columnar == "both" else (args.columnar,)
+        stages.append((f"columnar-{args.columnar}", partial(convert_recording_to_columnar, formats=formats)))
+    if args.align:
+        streams = set(args.align_streams.split(",")) if args.align_streams else None
+        name = f"aligned-{args.align:g}Hz" + (f"-{'+'.join(sorted(streams))}" if streams else "")
+        stages.append((name, partial(align_recording, rate=args.align, streams=streams)))
+    if args.pyramid:
+        stages.append((f"pyramid-{'-'.join(map(str, args.pyramid))}", partial(build_pyramids, factors=args.pyramid)))
+    if args.qc:
+        stages.append(("qc", summarize_recording))
+    return stages
+
+
+
+
+def _file_size(path):
+    """Size of a file (the original size for a compressed raw archive), 0 if it is missing"""
+    try:
+        if is_compressed_archive(path):
+            return load_archive_index(path)["size"]
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+
+
+def _folder_usage(folder):
+    """Number and total size of the files directly inside a folder (one scandir, for the run log)"""
+    try:
+        with os.scandir(folder) as entries:
+            sizes = [entry.stat().st_size for entry in entries if entry.is_file()]
+    except OSError:
+        return 0, 0
+    return len(sizes), sum(sizes)
+
+
+
+
+def _count_stage_files(read_paths, written_paths):
+    """Add the files a post-parse stage read and wrote to its run log counters (missing files count as nothing)"""
+    written_paths = [path for path in written_paths if os.path.exists(path)]
+    _run_log.add(files=len(written_paths), bytes_read=sum(_file_size(path) for path in read_paths),
+                 bytes_written=sum(_file_size(path) for path in written_paths))
+
+
+
+
+def organize_recording(success, recording_folder, staging_folder, original_csv_name, log=print, post_parse=()):
+    """After a parse: run the post-parse stages on the staged output and commit it; returns (success, parsed files)"""
+    parsed_files = []
+    folder_name = os.path.basename(recording_folder)
+    if success:
+        with _run_log.stage("organize", recording=folder_name) as record:
+            parsed_files = organize_parsed_files(staging_folder, original_csv_name, log=log)
+            record["files"] = len(parsed_files)
+       
+        # Optional post-parse stages (columnar copies, ...) also write into the staging folder
+        for stage_name, stage in post_parse if parsed_files else ():
+            log(f"Running post-parse stage: {stage_name}")
+            try:
+                with _run_log.stage(stage_name, recording=folder_name):
+                    stage(staging_folder, parsed_files, log=log)
+            except Exception as e:
+                log(f"✗ Post-parse stage {stage_name} failed: {str(e)}")
+                success = False
+       
+        if parsed_files:
+            try:
+                with _run_log.stage("commit", recording=folder_name):
+                    commit_recording(staging_folder, recording_folder, original_csv_name)
+                log(f"Successfully processed {original_csv_name} - committed {len(parsed_files)} parsed files")
+            except OSError as e:
+                log(f"✗ Could not commit {folder_name}: {str(e)}")
+                success = False
+        else:
+            log(f"Parser ran successfully for {original_csv_name}, but no parsed files were written")
+    else:
+        log(f"Failed to process {original_csv_name}")
+   
+    # A failed parse leaves the previous recording folder untouched
+    if staging_folder and os.path.exists(staging_folder):
+        shutil.rmtree(staging_folder, ignore_errors=True)
+    return success, parsed_files
+
+
+
+
+def parse_with_retries(parse_func, csv_path, recording_folder, folder_name, log=print):
+    """Parse a recording into a fresh staging folder once its memory estimate fits, retrying transient failures.
+
+    Returns (success, staging folder or None, failure class or None, attempts).
+    """
+    need, waited = _scheduler.acquire(_file_size(csv_path))
+    try:
+        attempt = 0
+        while True:
+            attempt += 1
+            # Every attempt starts from an empty staging folder, so a retry never sees partial output
+            try:
+                staging_folder = stage_recording(recording_folder)
+            except OSError as e:
+                log(f"✗ Could not create a staging folder for {folder_name}: {str(e)}")
+                return False, None, "os-error", attempt
+            with _run_log.stage("parse", recording=folder_name, attempt=attempt) as record:
+                if attempt == 1:
+                    record["memory_wait_s"] = round(waited, 3)
+                # The staging folder may already hold the pre-flight result, which is not parser output
+                staged_files, staged_bytes = _folder_usage(staging_folder)
+                success = parse_func(csv_path, staging_folder, log=log)
+                files, written = _folder_usage(staging_folder)
+                record.update(ok=success, bytes_read=_file_size(csv_path), bytes_written=written - staged_bytes,
+                              files=files - staged_files)
+                if not success:
+                    record["failure"] = record.get("failure") or "parser-error"
+            if success:
+                return True, staging_folder, None, attempt
+            if not _scheduler.should_retry(record["failure"], attempt):
+                return False, staging_folder, record["failure"], attempt
+            delay = _scheduler.backoff(attempt)
+            log(f"Retrying {folder_name} in {delay:g}s after {record['failure']} "
+                f"(attempt {attempt + 1}/{_scheduler.retries + 1})")
+            time.sleep(delay)
+    finally:
+        _scheduler.release(need)
+
+
+
+
+def process_recording(parse_func, recording_folder, copied_csv_path, original_csv_name, folder_name, post_parse=()):
+    """Parse and organize a single recording, buffering its output so it can be printed in order"""
+    lines = []
+    log = lines.append
+    start_time = time.perf_counter()
+   
+    log(f"\n{'='*50}")
+    log(f"Processing: {folder_name}")
+    log(f"{'='*50}")
+   
+    # Run parser with output going to a staging folder that is committed once complete
+    success, staging_folder, failure, attempts = parse_with_retries(parse_func, copied_csv_path, recording_folder,
+                                                                    folder_name, log)
+    parsed, parsed_files = success, []
+    if staging_folder:
+        success, parsed_files = organize_recording(success, recording_folder, staging_folder, original_csv_name, log,
+                                                   post_parse)
+    if parsed and not success:
+        failure = "organize"
+   
+    return {
+        "folder_name": folder_name,
+        "csv_file": original_csv_name,
+        "success": success,
+        "skipped": False,
+        "failure": failure,
+        "attempts": attempts,
+        "parsed_files": parsed_files,
+        "stages": [stage_name for stage_name, _ in post_parse],
+        "elapsed": time.perf_counter() - start_time,
+        "log": lines,
+    }
+
+
+
+
+def submit_recordings(executor, parse_func, recording_folders, copied_csv_files, post_parse=()):
+    """Queue one parse job per recording folder on an executor"""
+    return [
+        executor.submit(process_recording, parse_func, recording_folder, copied_csv_path,
+                        original_csv_name, folder_name, post_parse)
+        for (recording_folder, original_csv_name, folder_name), copied_csv_path
+        in zip(recording_folders, copied_csv_files)
+    ]
+
+
+
+
+def collect_results(futures):
+    """Wait for parse jobs in submission order, printing each job's output as it completes"""
+    results = []
+    for future in futures:
+        result = future.result()
+        for line in result["log"]:
+            _run_log.echo(line)
+        results.append(result)
+    return results
+
+
+
+
+class BuiltinParsePool:
+    """Worker processes for the built-in parser that are replaced when one of them is killed (e.g. out of memory)"""
+   
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._lock = threading.Lock()
+   
+    def _replace(self, executor):
+        """Swap a broken executor for a fresh one (once, however many of its jobs noticed)"""
+        with self._lock:
+            if self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+   
+    def _worker_died(self, executor, csv_file_path):
+        self._replace(executor)
+        # A killed worker breaks the whole pool, so jobs running beside it fail too; all of them can be retried
+        lines = [f"✗ Built-in parser worker died while parsing {os.path.basename(csv_file_path)} "
+                 f"(killed, most likely out of memory)"]
+        return False, lines, 0.0, "out-of-memory"
+   
+    def parse(self, csv_file_path, output_folder, split_workers, streams=None):
+        """_parse_in_subprocess() in a worker; a dead worker is reported as an out-of-memory failure"""
+        executor = self.executor
+        try:
+            return executor.submit(_parse_in_subprocess, csv_file_path, output_folder, split_workers, streams).result()
+        except BrokenProcessPool:
+            return self._worker_died(executor, csv_file_path)
+   
+    async def parse_async(self, csv_file_path, output_folder, split_workers, streams=None):
+        """Same as parse(), awaited from the pipeline's event loop"""
+        executor = self.executor
+        try:
+            return await asyncio.wrap_future(executor.submit(_parse_in_subprocess, csv_file_path, output_folder,
+                                                             split_workers, streams))
+        except BrokenProcessPool:
+            return self._worker_died(executor, csv_file_path)
+   
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+
+
+def builtin_parse_pool(parse_func, max_workers):
+    """Process pool for the built-in parser (pure Python, so threads would share one core); None for the exe"""
+    if getattr(parse_func, "func", None) is not parse_raw_file:
+        return None
+    return BuiltinParsePool(max_workers)
+
+
+
+
+def pooled_parser(parse_func, pool):
+    """Parse function that runs the built-in parser in a worker process and replays its log and failure class"""
+    if pool is None:
+        return parse_func
+    split_workers = parse_func.keywords.get("split_workers", 1)
+    streams = parse_func.keywords.get("streams")
+   
+    def parse(csv_file_path, output_folder, log=print):
+        success, lines, cpu, failure = pool.parse(csv_file_path, output_folder, split_workers, streams)
+        for line in lines:
+            log(line)
+        _run_log.note(subprocess_cpu_s=cpu)
+        if failure:
+            _run_log.note(failure=failure)
+        return success
+   
+    return parse
+
+
+
+
+def run_recordings(parse_func, recording_folders, copied_csv_files, max_workers=1, post_parse=()):
+    """Run the parser on every recording using a bounded worker pool, printing results in recording order"""
+    max_workers = max(1, min(max_workers, len(recording_folders) or 1))
+   
+    # Threads drive the jobs (retries, organizing); an exe job is its own process, a built-in one runs in process_pool
+    process_pool = builtin_parse_pool(parse_func, max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = submit_recordings(executor, pooled_parser(parse_func, process_pool), recording_folders,
+                                        copied_csv_files, post_parse)
+            return collect_results(futures)
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+
+
+
+
+def session_label(session):
+    """Short P#E#_W#D# name for a session"""
+    return f"P{session['participant']}E{session['emotibit']}_W{session['week']}D{session['day']}"
+
+
+
+
+def load_manifest(manifest_path):
+    """Read batch sessions from a CSV, JSON or YAML manifest"""
+    extension = os.path.splitext(manifest_path)[1].lower()
+   
+    with open(manifest_path, "r", encoding="utf-8", newline="") as f:
+        if extension == ".csv":
+            entries = list(csv.DictReader(f))
+        elif extension == ".json":
+            entries = json.load(f)
+        elif extension in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("YAML manifests need PyYAML (pip install pyyaml)")
+            entries = yaml.safe_load(f)
+        else:
+            raise ValueError(f"Unsupported manifest type '{extension}' (use .csv, .json or .yaml)")
+   
+    # JSON/YAML manifests may wrap the list as {"sessions": [...]}
+    if isinstance(entries, dict):
+        entries = entries.get("sessions", [])
+   
+    # Relative paths are taken relative to the manifest, not the current directory
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    sessions = []
+    for row_num, entry in enumerate(entries, 1):
+        session = {}
+        for field, names in MANIFEST_FIELDS.items():
+            value = next((entry[name] for name in names if entry.get(name) not in (None, "")), None)
+            if value is None:
+                raise ValueError(f"Manifest entry {row_num} is missing '{field}'")
+            if field.endswith("_dir"):
+                session[field] = os.path.join(manifest_dir, os.path.expanduser(str(value).strip()))
+            else:
+                try:
+                    session[field] = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Manifest entry {row_num}: '{field}' must be a number, got {value!r}")
+        sessions.append(session)
+   
+    return sessions
+
+
+
+
+def fast_file_hash(path, size):
+    """Hash the size plus the first and last MiB of a file, which is enough to spot a changed recording"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(FAST_HASH_BYTES))
+        if size > FAST_HASH_BYTES:
+            f.seek(max(FAST_HASH_BYTES, size - FAST_HASH_BYTES))
+            digest.update(f.read(FAST_HASH_BYTES))
+    return digest.hexdigest()
+
+
+
+
+def file_fingerprint(path, previous=None):
+    """Size, mtime and fast hash of a file; the previous hash is reused when size and mtime match"""
+    stat = os.stat(path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": fast_file_hash(path, stat.st_size)}
+
+
+
+
+def load_processing_manifest(output_dir):
+    """Load the record of files and recordings already processed into output_dir"""
+    manifest_path = os.path.join(output_dir, PROCESSING_MANIFEST_NAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Ignoring unreadable {manifest_path}: {str(e)}")
+        manifest = {}
+    manifest.setdefault("files", {})
+    manifest.setdefault("recordings", {})
+    return manifest
+
+
+
+
+def update_processing_manifest(output_dir, files, recordings):
+    """Merge new file fingerprints and recording entries into the output directory's manifest"""
+    manifest_path = os.path.join(output_dir, PROCESSING_MANIFEST_NAME)
+   
+    # Several batch sessions can share an output directory, so merge under a lock and replace atomically
+    with _processing_manifest_lock:
+        manifest = load_processing_manifest(output_dir)
+        manifest["files"].update(files)
+        manifest["recordings"].update(recordings)
+        temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, manifest_path)
+
+
+
+
+def is_recording_unchanged(entry, csv_fingerprint, json_fingerprint, parser_version, recording_folder, stages=()):
+    """Check a manifest entry against the current raw files, parser, post-parse stages and parsed outputs"""
+    if not entry or entry.get("parser") != parser_version:
+        return False
+    if not set(stages) <= set(entry.get("stages") or []):
+        return False
+    if (entry.get("csv") or {}).get("hash") != csv_fingerprint["hash"]:
+        return False
+    if (entry.get("json") or {}).get("hash") != (json_fingerprint or {}).get("hash"):
+        return False
+    parsed_files = entry.get("parsed_files") or []
+    return bool(parsed_files) and all(os.path.exists(os.path.join(recording_folder, file)) for file in parsed_files)
+
+
+
+
+def open_catalog(catalog_path):
+    """Open the SQLite catalog of processed recordings, creating its tables and indexes if needed"""
+    connection = sqlite3.connect(catalog_path, timeout=CATALOG_TIMEOUT)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.executescript(CATALOG_SCHEMA)
+    return connection
+
+
+
+
+def _catalog_streams(recording_folder, parsed_files):
+    """Row count, size and time range of each parsed stream of a recording"""
+    samples = {}
+    qc_path = os.path.join(recording_folder, QC_SUMMARY_NAME + ".json")
+    if os.path.exists(qc_path):
+        # The QC stage already counted every stream's samples
+        with open(qc_path, "r", encoding="utf-8") as f:
+            samples = {stream["stream"]: stream["samples"] for stream in json.load(f).get("streams", [])}
+   
+    streams = []
+    for file in sorted(parsed_files):
+        match = PARSED_CSV_PATTERN.match(file)
+        path = os.path.join(recording_folder, file)
+        if not match or not os.path.exists(path):
+            continue
+        stream = match.group(2)
+        try:
+            start, end = _read_time_range(path) or (None, None)
+        except (OSError, ValueError):
+            start = end = None
+        rows = samples.get(stream)
+        streams.append({"stream": stream, "file": file, "rows": _count_csv_rows(path) if rows is None else rows,
+                        "bytes": os.path.getsize(path), "start_time": start, "end_time": end})
+    return streams
+
+
+
+
+def update_catalog(catalog_path, session, prepared, results, parser_version):
+    """Upsert a catalog row, with its streams, for every recording of a finished session; returns the row count"""
+    output_dir = os.path.abspath(session["output_dir"])
+    raw_folder = prepared["raw_folder"]
+    folders = {csv_file: recording_folder for recording_folder, csv_file, _ in prepared["all_recording_folders"]}
+    updated = datetime.now().isoformat()
+   
+    connection = open_catalog(catalog_path)
+    try:
+        known = {row["csv_file"] for row in connection.execute(
+            "SELECT csv_file FROM recordings WHERE output_dir = ? AND status = 'ok'", (output_dir,))}
+       
+        # Read the parsed files before writing, so the catalog's write lock is only held briefly
+        entries = []
+        # Recordings that failed pre-flight checks and were quarantined are catalogued too
+        for result in results:
+            csv_file = result["csv_file"]
+            folder_name = result["folder_name"]
+            match = RECORDING_FOLDER_PATTERN.match(folder_name or "")
+            entry = {
+                "folder_name": folder_name,
+                "rec_index": int(match.group(5)) if match else None,
+                "rec_count": int(match.group(6)) if match else None,
+                "recording_folder": folders.get(csv_file),
+            }
+            if result["skipped"] and csv_file in known:
+                # Unchanged since it was catalogued: only its REC numbering can have moved
+                entries.append((csv_file, entry, None))
+                continue
+           
+            if result.get("quarantined"):
+                status, raw_path = "quarantined", os.path.join(session["output_dir"], QUARANTINE_FOLDER, csv_file)
+            else:
+                status, raw_path = "ok" if result["success"] else "failed", os.path.join(raw_folder, csv_file)
+                for suffix in COMPRESSED_SUFFIXES.values():
+                    if not os.path.exists(raw_path) and os.path.exists(raw_path + suffix):
+                        raw_path += suffix
+            streams = _catalog_streams(entry["recording_folder"], result["parsed_files"]) if entry["recording_folder"] else []
+            starts = [stream["start_time"] for stream in streams if stream["start_time"] is not None]
+            ends = [stream["end_time"] for stream in streams if stream["end_time"] is not None]
+            try:
+                start_time = datetime.strptime(csv_file[:-4], "%Y-%m-%d_%H-%M-%S-%f").timestamp()
+            except ValueError:
+                start_time = None
+            start_time = min(starts) if starts else start_time
+            end_time = max(ends) if ends else None
+            entry.update({
+                "output_dir": output_dir,
+                "csv_file": csv_file,
+                "participant": session["participant"],
+                "emotibit": session["emotibit"],
+                "week": session["week"],
+                "day": session["day"],
+                "date": csv_file[:10],
+                "source_path": os.path.abspath(os.path.join(session["source_dir"], csv_file)),
+                "raw_path": os.path.abspath(raw_path),
+                "recording_folder": os.path.abspath(entry["recording_folder"]) if entry["recording_folder"] else None,
+                "start_time": start_time,
+                "end_time": end_time,
+                "duration_s": round(end_time - start_time, 3) if start_time is not None and end_time is not None else None,
+                "raw_bytes": archived_size(raw_folder, csv_file) if status != "quarantined" else _file_size(raw_path),
+                "parsed_bytes": sum(stream["bytes"] for stream in streams),
+                "status": status,
+                "parser": parser_version,
+                "stages": json.dumps(result["stages"]),
+                "updated": updated,
+            })
+            entries.append((csv_file, entry, streams))
+       
+        with connection:
+            for csv_file, entry, streams in entries:
+                if streams is None:
+                    connection.execute("UPDATE recordings SET folder_name = ?, rec_index = ?, rec_count = ?, "
+                                       "recording_folder = ? WHERE output_dir = ? AND csv_file = ?",
+                                       (entry["folder_name"], entry["rec_index"], entry["rec_count"],
+                                        os.path.abspath(entry["recording_folder"]), output_dir, csv_file))
+                    continue
+                columns = list(entry)
+                connection.execute(
+                    f"INSERT INTO recordings ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT (output_dir, csv_file) DO UPDATE SET "
+                    + ", ".join(f"{column} = excluded.{column}" for column in columns),
+                    [entry[column] for column in columns])
+                recording_id = connection.execute("SELECT id FROM recordings WHERE output_dir = ? AND csv_file = ?",
+                                                  (output_dir, csv_file)).fetchone()["id"]
+                connection.execute("DELETE FROM streams WHERE recording_id = ?", (recording_id,))
+                connection.executemany(
+                    "INSERT INTO streams (recording_id, stream, file, rows, bytes, start_time, end_time) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(recording_id, stream["stream"], stream["file"], stream["rows"], stream["bytes"],
+                      stream["start_time"], stream["end_time"]) for stream in streams])
+    finally:
+        connection.close()
+    return len(entries)
+
+
+
+
+def query_catalog(catalog_path, **filters):
+    """Recordings in the catalog matching every filter, in P/E/W/D/REC order, as dicts with a "streams" list.
+
+    Filters are the CATALOG_FILTERS fields; each takes a value or a list of alternatives, except stream,
+    where a recording must have every listed stream.
+    """
+    if not os.path.exists(catalog_path):
+        raise FileNotFoundError(f"No catalog at {catalog_path}")
+   
+    conditions, params = [], []
+    for field, value in filters.items():
+        if field not in CATALOG_FILTERS:
+            raise ValueError(f"Unknown catalog filter '{field}' (use {', '.join(CATALOG_FILTERS)})")
+        if value is None:
+            continue
+        values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+        if field == "stream":
+            # One indexed (recording_id, stream) lookup per required stream
+            for stream in values:
+                conditions.append("EXISTS (SELECT 1 FROM streams s WHERE s.recording_id = r.id AND s.stream = ?)")
+                params.append(stream)
+        else:
+            conditions.append(f"r.{field} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+   
+    sql = ("SELECT r.*, (SELECT group_concat(s.stream) FROM streams s WHERE s.recording_id = r.id) AS streams "
+           "FROM recordings r")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY r.participant, r.emotibit, r.week, r.day, r.rec_index, r.csv_file"
+   
+    connection = open_catalog(catalog_path)
+    try:
+        rows = [dict(row) for row in connection.execute(sql, params)]
+    finally:
+        connection.close()
+    for row in rows:
+        row["streams"] = sorted(row["streams"].split(",")) if row["streams"] else []
+        row["stages"] = json.loads(row["stages"]) if row["stages"] else []
+    return rows
+
+
+
+
+def parse_catalog_filters(terms):
+    """Turn command line terms like W=3 stream=PG,EA into query_catalog() keyword arguments"""
+    aliases = {name.lower(): field for field, names in CATALOG_FILTERS.items() for name in names}
+    filters = {}
+    for term in terms:
+        name, separator, value = term.partition("=")
+        field = aliases.get(name.strip().lower())
+        if not separator or field is None:
+            raise ValueError(f"Bad catalog filter '{term}' (use e.g. P=3 W=1,2 stream=PG)")
+        values = [value.strip() for value in value.split(",") if value.strip()]
+        if field in ("participant", "emotibit", "week", "day"):
+            try:
+                values = [int(value) for value in values]
+            except ValueError:
+                raise ValueError(f"Catalog filter '{name}' must be a number, got {value!r}")
+        filters.setdefault(field, []).extend(values)
+    return filters
+
+
+
+
+def print_catalog_rows(rows, output_format="table"):
+    """Print query_catalog() results as a table, CSV or JSON"""
+    if output_format == "json":
+        print(json.dumps(rows, indent=2))
+    elif output_format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=CATALOG_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows({**row, "streams": " ".join(row["streams"])} for row in rows)
+    else:
+        print(f"{'recording':<38}{'status':<13}{'minutes':>8}{'raw MB':>9}  streams")
+        for row in rows:
+            minutes = f"{row['duration_s'] / 60:.1f}" if row["duration_s"] is not None else "-"
+            print(f"{row['folder_name'] or row['csv_file']:<38}{row['status']:<13}{minutes:>8}"
+                  f"{(row['raw_bytes'] or 0) / 1e6:>9.1f}  {' '.join(row['streams'])}")
+        print(f"{len(rows)} recordings")
+
+
+
+
+def open_dedup_store(store_path):
+    """Open the fingerprint store of archived raw files, creating its table and index if needed"""
+    connection = sqlite3.connect(store_path, timeout=CATALOG_TIMEOUT)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(DEDUP_SCHEMA)
+    return connection
+
+
+
+
+def archived_sha256(raw_folder, file):
+    """SHA-256 of a raw file's original content, as recorded when it was archived in Raw, or None"""
+    path = os.path.join(raw_folder, file)
+    try:
+        with open(path + CHECKSUM_SUFFIX, "r", encoding="utf-8") as f:
+            return f.read().split()[0]
+    except (OSError, IndexError):
+        pass
+    if os.path.isfile(path):
+        # Linked without a pre-flight checksum: the sidecar is written now, on first use
+        checksum = file_sha256(path)
+        write_checksum_sidecar(path, checksum)
+        return checksum
+    # A compressed archive's sidecar covers the compressed bytes; its index has the original content's hash
+    for suffix in COMPRESSED_SUFFIXES.values():
+        if os.path.exists(path + suffix + ARCHIVE_INDEX_SUFFIX):
+            return load_archive_index(path + suffix)["sha256"]
+    return None
+
+
+
+
+def find_duplicate(connection, session, csv_file, fingerprint, json_fingerprint, parser_version, stages=(), log=print,
+                   sha256_cache=None):
+    """Look up an identical raw file already parsed into another output directory with the same parser and stages.
+
+    Size and fast hash select the candidates; only then is the full SHA-256 compared. Returns a dict with the
+    existing recording's folder, parsed files and stages, or None. When this output directory stored the file
+    under another P/E/W/D label, the dict has that label and no folder, and the recording is parsed again.
+    """
+    output_dir = os.path.abspath(session["output_dir"])
+    previous = connection.execute("SELECT * FROM raw_files WHERE output_dir = ? AND csv_file = ?",
+                                  (output_dir, csv_file)).fetchone()
+    if previous is not None and (previous["participant"], previous["emotibit"], previous["week"], previous["day"]) \
+            != (session["participant"], session["emotibit"], session["week"], session["day"]):
+        # Relabelled since the last run (its old folder was moved away): its outputs elsewhere are not trusted either
+        return {
+            "output_dir": output_dir,
+            "folder": None,
+            "label": f"P{previous['participant']}E{previous['emotibit']}_W{previous['week']}D{previous['day']}",
+            "parsed_files": [],
+            "stages": [],
+        }
    
-    # Return ALL files, not just first 2
-    return csv_files, json_files
+    candidates = connection.execute(
+        "SELECT * FROM raw_files WHERE size = ? AND fast_hash = ? AND NOT (output_dir = ? AND csv_file = ?)",
+        (fingerprint["size"], fingerprint["hash"], output_dir, csv_file)).fetchall()
+    sha256_cache = {} if sha256_cache is None else sha256_cache
+    for candidate in candidates:
+        if candidate["csv_file"] != csv_file:
+            # Parsed file names carry the raw file's name, so a renamed copy cannot reuse them
+            log(f"WARNING: {csv_file} has the same content as {candidate['csv_file']} in {candidate['output_dir']}")
+            continue
+       
+        # The earlier outputs must still be there and match this run's parser, stages and _info.json
+        entry = load_processing_manifest(candidate["output_dir"])["recordings"].get(csv_file)
+        if not entry:
+            continue
+        folder = os.path.join(candidate["output_dir"], "Parsed", entry["folder_name"])
+        if not is_recording_unchanged(entry, fingerprint, json_fingerprint, parser_version, folder, stages):
+            continue
+       
+        # Same size and fast hash: compare the whole content before trusting the match
+        existing_sha256 = candidate["sha256"] or archived_sha256(os.path.join(candidate["output_dir"], "Raw"), csv_file)
+        if existing_sha256 is None:
+            continue
+        if csv_file not in sha256_cache:
+            sha256_cache[csv_file] = file_sha256(os.path.join(session["source_dir"], csv_file))
+        if sha256_cache[csv_file] != existing_sha256:
+            continue
+       
+        label = f"P{candidate['participant']}E{candidate['emotibit']}_W{candidate['week']}D{candidate['day']}"
+        return {
+            "output_dir": candidate["output_dir"],
+            "folder": folder,
+            "label": label,
+            "parsed_files": entry["parsed_files"],
+            "stages": entry.get("stages") or [],
+        }
+    return None
 
 
 
 
-def setup_folders(output_dir):
-    """Create Raw and Parsed folders if they don't exist"""
-    raw_folder = os.path.join(output_dir, "Raw")
-    parsed_folder = os.path.join(output_dir, "Parsed")
-    os.makedirs(raw_folder, exist_ok=True)
-    os.makedirs(parsed_folder, exist_ok=True)
-    return raw_folder, parsed_folder
+def link_archived_raw(existing_raw_folder, raw_folder, file, archive_mode="copy"):
+    """Hardlink an identical raw file already archived in another Raw folder; False if the mode or filesystem rules it out"""
+    # With --archive-mode copy (or reflink) every Raw folder keeps its own independent copy
+    if "hardlink" not in ARCHIVE_METHODS[archive_mode] and archive_mode not in COMPRESSED_SUFFIXES:
+        return False
+    name = file + COMPRESSED_SUFFIXES.get(archive_mode, "")
+    existing_path = os.path.join(existing_raw_folder, name)
+    dest_path = os.path.join(raw_folder, name)
+    sidecars = [CHECKSUM_SUFFIX] + ([ARCHIVE_INDEX_SUFFIX] if archive_mode in COMPRESSED_SUFFIXES else [])
+    if archive_mode not in COMPRESSED_SUFFIXES:
+        # A linked file may not have its sidecar yet
+        archived_sha256(existing_raw_folder, file)
+    if not all(os.path.exists(existing_path + suffix) for suffix in [""] + sidecars):
+        return False
+    temp_path = f"{dest_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        os.link(existing_path, temp_path)
+        os.replace(temp_path, dest_path)
+        # Sidecars are rewritten in place by archive_file(), so they are copied rather than linked
+        for suffix in sidecars:
+            shutil.copy2(existing_path + suffix, dest_path + suffix)
+    except OSError:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
 
 
 
 
-def copy_raw_files(source_dir, raw_folder, csv_files, json_files):
-    """Copy original files to Raw folder WITHOUT renaming them"""
-    copied_files = []
+def link_recording_outputs(existing_folder, recording_folder, csv_file):
+    """Stage hardlinks (or copies) of an identical recording's outputs and commit them as this recording's folder"""
+    staging_folder = stage_recording(recording_folder)
+    try:
+        prefix = os.path.splitext(csv_file)[0]
+        with os.scandir(existing_folder) as entries:
+            for entry in entries:
+                # The QC summary names its recording, so it is rewritten below rather than shared
+                if entry.is_file() and _is_recording_output(entry.name, prefix) \
+                        and not entry.name.startswith(QC_SUMMARY_NAME + "."):
+                    dest_path = os.path.join(staging_folder, entry.name)
+                    try:
+                        os.link(entry.path, dest_path)
+                    except OSError:
+                        shutil.copy2(entry.path, dest_path)
+        relabel_qc_summary(existing_folder, recording_folder, staging_folder)
+        commit_recording(staging_folder, recording_folder, csv_file)
+    finally:
+        if os.path.exists(staging_folder):
+            shutil.rmtree(staging_folder, ignore_errors=True)
+
+
+
+
+def link_duplicates(store_path, session, recording_folders, fingerprints, raw_folder, parser_version, stages=(),
+                    archive_mode="copy", log=print):
+    """Link recordings that were already parsed from an identical raw file elsewhere.
+
+    Returns (results, linked raw files, {csv file: previous label} for recordings relabelled in this output directory).
+    """
+    results, linked_raw, relabelled = [], set(), {}
+    sha256_cache = {}
+    connection = open_dedup_store(store_path)
+    try:
+        for recording_folder, csv_file, folder_name in recording_folders:
+            start_time = time.perf_counter()
+            duplicate = find_duplicate(connection, session, csv_file, fingerprints[csv_file],
+                                       fingerprints.get(csv_file[:-4] + "_info.json"), parser_version, stages, log,
+                                       sha256_cache)
+            if duplicate is None:
+                continue
+            if duplicate["folder"] is None:
+                log(f"WARNING: {csv_file} was processed as {duplicate['label']} in this output directory before; "
+                    f"check which label is right")
+                relabelled[csv_file] = duplicate["label"]
+                continue
+            try:
+                link_recording_outputs(duplicate["folder"], recording_folder, csv_file)
+            except OSError as e:
+                log(f"WARNING: Could not link {folder_name} to {duplicate['folder']}, parsing it instead: {str(e)}")
+                continue
+            if link_archived_raw(os.path.join(duplicate["output_dir"], "Raw"), raw_folder, csv_file, archive_mode):
+                linked_raw.add(csv_file)
+           
+            conflict = duplicate["label"] if duplicate["label"] != session_label(session) else None
+            if conflict:
+                log(f"WARNING: {csv_file} was already processed as {conflict} in {duplicate['output_dir']}; "
+                    f"check which label is right")
+            log(f"Linked duplicate recording: {folder_name} -> {duplicate['folder']}")
+            results.append({
+                "folder_name": folder_name,
+                "csv_file": csv_file,
+                "success": True,
+                "skipped": True,
+                "failure": None,
+                "attempts": 0,
+                "parsed_files": duplicate["parsed_files"],
+                "stages": duplicate["stages"],
+                "elapsed": time.perf_counter() - start_time,
+                "duplicate_of": duplicate["folder"],
+                "label_conflict": conflict,
+            })
+    finally:
+        connection.close()
+    return results, linked_raw, relabelled
+
+
+
+
+def register_raw_files(store_path, session, prepared, results):
+    """Record the fingerprints of a finished session's successfully parsed raw files in the store; returns the row count"""
+    output_dir = os.path.abspath(session["output_dir"])
+    updated = datetime.now().isoformat()
+    rows = []
+    for result in results:
+        csv_file = result["csv_file"]
+        if not result["success"] or csv_file not in prepared["fingerprints"]:
+            continue
+        fingerprint = prepared["fingerprints"][csv_file]
+        rows.append((output_dir, csv_file, fingerprint["size"], fingerprint["hash"],
+                     archived_sha256(prepared["raw_folder"], csv_file), session["participant"], session["emotibit"],
+                     session["week"], session["day"], result["folder_name"],
+                     os.path.abspath(os.path.join(session["source_dir"], csv_file)), updated))
    
-    print("Copying raw files to Raw folder (preserving original names)...")
+    connection = open_dedup_store(store_path)
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT INTO raw_files (output_dir, csv_file, size, fast_hash, sha256, participant, emotibit, week, day, "
+                "folder_name, source_path, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (output_dir, csv_file) DO UPDATE SET size = excluded.size, fast_hash = excluded.fast_hash, "
+                "sha256 = excluded.sha256, participant = excluded.participant, emotibit = excluded.emotibit, "
+                "week = excluded.week, day = excluded.day, folder_name = excluded.folder_name, "
+                "source_path = excluded.source_path, updated = excluded.updated", rows)
+    finally:
+        connection.close()
+    return len(rows)
+
+
+
+
+def plan_session(session, log=print, parser_version=None, force=False, stages=(), include=None, preflight="flag",
+                 archive_mode="copy", dedup=None):
+    """Find the session's raw files, work out what needs copying and parsing, and create its recording folders"""
+    with _run_log.stage("scan", session=session_label(session)) as record:
+        csv_files, json_files = find_raw_files(session["source_dir"], log=log)
    
-    for csv_file in csv_files:
-        # Copy CSV file with original name
-        shutil.copy2(os.path.join(source_dir, csv_file), os.path.join(raw_folder, csv_file))
-        print(f"  Copied: {csv_file}")
-        copied_files.append(os.path.join(raw_folder, csv_file))
+        # The watcher only hands over recordings whose files have finished writing
+        if include is not None:
+            csv_files = [file for file in csv_files if file[:-4] in include]
+            json_files = [file for file in json_files if file[:-len("_info.json")] in include]
+        record["files"] = len(csv_files) + len(json_files)
    
-    for json_file in json_files:
-        # Copy JSON file with original name  
-        shutil.copy2(os.path.join(source_dir, json_file), os.path.join(raw_folder, json_file))
-        print(f"  Copied: {json_file}")
+        if not csv_files:
+            log("ERROR: No CSV files found!")
+            return None
    
-    return copied_files
+        if len(csv_files) != len(json_files):
+            log(f"WARNING: Found {len(csv_files)} CSV files but {len(json_files)} JSON files")
+   
+        raw_folder, parsed_folder = setup_folders(session["output_dir"])
+   
+        # Compare against what previous runs already processed (--force starts from scratch)
+        manifest = {"files": {}, "recordings": {}} if force else load_processing_manifest(session["output_dir"])
+        fingerprints = {}
+        unchanged_files = set()
+        for file in csv_files + json_files:
+            previous = manifest["files"].get(file)
+            fingerprints[file] = file_fingerprint(os.path.join(session["source_dir"], file), previous)
+            if previous and previous["hash"] == fingerprints[file]["hash"] \
+                    and archived_size(raw_folder, file) == fingerprints[file]["size"]:
+                unchanged_files.add(file)
+   
+        # Check new or changed recordings before anything is copied or parsed
+        # (REC numbers count quarantined recordings too, so they do not shift when a bad file is set aside)
+        all_csv_files = csv_files
+        csv_files, json_files, qc = preflight_raw_files(session, csv_files, json_files, preflight, log,
+                                                        skip=unchanged_files, archive_mode=archive_mode)
+        quarantined = [csv_file for csv_file in all_csv_files if csv_file not in csv_files]
+        if not csv_files:
+            log("ERROR: No CSV files left after the pre-flight checks!")
+            return None
+   
+        # Raw keeps the original names, so the copies' paths are known before copying
+        # (compressed archives are parsed as they are, or expanded for the external parser)
+        copied_csv_files = [archived_raw_path(raw_folder, csv_file, archive_mode) for csv_file in csv_files]
+   
+        # Create recording folders in Parsed folder
+        previous_folders = {csv_file: entry.get("folder_name") for csv_file, entry in manifest["recordings"].items()}
+        try:
+            recording_folders = create_recording_folders(parsed_folder, all_csv_files, session["participant"],
+                                                         session["emotibit"], session["week"], session["day"], log=log,
+                                                         previous_folders=previous_folders, exclude=quarantined)
+        except LabelConflictError as e:
+            log(f"ERROR: {str(e)}")
+            return None
+        quarantined_results = [{
+            "folder_name": recording_folder_name(session["participant"], session["emotibit"], session["week"],
+                                                 session["day"], all_csv_files.index(csv_file) + 1, len(all_csv_files),
+                                                 csv_file),
+            "csv_file": csv_file,
+            "success": False,
+            "skipped": False,
+            "quarantined": True,
+            "failure": "quarantined",
+            "attempts": 0,
+            "parsed_files": [],
+            "stages": [],
+            "elapsed": 0.0,
+        } for csv_file in quarantined]
+        for recording_folder, csv_file, _ in recording_folders:
+            if csv_file in qc:
+                with open(os.path.join(recording_folder, RAW_QC_NAME), "w", encoding="utf-8") as f:
+                    json.dump(qc[csv_file], f, indent=2)
+   
+        # Only recordings whose raw files, parser or outputs changed need to be parsed again
+        pending_folders, pending_csv_files, skipped_results = [], [], []
+        for recording, copied_csv_path in zip(recording_folders, copied_csv_files):
+            recording_folder, csv_file, folder_name = recording
+            json_fingerprint = fingerprints.get(csv_file[:-4] + "_info.json")
+            entry = manifest["recordings"].get(csv_file)
+            if is_recording_unchanged(entry, fingerprints[csv_file], json_fingerprint, parser_version, recording_folder, stages):
+                log(f"Skipping unchanged recording: {folder_name}")
+                skipped_results.append({
+                    "folder_name": folder_name,
+                    "csv_file": csv_file,
+                    "success": True,
+                    "skipped": True,
+                    "failure": None,
+                    "attempts": 0,
+                    "parsed_files": entry["parsed_files"],
+                    "stages": entry.get("stages") or [],
+                    "elapsed": 0.0,
+                })
+            else:
+                pending_folders.append(recording)
+                pending_csv_files.append(copied_csv_path)
+   
+        # The same raw file offloaded into another output directory before is linked from there instead of parsed again
+        relabelled = {}
+        if dedup and pending_folders and not force:
+            with _run_log.stage("dedup", session=session_label(session)) as record:
+                linked, linked_raw, relabelled = link_duplicates(dedup, session, pending_folders, fingerprints,
+                                                                 raw_folder, parser_version, stages, archive_mode, log)
+                record["files"] = len(linked)
+            linked_csv_files = set(result["csv_file"] for result in linked)
+            pending = [(recording, copied_csv_path) for recording, copied_csv_path in zip(pending_folders, pending_csv_files)
+                       if recording[1] not in linked_csv_files]
+            pending_folders = [recording for recording, _ in pending]
+            pending_csv_files = [copied_csv_path for _, copied_csv_path in pending]
+            skipped_results.extend(linked)
+            unchanged_files |= linked_raw
+   
+        return {
+            "raw_folder": raw_folder,
+            "parsed_folder": parsed_folder,
+            "recording_folders": pending_folders,
+            "copied_csv_files": pending_csv_files,
+            "all_recording_folders": recording_folders,
+            "all_csv_files": all_csv_files,
+            "skipped_results": skipped_results,
+            "quarantined_results": quarantined_results,
+            "relabelled": relabelled,
+            "fingerprints": fingerprints,
+            "csv_files": csv_files,
+            "json_files": json_files,
+            "unchanged_files": unchanged_files,
+            "qc": qc,
+        }
 
 
 
 
-def create_recording_folders(parsed_folder, csv_files, participant_num, emotibit_num, week_num, day_num):
-    """Create recording folders based on actual number of CSV files found"""
-    recording_folders = []
+def preflight_checksums(prepared):
+    """SHA-256 of each raw CSV the pre-flight check read, for archiving by link without reading it again"""
+    return {csv_file: qc["sha256"] for csv_file, qc in prepared["qc"].items()}
+
+
+
+
+def prepare_session(session, log=print, parser_version=None, force=False, archive_mode="copy", stages=(), include=None,
+                    preflight="flag", dedup=None):
+    """Find the session's raw files, copy them to Raw and create its recording folders"""
+    prepared = plan_session(session, log, parser_version, force, stages, include, preflight, archive_mode, dedup)
+    if prepared is not None:
+        # Copy original files to Raw folder (preserve names)
+        with _run_log.stage("copy", session=session_label(session)):
+            copy_raw_files(session["source_dir"], prepared["raw_folder"], prepared["csv_files"], prepared["json_files"],
+                           log=log, unchanged_files=prepared["unchanged_files"], archive_mode=archive_mode,
+                           checksums=preflight_checksums(prepared))
+    return prepared
+
+
+
+
+def finish_session(session, prepared, results, parser_version, catalog=None, dedup=None, log=print):
+    """Record successful recordings in the processing manifest (catalog and dedup store) and return all results in recording order"""
+    fingerprints = prepared["fingerprints"]
+    recordings = {}
+    for result in results:
+        if result["success"] and result["parsed_files"]:
+            csv_file = result["csv_file"]
+            recordings[csv_file] = {
+                "folder_name": result["folder_name"],
+                "csv": fingerprints[csv_file],
+                "json": fingerprints.get(csv_file[:-4] + "_info.json"),
+                "parser": parser_version,
+                "parsed_files": sorted(result["parsed_files"]),
+                "stages": result["stages"],
+            }
+    for result in prepared["skipped_results"]:
+        # Keep the folder name current in case the recording was renumbered
+        csv_file = result["csv_file"]
+        recordings[csv_file] = {
+            "folder_name": result["folder_name"],
+            "csv": fingerprints[csv_file],
+            "json": fingerprints.get(csv_file[:-4] + "_info.json"),
+            "parser": parser_version,
+            "parsed_files": result["parsed_files"],
+            "stages": result["stages"],
+        }
    
-    for i, csv_file in enumerate(csv_files, 1):
-        # Extract date from filename (YYYY-MM-DD format)
-        iso_date = csv_file[:10]  # First 10 characters are YYYY-MM-DD
-        folder_name = f"P{participant_num}E{emotibit_num}_W{week_num}D{day_num}_REC{i}-{len(csv_files)}_{iso_date}"
-       
-        folder_path = os.path.join(parsed_folder, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-       
-        recording_folders.append((folder_path, csv_file, folder_name))
-        print(f"Created recording folder: {folder_name}")
+    # Only remember files that actually made it to Raw
+    raw_files = {file: fingerprint for file, fingerprint in fingerprints.items()
+                 if archived_size(prepared["raw_folder"], file) is not None}
+    with _run_log.stage("manifest", session=session_label(session)):
+        update_processing_manifest(session["output_dir"], raw_files, recordings)
+        # Refresh the Parsed/ level QC roll-up (a no-op when no recording has a qc_summary.json)
+        write_qc_rollup(prepared["parsed_folder"])
+        remove_staging_folder(prepared["parsed_folder"])
    
-    return recording_folders
+    for result in results:
+        if result["csv_file"] in prepared["relabelled"]:
+            result["label_conflict"] = prepared["relabelled"][result["csv_file"]]
+    order = {csv_file: i for i, csv_file in enumerate(prepared["all_csv_files"])}
+    results = sorted(results + prepared["skipped_results"] + prepared["quarantined_results"],
+                     key=lambda result: order[result["csv_file"]])
+    if catalog:
+        try:
+            with _run_log.stage("catalog", session=session_label(session)) as record:
+                record["files"] = update_catalog(catalog, session, prepared, results, parser_version)
+        except sqlite3.Error as e:
+            log(f"WARNING: Could not update the catalog {catalog}: {str(e)}")
+    if dedup:
+        try:
+            with _run_log.stage("dedup", session=session_label(session)) as record:
+                record["files"] = register_raw_files(dedup, session, prepared, results)
+        except sqlite3.Error as e:
+            log(f"WARNING: Could not update the dedup store {dedup}: {str(e)}")
+    return results
 
 
 
 
-def run_parser(parser_exe_path, csv_file_path, output_folder):
-    """Run EmotiBit DataParser.exe on a CSV file with output directory"""
+def run_batch(sessions, parse_func, max_workers=1, copy_workers=2, parser_version=None, force=False, archive_mode="copy",
+              post_parse=(), preflight="flag", catalog=None, dedup=None):
+    """Run every session through copy -> parse -> organize on shared worker pools and return a report"""
+   
+    def stage_session(session):
+        lines = []
+        try:
+            prepared = prepare_session(session, log=lines.append, parser_version=parser_version, force=force,
+                                       archive_mode=archive_mode, stages=[stage_name for stage_name, _ in post_parse],
+                                       preflight=preflight, dedup=dedup)
+        except Exception as e:
+            lines.append(f"ERROR: {str(e)}")
+            prepared = None
+        return prepared, lines
+   
+    report = []
+    process_pool = builtin_parse_pool(parse_func, max_workers)
+    parse_func = pooled_parser(parse_func, process_pool)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, copy_workers)) as copy_pool, \
+                ThreadPoolExecutor(max_workers=max(1, max_workers)) as parse_pool:
+            staging = [copy_pool.submit(stage_session, session) for session in sessions]
+           
+            # Queue each session's recordings on the shared parser pool as soon as its files are staged
+            queued = []
+            for session, future in zip(sessions, staging):
+                prepared, lines = future.result()
+                print(f"\n{'#'*50}")
+                print(f"Session {session_label(session)}: {session['source_dir']}")
+                print(f"{'#'*50}")
+                for line in lines:
+                    _run_log.echo(line)
+                futures = []
+                if prepared:
+                    futures = submit_recordings(parse_pool, parse_func, prepared["recording_folders"],
+                                                prepared["copied_csv_files"], post_parse)
+                queued.append((session, prepared, futures))
+           
+            for session, prepared, futures in queued:
+                results = collect_results(futures)
+                warnings = []
+                if prepared is not None:
+                    results = finish_session(session, prepared, results, parser_version, catalog, dedup,
+                                             log=warnings.append)
+                for line in warnings:
+                    _run_log.echo(line)
+                if prepared is None:
+                    status = "failed"
+                elif all(result["success"] for result in results):
+                    status = "ok"
+                else:
+                    status = "partial"
+                report.append({
+                    "session": session_label(session),
+                    "source_dir": session["source_dir"],
+                    "output_dir": session["output_dir"],
+                    "status": status,
+                    "recordings": [{key: value for key, value in result.items() if key != "log"} for result in results],
+                    "warnings": warnings,
+                })
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+   
+    return report
+
+
+
+
+async def run_parser_async(parser_exe_path, csv_file_path, output_folder, log=print, streams=None):
+    """Run EmotiBit DataParser.exe without blocking the event loop (pipeline mode)"""
     if not os.path.exists(parser_exe_path):
-        print(f"ERROR: Parser executable not found at {parser_exe_path}")
+        log(f"ERROR: Parser executable not found at {parser_exe_path}")
+        _run_log.note(failure="missing-parser")
         return False
    
+    if is_compressed_archive(csv_file_path):
+        # Same as run_parser(), with the archive expanded off the event loop
+        try:
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(output_folder)) as temp_folder:
+                plain_path = await asyncio.get_running_loop().run_in_executor(None, expand_archive, csv_file_path,
+                                                                              temp_folder)
+                return await run_parser_async(parser_exe_path, plain_path, output_folder, log, streams)
+        except OSError as e:
+            log(f"✗ Could not expand {os.path.basename(csv_file_path)}: {str(e)}")
+            _run_log.note(failure="os-error")
+            return False
+   
     csv_filename = os.path.basename(csv_file_path)
-    print(f"Running parser on: {csv_filename}")
-    print(f"Output folder: {output_folder}")
+    timeout = _scheduler.timeout(_file_size(csv_file_path))
+    _run_log.note(timeout_s=round(timeout, 1))
+    log(f"Running parser on: {csv_filename}")
+    log(f"Output folder: {output_folder}")
    
     try:
-        # Use string format with shell=True and quotes for paths with spaces
-        cmd = f'"{parser_exe_path}" "{csv_file_path}" -o "{output_folder}"'
-        result = subprocess.run(cmd, capture_output=True, text=True, shell=True, timeout=300)
+        # Arguments are passed directly, so paths with spaces need no quoting
+        process = await asyncio.create_subprocess_exec(parser_exe_path, csv_file_path, "-o", output_folder,
+                                                       stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            log(f"✗ Parser timed out after {timeout:.0f}s")
+            _run_log.note(failure="timeout")
+            return False
        
-        print(f"Return code: {result.returncode}")
-        if result.stdout:
-            print(f"Output: {result.stdout}")
-        if result.stderr:
-            print(f"Errors: {result.stderr}")
+        log(f"Return code: {process.returncode}")
+        if stdout:
+            log(f"Output: {stdout.decode(errors='replace')}")
+        if stderr:
+            log(f"Errors: {stderr.decode(errors='replace')}")
        
-        if result.returncode == 0:
-            print(f"✓ Successfully parsed {csv_filename}")
+        if process.returncode == 0:
+            log(f"✓ Successfully parsed {csv_filename}")
+            drop_unselected_streams(output_folder, csv_file_path, streams, log)
             return True
         else:
-            print(f"✗ Parser failed with return code {result.returncode}")
+            failure = classify_parser_exit(process.returncode)
+            log(f"✗ Parser failed with return code {process.returncode} ({failure})")
+            _run_log.note(failure=failure)
             return False
            
     except Exception as e:
-        print(f"Exception running parser: {str(e)}")
+        failure = classify_parser_exception(e)
+        log(f"Exception running parser ({failure}): {str(e)}")
+        _run_log.note(failure=failure)
         return False
 
 
 
 
-def organize_parsed_files(recording_folder, raw_folder, expected_csv_name):
-    """Move parsed datastream files from Raw folder to the correct Parsed recording folder"""
-    print(f"Looking for parsed files to move to: {os.path.basename(recording_folder)}")
+def _parse_in_subprocess(csv_file_path, output_folder, split_workers, streams=None):
+    """Run the built-in parser in a worker process and hand its log lines, CPU time and failure class back"""
+    lines = []
+    # Stand-in stage record, so the parser's note(failure=...) reaches the parent
+    record = {}
+    token = _current_stage.set(record)
+    start_cpu = time.process_time()
+    try:
+        success = parse_raw_file(csv_file_path, output_folder, log=lines.append, split_workers=split_workers,
+                                 streams=streams)
+    finally:
+        _current_stage.reset(token)
+    return success, lines, time.process_time() - start_cpu, record.get("failure")
+
+
+
+
+def run_pipeline(sessions, backend, parser_exe_path, split_workers=1, max_workers=1, copy_workers=2, queue_depth=2,
+                 parser_version=None, force=False, archive_mode="copy", post_parse=(), preflight="flag", catalog=None,
+                 streams=None, dedup=None):
+    """Run sessions as an overlapped copy -> parse -> organize pipeline and return a batch report"""
+    return asyncio.run(_run_pipeline(sessions, backend, parser_exe_path, split_workers, max_workers, copy_workers,
+                                     queue_depth, parser_version, force, archive_mode, post_parse, preflight, catalog,
+                                     streams, dedup))
+
+
+
+
+async def _run_pipeline(sessions, backend, parser_exe_path, split_workers, max_workers, copy_workers, queue_depth,
+                        parser_version, force, archive_mode, post_parse, preflight, catalog, streams, dedup):
+    loop = asyncio.get_running_loop()
+    stages = [stage_name for stage_name, _ in post_parse]
+    max_workers, copy_workers = max(1, max_workers), max(1, copy_workers)
+   
+    # Bounded queues between the stages: a slow stage holds back the one before it instead of piling up work
+    copy_queue = asyncio.Queue(maxsize=max(1, queue_depth))
+    parse_queue = asyncio.Queue(maxsize=max(1, queue_depth))
+    organize_queue = asyncio.Queue(maxsize=max(1, queue_depth))
+   
+    io_pool = ThreadPoolExecutor(max_workers=copy_workers + 1)
+    parse_pool = BuiltinParsePool(max_workers) if backend == "builtin" else None
+    planned = [None] * len(sessions)
+    results = [[] for _ in sessions]
+   
+    def _finish_pipeline_job(job, success):
+        job["log"].append(f"{'✓' if success else '✗'} {job['folder_name']}")
+        for line in job["log"]:
+            _run_log.echo(line)
+        results[job["session"]].append({
+            "folder_name": job["folder_name"],
+            "csv_file": job["csv_file"],
+            "success": success,
+            "skipped": False,
+            "failure": job.get("failure"),
+            "attempts": job.get("attempts", 0),
+            "parsed_files": job.get("parsed_files", []),
+            "stages": stages,
+            "elapsed": time.perf_counter() - job["start_time"],
+        })
+   
+    async def produce():
+        # Plan each session (cheap: index, fingerprints, folders) and feed its recordings to the copy stage
+        for i, session in enumerate(sessions):
+            lines = []
+            try:
+                prepared = await loop.run_in_executor(io_pool, plan_session, session, lines.append, parser_version,
+                                                      force, stages, None, preflight, archive_mode, dedup)
+            except Exception as e:
+                lines.append(f"ERROR: {str(e)}")
+                prepared = None
+            print(f"\n{'#'*50}")
+            print(f"Session {session_label(session)}: {session['source_dir']}")
+            print(f"{'#'*50}")
+            for line in lines:
+                _run_log.echo(line)
+            planned[i] = prepared
+            if prepared is None:
+                continue
+           
+            pending = set(csv_file for _, csv_file, _ in prepared["recording_folders"])
+            to_copy = [file for file in prepared["csv_files"] + prepared["json_files"]
+                       if file not in prepared["unchanged_files"]]
+            for n, (recording_folder, csv_file, folder_name) in enumerate(prepared["all_recording_folders"]):
+                # Each recording carries its own CSV and _info.json; orphaned JSON files ride along with the first one
+                own_files = [file for file in to_copy if file.startswith(csv_file[:-4])]
+                if n == 0:
+                    own_files += [file for file in to_copy if file.endswith("_info.json")
+                                  and file[:-len("_info.json")] + ".csv" not in prepared["csv_files"]]
+                if csv_file not in pending and not own_files:
+                    continue
+                await copy_queue.put({
+                    "session": i,
+                    "source_dir": session["source_dir"],
+                    "raw_folder": prepared["raw_folder"],
+                    "recording_folder": recording_folder,
+                    "csv_file": csv_file,
+                    "folder_name": folder_name,
+                    "copy_files": own_files,
+                    "checksums": preflight_checksums(prepared),
+                    "parse": csv_file in pending,
+                    "log": [],
+                })
+        for _ in range(copy_workers):
+            await copy_queue.put(None)
+   
+    async def copy_stage(job):
+        job["start_time"] = time.perf_counter()
+        try:
+            # The event loop thread's CPU time would mix in the other stages, so only wall time is tracked here
+            with _run_log.stage("copy", track_cpu=False, recording=job["folder_name"]):
+                for file in job["copy_files"]:
+                    method = await loop.run_in_executor(io_pool, archive_file, os.path.join(job["source_dir"], file),
+                                                        os.path.join(job["raw_folder"], file), archive_mode,
+                                                        job["checksums"].get(file))
+                    job["log"].append(f"  {ARCHIVE_LABELS[method]}: {file}")
+                    _record_archived(os.path.join(job["source_dir"], file), os.path.join(job["raw_folder"], file), method)
+        except Exception as e:
+            job["log"].append(f"ERROR: Could not copy raw files for {job['folder_name']}: {str(e)}")
+            if job["parse"]:
+                job["failure"] = "os-error"
+                _finish_pipeline_job(job, False)
+            return None
+        if not job["parse"]:
+            for line in job["log"]:
+                _run_log.echo(line)
+            return None
+        return job
+   
+    async def parse_stage(job):
+        log = job["log"].append
+        log(f"\n{'='*50}")
+        log(f"Processing: {job['folder_name']}")
+        log(f"{'='*50}")
+        csv_path = archived_raw_path(job["raw_folder"], job["csv_file"], archive_mode)
+        # Same policy as parse_with_retries(); waiting for memory happens off the event loop
+        need, waited = await loop.run_in_executor(None, _scheduler.acquire, _file_size(csv_path))
+        try:
+            for attempt in range(1, _scheduler.retries + 2):
+                job["attempts"] = attempt
+                try:
+                    job["staging_folder"] = await loop.run_in_executor(io_pool, stage_recording, job["recording_folder"])
+                except OSError as e:
+                    log(f"✗ Could not create a staging folder for {job['folder_name']}: {str(e)}")
+                    job["staging_folder"], job["parsed"], job["failure"] = None, False, "os-error"
+                    break
+                with _run_log.stage("parse", track_cpu=False, recording=job["folder_name"], attempt=attempt) as record:
+                    if attempt == 1:
+                        record["memory_wait_s"] = round(waited, 3)
+                    staged_files, staged_bytes = _folder_usage(job["staging_folder"])
+                    if backend == "builtin":
+                        job["parsed"], lines, cpu, failure = await parse_pool.parse_async(
+                            csv_path, job["staging_folder"], split_workers, streams)
+                        job["log"].extend(lines)
+                        record["subprocess_cpu_s"] = cpu
+                        if failure:
+                            record["failure"] = failure
+                    else:
+                        job["parsed"] = await run_parser_async(parser_exe_path, csv_path, job["staging_folder"], log=log,
+                                                               streams=streams)
+                    files, written = _folder_usage(job["staging_folder"])
+                    record.update(ok=job["parsed"], bytes_read=_file_size(csv_path), bytes_written=written - staged_bytes,
+                                  files=files - staged_files)
+                    if not job["parsed"]:
+                        record["failure"] = record.get("failure") or "parser-error"
+                job["failure"] = record.get("failure")
+                if job["parsed"] or not _scheduler.should_retry(job["failure"], attempt):
+                    break
+                delay = _scheduler.backoff(attempt)
+                log(f"Retrying {job['folder_name']} in {delay:g}s after {job['failure']} "
+                    f"(attempt {attempt + 1}/{_scheduler.retries + 1})")
+                await asyncio.sleep(delay)
+        finally:
+            _scheduler.release(need)
+        return job
+   
+    async def organize_stage(job):
+        success, job["parsed_files"] = await loop.run_in_executor(
+            io_pool, organize_recording, job["parsed"], job["recording_folder"], job["staging_folder"], job["csv_file"],
+            job["log"].append, post_parse)
+        if job["parsed"] and not success:
+            job["failure"] = "organize"
+        _finish_pipeline_job(job, success)
+        return None
+   
+    async def run_stage(handler, in_queue, out_queue, workers, next_workers):
+        async def worker():
+            while True:
+                job = await in_queue.get()
+                if job is None:
+                    break
+                job = await handler(job)
+                if job is not None:
+                    await out_queue.put(job)
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(next_workers):
+            await out_queue.put(None)
+   
+    try:
+        await asyncio.gather(
+            produce(),
+            run_stage(copy_stage, copy_queue, parse_queue, copy_workers, max_workers),
+            run_stage(parse_stage, parse_queue, organize_queue, max_workers, 1),
+            run_stage(organize_stage, organize_queue, None, 1, 0),
+        )
+    finally:
+        io_pool.shutdown()
+        if parse_pool is not None:
+            parse_pool.shutdown()
+   
+    report = []
+    for session, prepared, session_results in zip(sessions, planned, results):
+        warnings = []
+        if prepared is not None:
+            session_results = finish_session(session, prepared, session_results, parser_version, catalog, dedup,
+                                             log=warnings.append)
+        for line in warnings:
+            _run_log.echo(line)
+        if prepared is None:
+            status = "failed"
+        elif all(result["success"] for result in session_results):
+            status = "ok"
+        else:
+            status = "partial"
+        report.append({
+            "session": session_label(session),
+            "source_dir": session["source_dir"],
+            "output_dir": session["output_dir"],
+            "status": status,
+            "recordings": session_results,
+            "warnings": warnings,
+        })
+    return report
+
+
+
+
+def print_batch_report(report, elapsed):
+    """Print the consolidated summary for a batch run"""
+    print(f"\n{'='*50}")
+    print("BATCH SUMMARY:")
+    print(f"{'='*50}")
+    for entry in report:
+        succeeded = sum(1 for result in entry["recordings"] if result["success"])
+        linked = sum(1 for result in entry["recordings"] if result.get("duplicate_of"))
+        skipped = sum(1 for result in entry["recordings"] if result["skipped"]) - linked
+        print(f"  [{entry['status']:>7}] {entry['session']}: {succeeded}/{len(entry['recordings'])} recordings parsed"
+              f" ({skipped} unchanged{f', {linked} duplicates linked' if linked else ''}) -> {entry['output_dir']}")
+        for result in entry["recordings"]:
+            if result.get("label_conflict"):
+                where = os.path.dirname(os.path.dirname(result["duplicate_of"])) if result.get("duplicate_of") \
+                    else "this output directory before"
+                print(f"            ! {result['folder_name']} ({result['csv_file']}): also processed as "
+                      f"{result['label_conflict']} in {where}")
+            if result.get("quarantined"):
+                print(f"            ✗ {result['folder_name']} ({result['csv_file']}): quarantined in "
+                      f"{os.path.join(entry['output_dir'], QUARANTINE_FOLDER)}")
+            elif not result["success"]:
+                print(f"            ✗ {result['folder_name']} ({result['csv_file']}): {result.get('failure') or 'failed'}"
+                      f" after {result.get('attempts', 1)} attempts")
+    ok_sessions = sum(1 for entry in report if entry["status"] == "ok")
+    print(f"{ok_sessions}/{len(report)} sessions fully processed in {elapsed:.1f}s")
+
+
+
+
+class InotifyWatcher:
+    """Minimal ctypes inotify wrapper (Linux) that wakes the watch loop as soon as a drop folder changes"""
+   
+    def __init__(self, directories):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name or not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        for directory in directories:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self.watches[wd] = directory
+   
+    def wait(self, timeout):
+        """Wait up to timeout seconds and return the directories that had events"""
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        while ready:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + 16 <= len(data):
+                wd, _, _, name_length = struct.unpack_from("iIII", data, offset)
+                if wd in self.watches:
+                    changed.add(self.watches[wd])
+                offset += 16 + name_length
+            ready, _, _ = select.select([self.fd], [], [], 0)
+        return changed
+   
+    def close(self):
+        os.close(self.fd)
+
+
+
+
+class PollingWatcher:
+    """Fallback for platforms or filesystems (e.g. network shares) without inotify"""
+   
+    def __init__(self, directories, interval):
+        self.directories = set(directories)
+        self.interval = interval
    
-    # Check both the raw folder and the recording folder for parsed files
-    locations_to_check = [raw_folder, recording_folder]
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return set(self.directories)
    
-    moved_files = []
+    def close(self):
+        pass
+
+
+
+
+def find_settled_recordings(source_dir, candidates, settle_seconds, now):
+    """Return the timestamp prefixes whose CSV and _info.json sizes have been stable for settle_seconds"""
+    settled = set()
+    present = set()
+    for prefix, group in build_dir_index(source_dir).items():
+        if not group["csv"] or not group["json"]:
+            continue
+        try:
+            csv_stat = os.stat(os.path.join(source_dir, group["csv"]))
+            json_stat = os.stat(os.path.join(source_dir, group["json"]))
+        except FileNotFoundError:
+            continue
+        key = (csv_stat.st_size, csv_stat.st_mtime_ns, json_stat.st_size, json_stat.st_mtime_ns)
+        present.add(prefix)
+       
+        previous = candidates.get(prefix)
+        if previous is None or previous[0] != key:
+            # New or still growing: (re)start the settle timer
+            candidates[prefix] = (key, now)
+        elif now - previous[1] >= settle_seconds:
+            settled.add((prefix, key))
    
-    for location in locations_to_check:
-        if not os.path.exists(location):
+    # Forget files that were removed from the drop folder
+    for prefix in set(candidates) - present:
+        del candidates[prefix]
+    return settled
+
+
+
+
+def ingest_recordings(session, prefixes, parse_func, parser_version, archive_mode="copy", post_parse=(), preflight="flag",
+                      catalog=None, dedup=None):
+    """Watcher job: push newly settled recordings through copy -> parse -> organize for their session"""
+    lines = []
+    try:
+        prepared = prepare_session(session, log=lines.append, parser_version=parser_version, archive_mode=archive_mode,
+                                   stages=[stage_name for stage_name, _ in post_parse], include=prefixes,
+                                   preflight=preflight, dedup=dedup)
+        results = []
+        if prepared is not None:
+            results = [process_recording(parse_func, recording_folder, copied_csv_path, original_csv_name, folder_name,
+                                         post_parse)
+                       for (recording_folder, original_csv_name, folder_name), copied_csv_path
+                       in zip(prepared["recording_folders"], prepared["copied_csv_files"])]
+            for result in results:
+                lines.extend(result["log"])
+            results = finish_session(session, prepared, results, parser_version, catalog, dedup, log=lines.append)
+    except Exception as e:
+        lines.append(f"ERROR: {str(e)}")
+        results = []
+    return results, lines
+
+
+
+
+def watch_folders(sessions, parse_func, parser_version, max_workers=1, archive_mode="copy", post_parse=(),
+                  settle_seconds=30, poll_interval=5, preflight="flag", catalog=None, dedup=None):
+    """Daemon mode: watch each session's source folder and process recordings as soon as they finish writing"""
+    sessions_by_dir = {}
+    for session in sessions:
+        source_dir = os.path.abspath(session["source_dir"])
+        if source_dir in sessions_by_dir:
+            print(f"WARNING: {source_dir} is mapped more than once, using {session_label(sessions_by_dir[source_dir])}")
             continue
+        os.makedirs(source_dir, exist_ok=True)
+        sessions_by_dir[source_dir] = session
+   
+    try:
+        watcher = InotifyWatcher(sessions_by_dir)
+        print(f"Watching {len(sessions_by_dir)} folders with inotify")
+    except OSError as e:
+        watcher = PollingWatcher(sessions_by_dir, poll_interval)
+        print(f"Watching {len(sessions_by_dir)} folders by polling every {poll_interval}s ({str(e)})")
+   
+    def request_stop(*_):
+        # Raising interrupts the watcher's select(); running jobs still finish before the pool shuts down
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, request_stop)
+   
+    candidates = {source_dir: {} for source_dir in sessions_by_dir}
+    processed = {source_dir: {} for source_dir in sessions_by_dir}
+    running = {}
+    dirty = set(sessions_by_dir)
+   
+    def is_settling(source_dir):
+        # Files seen but not yet processed in their current state
+        return any(processed[source_dir].get(prefix) != key for prefix, (key, _) in candidates[source_dir].items())
+   
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            while True:
+                # Report finished jobs; their folders are rescanned in case more files arrived meanwhile
+                for source_dir, (future, submitted) in list(running.items()):
+                    if future.done():
+                        results, lines = future.result()
+                        for line in lines:
+                            _run_log.echo(line)
+                        for result in results:
+                            if not result["skipped"]:
+                                status = "✓" if result["success"] else "✗"
+                                print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {status} {result['folder_name']}")
+                        processed[source_dir].update(submitted)
+                        del running[source_dir]
+                        dirty.add(source_dir)
            
-        files_in_location = os.listdir(location)
-        print(f"Files in {os.path.basename(location)}: {files_in_location}")
+                # Folders with files that are still settling are rechecked even without new events
+                now = time.monotonic()
+                for source_dir in (dirty | set(filter(is_settling, candidates))) - set(running):
+                    dirty.discard(source_dir)
+                    settled = find_settled_recordings(source_dir, candidates[source_dir], settle_seconds, now)
+                    new = {prefix: key for prefix, key in settled if processed[source_dir].get(prefix) != key}
+                    if new:
+                        # Everything already settled is passed in, so REC numbering counts all finished recordings
+                        include = {prefix for prefix, _ in settled}
+                        session = sessions_by_dir[source_dir]
+                        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {session_label(session)}: {len(new)} new recordings ready")
+                        future = executor.submit(ingest_recordings, session, include, parse_func, parser_version,
+                                                 archive_mode, post_parse, preflight, catalog, dedup)
+                        running[source_dir] = (future, new)
+           
+                # Wake up early while files are settling or jobs are running
+                settling = any(is_settling(source_dir) for source_dir in candidates)
+                dirty |= watcher.wait(1.0 if running else (poll_interval if settling else WATCH_IDLE_SECONDS))
+    except KeyboardInterrupt:
+        print("Stopping watcher...")
+    finally:
+        watcher.close()
+   
+    print("Watcher stopped")
+    return 0
+
+
+
+
+def open_queue(queue_path):
+    """Open the shared work queue, creating its table if needed (transactions are started explicitly)"""
+    connection = sqlite3.connect(queue_path, timeout=QUEUE_TIMEOUT, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(QUEUE_SCHEMA)
+    return connection
+
+
+
+
+def enqueue_sessions(queue_path, sessions):
+    """Add sessions to the work queue; finished ones are queued again (unchanged recordings are skipped anyway)"""
+    connection = open_queue(queue_path)
+    added = requeued = 0
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        for session in sessions:
+            key = (os.path.abspath(session["source_dir"]), os.path.abspath(session["output_dir"]), session["participant"],
+                   session["emotibit"], session["week"], session["day"])
+            cursor = connection.execute(
+                "INSERT INTO jobs (source_dir, output_dir, participant, emotibit, week, day, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'pending') ON CONFLICT DO NOTHING", key)
+            if cursor.rowcount:
+                added += 1
+                continue
+            # Jobs that are pending or running are left as they are
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL, token = NULL, lease_expires = NULL, "
+                "finished = NULL, report = NULL WHERE source_dir = ? AND output_dir = ? AND participant = ? "
+                "AND emotibit = ? AND week = ? AND day = ? AND status NOT IN ('pending', 'running')", key)
+            requeued += cursor.rowcount
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+    return added, requeued
+
+
+
+
+def claim_job(connection, worker, lease_seconds=QUEUE_LEASE_SECONDS):
+    """Atomically claim the next pending job, or one whose worker's lease ran out; returns the job row or None"""
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        # Jobs that already lost QUEUE_MAX_ATTEMPTS workers probably take their workers down with them
+        connection.execute(
+            "UPDATE jobs SET status = 'failed', worker = NULL, token = NULL, finished = ?, report = ? "
+            "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+            (datetime.now().isoformat(), json.dumps({"error": f"worker lost {QUEUE_MAX_ATTEMPTS} times"}), now,
+             QUEUE_MAX_ATTEMPTS))
        
-        # Look for parsed files: anything that ends with _LETTERS.csv
-        for file in files_in_location:
-            if re.match(r'.*_.*\.csv$', file) and not re.match(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}-\d{6}\.csv$', file):
-                expected_timestamp = expected_csv_name[:19] # Get YYYY-MM-DD_HH-MM-SS part
-                if file.startswith(expected_timestamp):
-                    source_path = os.path.join(location, file)
-                    dest_path = os.path.join(recording_folder, file)
-               
-                # Only move if it's not already in the recording folder
-                if location != recording_folder:
-                    print(f"Moving parsed file: {file}")
-                    print(f"  From: {location}")
-                    print(f"  To: {recording_folder}")
-                    shutil.move(source_path, dest_path)
-                    moved_files.append(file)
-                else:
-                    print(f"Parsed file already in correct location: {file}")
-                    moved_files.append(file)
+        # Output directories share a processing manifest and REC numbering, so only one job at a time may write to each
+        job = connection.execute(
+            "SELECT * FROM jobs WHERE (status = 'pending' OR (status = 'running' AND lease_expires < ?)) "
+            "AND output_dir NOT IN (SELECT output_dir FROM jobs WHERE status = 'running' AND lease_expires >= ?) "
+            "ORDER BY id LIMIT 1", (now, now)).fetchone()
+        if job is not None:
+            token = uuid.uuid4().hex
+            connection.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, token = ?, attempts = attempts + 1, lease_expires = ?, "
+                "heartbeat = ?, claimed = ? WHERE id = ?",
+                (worker, token, now + lease_seconds, now, datetime.now().isoformat(), job["id"]))
+            job = dict(job, token=token, attempts=job["attempts"] + 1)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return job
+
+
+
+
+def renew_lease(connection, job, lease_seconds=QUEUE_LEASE_SECONDS):
+    """Heartbeat: extend a claimed job's lease; False if the job was meanwhile handed to another worker"""
+    now = time.time()
+    cursor = connection.execute("UPDATE jobs SET lease_expires = ?, heartbeat = ? WHERE id = ? AND token = ?",
+                                (now + lease_seconds, now, job["id"], job["token"]))
+    return cursor.rowcount == 1
+
+
+
+
+def finish_job(connection, job, entry):
+    """Record a job's batch report entry as its result; False if the job no longer belongs to this worker"""
+    cursor = connection.execute(
+        "UPDATE jobs SET status = ?, token = NULL, lease_expires = NULL, finished = ?, report = ? "
+        "WHERE id = ? AND token = ?",
+        (entry["status"], datetime.now().isoformat(), json.dumps(entry), job["id"], job["token"]))
+    return cursor.rowcount == 1
+
+
+
+
+def release_job(connection, job):
+    """Hand a claimed job back to the queue without counting the attempt (the worker is stopping)"""
+    connection.execute(
+        "UPDATE jobs SET status = 'pending', worker = NULL, token = NULL, lease_expires = NULL, attempts = attempts - 1 "
+        "WHERE id = ? AND token = ?", (job["id"], job["token"]))
+
+
+
+
+def _keep_lease(queue_path, job, lease_seconds, stop):
+    """Heartbeat thread: renew the lease every third of its length until the job is done"""
+    connection = open_queue(queue_path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            try:
+                if not renew_lease(connection, job, lease_seconds):
+                    print(f"WARNING: Lost the lease on {session_label(job)}, another worker has taken it over")
+                    return
+            except sqlite3.Error as e:
+                # Retried at the next beat; the lease only runs out after three missed beats
+                print(f"WARNING: Could not renew the lease on {session_label(job)}: {str(e)}")
+    finally:
+        connection.close()
+
+
+
+
+def run_worker(queue_path, run_session, lease_seconds=QUEUE_LEASE_SECONDS, poll_interval=5, worker=None):
+    """Worker mode: claim sessions from the shared queue and process them until no job is left; returns the report"""
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker {worker} taking jobs from {queue_path}")
    
-    if moved_files:
-        print(f"Found/moved {len(moved_files)} parsed datastream files: {moved_files}")
+    def request_stop(*_):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, request_stop)
+   
+    report = []
+    job = None
+    connection = open_queue(queue_path)
+    try:
+        while True:
+            job = claim_job(connection, worker, lease_seconds)
+            if job is None:
+                counts = dict(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+                if not counts.get("pending") and not counts.get("running"):
+                    break
+                # The remaining jobs (or their output directories) are held by other workers; one of them may still die
+                time.sleep(poll_interval)
+                continue
+           
+            session = {field: job[field] for field in MANIFEST_FIELDS}
+            if job["attempts"] > 1:
+                print(f"Reclaiming {session_label(session)} from {job['worker']} (attempt {job['attempts']})")
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_keep_lease, args=(queue_path, job, lease_seconds, stop), daemon=True)
+            heartbeat.start()
+            try:
+                entry = run_session(session)
+            except Exception as e:
+                print(f"ERROR: {session_label(session)}: {str(e)}")
+                entry = {"session": session_label(session), "source_dir": session["source_dir"],
+                         "output_dir": session["output_dir"], "status": "failed", "recordings": [], "error": str(e)}
+            finally:
+                stop.set()
+                heartbeat.join()
+            entry["worker"] = worker
+            if not finish_job(connection, job, entry):
+                print(f"WARNING: {session_label(session)} was taken over by another worker, its result is not recorded")
+            report.append(entry)
+            job = None
+    except KeyboardInterrupt:
+        print("Stopping worker...")
+        if job is not None:
+            release_job(connection, job)
+    finally:
+        connection.close()
+    return report
+
+
+
+
+def print_queue_status(queue_path):
+    """Print the number of jobs in each state and who is working on what"""
+    connection = open_queue(queue_path)
+    try:
+        counts = connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status ORDER BY status").fetchall()
+        running = connection.execute("SELECT * FROM jobs WHERE status = 'running' ORDER BY id").fetchall()
+        failed = connection.execute("SELECT * FROM jobs WHERE status IN ('failed', 'partial') ORDER BY id").fetchall()
+    finally:
+        connection.close()
+    print(f"Queue {queue_path}: " + (", ".join(f"{count} {status}" for status, count in counts) or "empty"))
+    now = time.time()
+    for job in running:
+        state = "lease expired" if job["lease_expires"] < now else f"last heartbeat {now - job['heartbeat']:.0f}s ago"
+        print(f"  [running] {session_label(job)} on {job['worker']} (attempt {job['attempts']}, {state}) -> {job['output_dir']}")
+    for job in failed:
+        error = json.loads(job["report"] or "{}").get("error")
+        print(f"  [{job['status']:>7}] {session_label(job)} -> {job['output_dir']}" + (f": {error}" if error else ""))
+    return 0
+
+
+
+
+def parse_pyramid_factors(value):
+    """--pyramid 10,100,1000: distinct decimation factors above 1, finest first"""
+    try:
+        factors = sorted(set(int(factor) for factor in value.split(",")))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated whole numbers, got {value!r}")
+    if not factors or factors[0] < 2:
+        raise argparse.ArgumentTypeError("decimation factors must be 2 or more")
+    return tuple(factors)
+
+
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="EmotiBit File Processor")
+    parser.add_argument("--parser-exe", default=DEFAULT_PARSER_EXE_PATH,
+                        help="Path to the EmotiBit DataParser executable")
+    parser.add_argument("--parser-backend", choices=PARSER_BACKENDS, default="exe",
+                        help="'exe' runs EmotiBitDataParser, 'builtin' uses the Python parser (no .exe needed)")
+    parser.add_argument("--max-workers", type=int, default=1,
+                        help="Number of recordings to parse at the same time (default: 1)")
+    parser.add_argument("--timeout-base", type=float, default=PARSER_TIMEOUT_BASE,
+                        help=f"Parser timeout in seconds for an empty file (default: {PARSER_TIMEOUT_BASE:g})")
+    parser.add_argument("--timeout-per-mb", type=float, default=PARSER_TIMEOUT_PER_MB,
+                        help=f"Extra parser timeout in seconds per MB of raw input (default: {PARSER_TIMEOUT_PER_MB:g})")
+    parser.add_argument("--retries", type=int, default=PARSER_RETRIES,
+                        help=f"Retries for parser jobs that time out, run out of memory or hit an OS error "
+                             f"(default: {PARSER_RETRIES})")
+    parser.add_argument("--retry-backoff", type=float, default=PARSER_RETRY_BACKOFF,
+                        help=f"Seconds before the first retry, doubled for each further one (default: {PARSER_RETRY_BACKOFF:g})")
+    parser.add_argument("--memory-limit", type=float, metavar="MB",
+                        help="RAM that running parser jobs may use together, estimated from their raw file sizes "
+                             f"(default: {MEMORY_HEADROOM:.0%}% of the available memory at start-up)")
+    parser.add_argument("--split-workers", type=int, default=1,
+                        help="Built-in parser only: split raw files over 64 MB into chunks parsed by this many processes")
+    parser.add_argument("--manifest",
+                        help="Run non-interactively over every session listed in a CSV/JSON/YAML manifest")
+    parser.add_argument("--copy-workers", type=int, default=2,
+                        help="Number of sessions copied to Raw at the same time in batch mode (default: 2)")
+    parser.add_argument("--report", help="Write the batch summary to this JSON file")
+    parser.add_argument("--archive-mode", choices=ARCHIVE_MODES, default="copy",
+                        help="How raw files are placed in Raw: copy, hardlink, reflink (copy-on-write clone), auto "
+                             "(best available per file), or gzip/zstd (compressed frames with a seek index)")
+    parser.add_argument("--verify-raw", metavar="RAW_FOLDER",
+                        help="Check the files in a Raw folder against their .sha256 sidecars and exit")
+    parser.add_argument("--streams", metavar="TAGS",
+                        help="Only parse and keep these typetags, comma-separated, e.g. EA,PI,PR,PG,AX,AY,AZ (default: all)")
+    parser.add_argument("--exclude-streams", metavar="TAGS",
+                        help="Never keep these typetags, e.g. MX,MY,MZ,GX,GY,GZ")
+    parser.add_argument("--columnar", choices=COLUMNAR_FORMATS,
+                        help="After parsing, also write each data stream as a memory-mappable .npy (with a schema), "
+                             "Parquet, or both")
+    parser.add_argument("--align", type=float, metavar="RATE_HZ",
+                        help="After parsing, resample the numeric streams of each recording onto one common timebase at "
+                             "this rate and save it as a memory-mappable <timestamp>_aligned_<rate>Hz.npy")
+    parser.add_argument("--align-streams", metavar="TAGS",
+                        help="Comma-separated typetags to include with --align, e.g. EA,PG,T1,AX (default: all numeric)")
+    parser.add_argument("--pyramid", nargs="?", type=parse_pyramid_factors, const=PYRAMID_FACTORS, metavar="FACTORS",
+                        help="After parsing, write a min/max/mean decimation pyramid of each numeric stream as a "
+                             "memory-mappable <timestamp>_<TAG>_pyramid.npy, for plotting long recordings "
+                             f"(default levels: {','.join(map(str, PYRAMID_FACTORS))})")
+    parser.add_argument("--qc", action="store_true",
+                        help="After parsing, write qc_summary.json/.csv (sample rate, dropouts, value ranges per stream) "
+                             "into each recording folder and a roll-up into Parsed/")
+    parser.add_argument("--watch", metavar="MAPPING",
+                        help="Daemon mode: watch the source folders listed in a mapping file (same format as --manifest) "
+                             "and process recordings as soon as they finish writing")
+    parser.add_argument("--settle-seconds", type=float, default=30,
+                        help="How long a recording's files must stop changing before --watch picks them up (default: 30)")
+    parser.add_argument("--poll-interval", type=float, default=5,
+                        help="Seconds between checks while files are settling, or without inotify, and between --worker "
+                             "checks for reclaimable jobs (default: 5)")
+    parser.add_argument("--queue", metavar="PATH",
+                        help="SQLite work queue on a shared filesystem: with --manifest, add the manifest's sessions to it; "
+                             "with --worker, process sessions from it; on its own, print its status")
+    parser.add_argument("--worker", action="store_true",
+                        help="Claim sessions from --queue and process them until the queue is empty (run one or more per host)")
+    parser.add_argument("--lease-seconds", type=float, default=QUEUE_LEASE_SECONDS,
+                        help="A --worker job whose heartbeat stops for this long is reclaimed by another worker "
+                             f"(default: {QUEUE_LEASE_SECONDS})")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap the copy, parse and organize stages (recording N+1 copies while N parses)")
+    parser.add_argument("--queue-depth", type=int, default=2,
+                        help="Pipeline mode: recordings that may wait between two stages (default: 2)")
+    parser.add_argument("--preflight", choices=PREFLIGHT_MODES, default="flag",
+                        help="Check raw files (packet gaps, timestamp order, malformed/truncated lines) before copying: "
+                             "flag warns, quarantine sets bad recordings aside in Quarantine/, off skips (default: flag)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-copy and re-parse everything, even recordings that are unchanged since the last run")
+    parser.add_argument("--catalog", metavar="PATH",
+                        help="Upsert every processed recording (P/E/W/D, paths, times, streams, row counts, sizes, status) "
+                             "into this SQLite catalog; with --query-catalog, the catalog to search")
+    parser.add_argument("--dedup", metavar="PATH",
+                        help="SQLite store of raw file fingerprints shared by all output directories: a recording whose "
+                             "raw file was already parsed elsewhere is linked from there instead of copied and parsed again")
+    parser.add_argument("--query-catalog", nargs="*", metavar="FILTER",
+                        help="List the recordings in --catalog matching filters like P=3 W=1,2 D=1 date=2025-07-21 "
+                             "status=ok stream=PG,EA (every listed stream must be present) and exit")
+    parser.add_argument("--query-format", choices=("table", "csv", "json"), default="table",
+                        help="Output format for --query-catalog (default: table)")
+    parser.add_argument("--run-log", metavar="PATH",
+                        help="Append per-stage timings (wall/CPU time, bytes, files) for every recording to this JSONL file")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument("-q", "--quiet", dest="verbosity", action="store_const", const=VERBOSITY_QUIET,
+                           default=VERBOSITY_NORMAL, help="Only print problems and the final summary")
+    verbosity.add_argument("-v", "--verbose", dest="verbosity", action="store_const", const=VERBOSITY_DEBUG,
+                           help="Also print debug listings")
+    args = parser.parse_args(argv)
+    if args.archive_mode == "zstd":
+        # Checked up front, so a run does not fail on its first raw file after planning every session
+        if importlib.util.find_spec("zstandard") is None:
+            parser.error("--archive-mode zstd needs the zstandard package (pip install zstandard)")
+    return args
+
+
+
+
+def main(argv=None):
+    global _run_log, _scheduler
+    args = parse_args(argv)
+    _run_log = RunLog(args.run_log, args.verbosity)
+    if args.memory_limit:
+        memory_limit = args.memory_limit * 1024 * 1024
     else:
-        print("No parsed datastream files found")
+        available = available_memory()
+        memory_limit = available * MEMORY_HEADROOM if available else None
+    _scheduler = ParserScheduler(args.timeout_base, args.timeout_per_mb, max(0, args.retries), args.retry_backoff,
+                                 memory_limit)
+    start_time = time.perf_counter()
+    exit_code = 1
+    try:
+        exit_code = run_cli(args)
+        return exit_code
+    finally:
+        _run_log.write({"event": "run", "argv": sys.argv[1:] if argv is None else list(argv), "exit_code": exit_code,
+                        "wall_s": round(time.perf_counter() - start_time, 6)})
+        _run_log.print_summary()
+        _run_log.close()
+
+
+
+
+def run_queue(args, parse_func, parser_version, post_parse, streams):
+    """--queue: enqueue the manifest's sessions, run a worker, or print the queue's status"""
+    try:
+        if args.manifest:
+            sessions = load_manifest(args.manifest)
+            added, requeued = enqueue_sessions(args.queue, sessions)
+            print(f"Queued {added} new and {requeued} finished sessions from {args.manifest} in {args.queue}")
+        if not args.worker:
+            return 0 if args.manifest else print_queue_status(args.queue)
        
-        # Debug: List all files in raw folder to see what the parser actually created
-        print("DEBUG: All files in Raw folder after parsing:")
-        if os.path.exists(raw_folder):
-            all_raw_files = os.listdir(raw_folder)
-            for file in all_raw_files:
-                print(f"  {file}")
+        def run_session(session):
+            if args.pipeline:
+                return run_pipeline([session], args.parser_backend, args.parser_exe, args.split_workers, args.max_workers,
+                                    args.copy_workers, args.queue_depth, parser_version, args.force, args.archive_mode,
+                                    post_parse, args.preflight, args.catalog, streams, args.dedup)[0]
+            return run_batch([session], parse_func, args.max_workers, args.copy_workers, parser_version, args.force,
+                             args.archive_mode, post_parse, args.preflight, args.catalog, args.dedup)[0]
        
-        # Debug: List all files in recording folder
-        print("DEBUG: All files in recording folder:")
-        if os.path.exists(recording_folder):
-            all_recording_files = os.listdir(recording_folder)
-            for file in all_recording_files:
-                print(f"  {file}")
-   
-    return moved_files
+        start_time = time.perf_counter()
+        report = run_worker(args.queue, run_session, args.lease_seconds, args.poll_interval)
+    except (OSError, ValueError, RuntimeError, sqlite3.Error) as e:
+        print(f"ERROR: {str(e)}")
+        return 1
+    elapsed = time.perf_counter() - start_time
+    print_batch_report(report, elapsed)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"elapsed": elapsed, "sessions": report}, f, indent=2)
+        print(f"Report written to {args.report}")
+    return 0 if all(entry["status"] == "ok" for entry in report) else 1
 
 
 
 
-def main():
+def run_cli(args):
+    """Run the mode selected on the command line and return the exit code"""
+    if args.query_catalog is not None:
+        # Answered from the catalog alone, before any banner so CSV/JSON output can be piped
+        if not args.catalog:
+            print("ERROR: --query-catalog needs --catalog PATH")
+            return 1
+        try:
+            rows = query_catalog(args.catalog, **parse_catalog_filters(args.query_catalog))
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"ERROR: {str(e)}")
+            return 1
+        print_catalog_rows(rows, args.query_format)
+        return 0
+   
     print("=== EmotiBit File Processor (Fixed Version) ===\n")
    
+    if args.verify_raw:
+        return 1 if verify_raw_files(args.verify_raw) else 0
+   
+    try:
+        streams = parse_stream_selection(args.streams, args.exclude_streams)
+    except ValueError as e:
+        print(f"ERROR: {str(e)}")
+        return 1
+    parse_func = get_parser(args.parser_backend, args.parser_exe, args.split_workers, streams)
+    parser_version = get_parser_version(args.parser_backend, args.parser_exe, streams)
+    post_parse = get_post_parse_stages(args)
+   
+    if args.worker and not args.queue:
+        print("ERROR: --worker needs --queue PATH")
+        return 1
+    if args.queue:
+        return run_queue(args, parse_func, parser_version, post_parse, streams)
+   
+    if args.watch:
+        sessions = load_manifest(args.watch)
+        return watch_folders(sessions, parse_func, parser_version, args.max_workers, args.archive_mode, post_parse,
+                             args.settle_seconds, args.poll_interval, args.preflight, args.catalog, args.dedup)
+   
+    if args.manifest:
+        # Batch mode: no prompts, every session in the manifest goes through the same worker pools
+        sessions = load_manifest(args.manifest)
+        print(f"Loaded {len(sessions)} sessions from {args.manifest}")
+        start_time = time.perf_counter()
+        if args.pipeline:
+            report = run_pipeline(sessions, args.parser_backend, args.parser_exe, args.split_workers, args.max_workers,
+                                  args.copy_workers, args.queue_depth, parser_version, args.force, args.archive_mode,
+                                  post_parse, args.preflight, args.catalog, streams, args.dedup)
+        else:
+            report = run_batch(sessions, parse_func, args.max_workers, args.copy_workers, parser_version, args.force,
+                               args.archive_mode, post_parse, args.preflight, args.catalog, args.dedup)
+        elapsed = time.perf_counter() - start_time
+        print_batch_report(report, elapsed)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump({"elapsed": elapsed, "sessions": report}, f, indent=2)
+            print(f"Report written to {args.report}")
+        return 0 if all(entry["status"] == "ok" for entry in report) else 1
+   
     # Directory containing your raw files
     source_dir = input("Enter source directory for raw files (or press Enter for current directory): ").strip()
     if not source_dir:
@@ -194,61 +4647,62 @@ def main():
     if not output_dir:
         output_dir = "."
    
-    parser_exe_path = r"C:\Program Files\EmotiBit\EmotiBit DataParser\EmotiBitDataParser.exe"
-   
     # Get user input for numbers
     participant_num, emotibit_num, week_num, day_num = get_user_input()
+    session = {"source_dir": source_dir, "output_dir": output_dir, "participant": participant_num,
+               "emotibit": emotibit_num, "week": week_num, "day": day_num}
    
-    # Find raw files and setup folders
-    csv_files, json_files = find_raw_files(source_dir)
-   
-    if not csv_files:
-        print("ERROR: No CSV files found!")
-        return
-   
-    if len(csv_files) != len(json_files):
-        print(f"WARNING: Found {len(csv_files)} CSV files but {len(json_files)} JSON files")
-   
-    raw_folder, parsed_folder = setup_folders(output_dir)
-   
-    # Step 1: Copy original files to Raw folder (preserve names)
-    copied_csv_files = copy_raw_files(source_dir, raw_folder, csv_files, json_files)
+    if args.pipeline:
+        start_time = time.perf_counter()
+        report = run_pipeline([session], args.parser_backend, args.parser_exe, args.split_workers, args.max_workers,
+                              args.copy_workers, args.queue_depth, parser_version, args.force, args.archive_mode,
+                              post_parse, args.preflight, args.catalog, streams, args.dedup)
+        print_batch_report(report, time.perf_counter() - start_time)
+        return 0 if report[0]["status"] == "ok" else 1
    
-    # Step 2: Create recording folders in Parsed folder
-    recording_folders = create_recording_folders(parsed_folder, csv_files, participant_num, emotibit_num, week_num, day_num)
+    # Step 1 & 2: Copy original files to Raw folder and create recording folders in Parsed folder
+    prepared = prepare_session(session, log=_run_log.echo, parser_version=parser_version, force=args.force,
+                               archive_mode=args.archive_mode, stages=[stage_name for stage_name, _ in post_parse],
+                               preflight=args.preflight, dedup=args.dedup)
+    if prepared is None:
+        return 1
+    raw_folder, parsed_folder = prepared["raw_folder"], prepared["parsed_folder"]
    
-    # Step 3: Run parser for each CSV file
-    for (recording_folder, original_csv_name, folder_name), copied_csv_path in zip(recording_folders, copied_csv_files):
-        print(f"\n{'='*50}")
-        print(f"Processing: {folder_name}")
-        print(f"{'='*50}")
-       
-        # Run parser with output going directly to the recording folder
-        success = run_parser(parser_exe_path, copied_csv_path, recording_folder)
-       
-        if success:
-            # Move parsed files from Raw folder to recording folder
-            moved_files = organize_parsed_files(recording_folder, raw_folder, original_csv_name)
-            if moved_files:
-                print(f"Successfully processed {original_csv_name} - moved {len(moved_files)} parsed files")
-            else:
-                print(f"Parser ran successfully for {original_csv_name}, but no parsed files found to move")
-        else:
-            print(f"Failed to process {original_csv_name}")
+    # Step 3: Run parser for each new or changed CSV file (up to --max-workers at a time)
+    start_time = time.perf_counter()
+    results = run_recordings(parse_func, prepared["recording_folders"], prepared["copied_csv_files"], args.max_workers,
+                             post_parse)
+    results = finish_session(session, prepared, results, parser_version, args.catalog, args.dedup)
+    elapsed = time.perf_counter() - start_time
    
     print(f"\n{'='*50}")
     print("SUMMARY:")
     print(f"{'='*50}")
     print(f"Raw files (original names): {raw_folder}")
     print(f"Parsed files (by recording): {parsed_folder}")
-    for _, _, folder_name in recording_folders:
-        print(f"  - {folder_name}")
+    for result in results:
+        status = "✓" if result["success"] else "✗"
+        detail = "unchanged" if result["skipped"] else f"{result['elapsed']:.1f}s"
+        if result.get("quarantined"):
+            detail = f"set aside in {QUARANTINE_FOLDER}/"
+        if result.get("duplicate_of"):
+            detail = f"linked from {result['duplicate_of']}"
+            if result.get("label_conflict"):
+                detail += f", labelled {result['label_conflict']} there"
+        elif result.get("label_conflict"):
+            detail += f", labelled {result['label_conflict']} here before"
+        if not result["success"]:
+            detail += f", {result.get('failure') or 'failed'}"
+        print(f"  {status} {result['folder_name']} ({len(result['parsed_files'])} parsed files, {detail})")
+    succeeded = sum(1 for result in results if result["success"])
+    print(f"Parsed {succeeded}/{len(results)} recordings in {elapsed:.1f}s using up to {args.max_workers} workers")
+    return 0 if succeeded == len(results) else 1
 
 
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 
 
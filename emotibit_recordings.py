@@ -0,0 +1,552 @@
+"""
+Lazy access to the recordings emotibit_parse_organize.py writes into Parsed/
+
+Recordings are found from the P#E#_W#D#_REC#-#_<date> folder names and their streams from the
+<timestamp>_<TAG> file names, without opening anything. A stream is decoded on first access (from its
+columnar .npy when there is one, else from the CSV) and kept in an LRU cache whose total size is bounded,
+shared by all recordings.
+
+    from emotibit_recordings import find_sessions, set_cache_size
+    set_cache_size(1024)                                  # MB for decoded streams, across all recordings
+    for session in find_sessions("D:/study/P1/Parsed", week=3):
+        for recording in session:
+            eda = recording["EA"]                         # loaded now, cached for the next access
+            ppg = recording.stream("PG", start=recording.start_time + 60, end=recording.start_time + 120)
+            print(recording, eda.time[:3], ppg.values.mean())
+        # 1 s before to 2 s after every LSL marker, stacked per stream and marker label
+        erp = session.epochs(["EA", "PG"], pre=1.0, post=2.0)["PG"]["stim30"].mean()
+"""
+import os
+import csv
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import emotibit_parse_organize as epo
+
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+HEADER_COLUMNS = epo.PARSED_HEADER.split(",")
+SEEK_MIN_BYTES = 1024 * 1024  # smaller CSVs are read from the top instead of bisected for a window start
+MARKER_TYPETAG = "LM"         # LSL markers, one row per marker with its payload fields as text
+
+
+
+
+class StreamCache:
+    """Least-recently-used cache of decoded streams, bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """Cached value for a key (marking it as recently used), or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def get(self, key, loader):
+        """Cached value for a key, loaded with loader() on a miss"""
+        value = self.peek(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Add a value, evicting the least recently used ones to stay within max_bytes (too large values are not kept)"""
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key).nbytes
+            if value.nbytes > self.max_bytes:
+                return
+            self._entries[key] = value
+            self.size += value.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        with self._lock:
+            while self.size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+
+# Shared by every Recording that is not given its own cache
+_cache = StreamCache()
+
+
+
+
+def set_cache_size(megabytes):
+    """Bound the memory the shared stream cache may hold"""
+    _cache.resize(int(megabytes * 1024 * 1024))
+
+
+
+
+def get_cache():
+    return _cache
+
+
+
+
+class StreamData:
+    """A decoded stream: a float64 (rows, columns) array plus, for non-numeric streams such as LM, the payload text"""
+
+    def __init__(self, typetag, columns, data, text=None):
+        self.typetag = typetag
+        self.columns = columns
+        self.data = data
+        self.text = text
+        self._sorted = None
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + sum(len(payload) for payload in self.text or ())
+
+    @property
+    def time(self):
+        """LocalTimestamp of every row (seconds since the epoch)"""
+        return self.data[:, 0]
+
+    @property
+    def values(self):
+        """The sample column of a data stream (its last column)"""
+        return self.data[:, -1]
+
+    def column(self, name):
+        return self.data[:, self.columns.index(name)]
+
+    def sorted_index(self):
+        """(timestamps, values) in time order, built once per decoded stream and reused for every search"""
+        if self._sorted is None:
+            times, values = self.time, self.values
+            if len(times) > 1 and (np.diff(times) < 0).any():
+                # Each packet's samples are spread back to the previous packet, so a few can land out of order
+                order = np.argsort(times, kind="stable")
+                times, values = times[order], values[order]
+            self._sorted = (np.ascontiguousarray(times), np.ascontiguousarray(values))
+        return self._sorted
+
+    def window(self, start=None, end=None):
+        """Rows with start <= LocalTimestamp <= end, as views where possible"""
+        mask = np.ones(len(self.data), dtype=bool)
+        if start is not None:
+            mask &= self.time >= start
+        if end is not None:
+            mask &= self.time <= end
+        rows = np.flatnonzero(mask)
+        text = [self.text[i] for i in rows] if self.text is not None else None
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            return StreamData(self.typetag, self.columns, self.data[rows[0]:rows[-1] + 1], text)
+        return StreamData(self.typetag, self.columns, self.data[mask], text)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"<StreamData {self.typetag}: {len(self.data)} rows x {len(self.columns)} columns>"
+
+
+
+
+class Epochs:
+    """Fixed-length windows of one stream around the markers of one label, stacked as (epochs, samples)"""
+
+    def __init__(self, typetag, label, onsets, offsets, data, time):
+        self.typetag = typetag
+        self.label = label
+        self.onsets = onsets
+        self.offsets = offsets
+        self.data = data
+        self.time = time
+
+    def mean(self):
+        """Average over epochs (NaN samples, e.g. in dropouts, are left out)"""
+        return np.nanmean(self.data, axis=0)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"<Epochs {self.typetag} '{self.label}': {self.data.shape[0]} x {self.data.shape[1]} samples>"
+
+
+
+
+def marker_label(payload):
+    """Default marker label: the last payload field (e.g. 'stim30' of 'LSL_MARKER,stim30')"""
+    return payload.rsplit(",", 1)[-1]
+
+
+
+
+def extract_epochs(stream, onsets, pre=1.0, post=2.0):
+    """Cut [onset - pre, onset + post) out of a stream for every onset in one vectorized pass.
+
+    Returns (offsets, data, time): the nominal offsets from the onset at the stream's sample rate, and
+    (onsets, samples) arrays of values and of actual times relative to each onset. Samples beyond either end
+    of the stream, or pushed outside the window by a dropout, are NaN.
+    """
+    times, values = stream.sorted_index()
+    interval = epo._typical_interval(times)
+    if not interval:
+        raise ValueError(f"{stream.typetag} has too few samples to epoch")
+    # Enough samples to cover the whole window whatever the onset's phase between two samples
+    offsets = np.arange(-int(np.ceil(pre / interval)), int(np.ceil(post / interval)))
+   
+    # One binary search per onset, then a single gather for all windows
+    onsets = np.asarray(onsets, dtype=np.float64)
+    positions = np.searchsorted(times, onsets)[:, None] + offsets[None, :]
+    valid = (positions >= 0) & (positions < len(times))
+    positions = np.clip(positions, 0, len(times) - 1)
+    data = values[positions]
+    time = times[positions] - onsets[:, None]
+    valid &= (time >= -pre - interval) & (time < post + interval)
+    data[~valid] = np.nan
+    time[~valid] = np.nan
+    return offsets * interval, data, time
+
+
+
+
+def _epoch_streams(source, typetags, pre, post, labels, label):
+    """Epochs per stream and marker label for a Recording or Session; the markers are read once"""
+    onsets, names = source.markers(label)
+    if labels is not None:
+        keep = np.isin(names, list(labels))
+        onsets, names = onsets[keep], names[keep]
+    if typetags is None:
+        typetags = [tag for tag in source.streams if tag in epo.DATA_TYPETAGS]
+   
+    epochs = {}
+    for typetag in typetags:
+        offsets, data, time = extract_epochs(source.stream(typetag), onsets, pre, post)
+        epochs[typetag] = {}
+        for name in dict.fromkeys(names):
+            rows = names == name
+            epochs[typetag][name] = Epochs(typetag, name, onsets[rows], offsets, data[rows], time[rows])
+    return epochs
+
+
+
+
+def _timestamp(value):
+    """Window bounds may be datetimes or epoch seconds"""
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+
+
+def _seek_time(f, size, start):
+    """Move f to the start of a line shortly before the first row at or after `start` (rows are in time order)"""
+    low, high = f.tell(), size
+    while high - low > epo.COPY_BUFFER_BYTES:
+        middle = (low + high) // 2
+        f.seek(middle)
+        f.readline()
+        line = f.readline()
+        try:
+            timestamp = float(line.split(b",", 1)[0])
+        except ValueError:
+            break
+        if timestamp < start:
+            low = middle
+        else:
+            high = middle
+    f.seek(low)
+    if low:
+        f.readline()
+
+
+
+
+def _load_csv(csv_path, typetag, start=None, end=None):
+    """Decode a parsed <timestamp>_<TAG>.csv, reading only the part of the file around a time window"""
+    with open(csv_path, "rb") as f:
+        header = f.readline().decode("utf-8").rstrip("\r\n").split(",")
+        numeric = typetag in epo.DATA_TYPETAGS and len(header) > len(HEADER_COLUMNS)
+        if numeric:
+            # TypeTag is constant within a file, the same columns the .npy conversion keeps
+            usecols = [i for i, column in enumerate(header) if column != "TypeTag"]
+        else:
+            # Marker/status streams: the numeric packet fields, with the payload kept as text
+            usecols = [i for i, column in enumerate(HEADER_COLUMNS) if column != "TypeTag"]
+        columns = [header[i] for i in usecols]
+
+        size = os.fstat(f.fileno()).st_size
+        if start is not None and size > SEEK_MIN_BYTES:
+            _seek_time(f, size, start)
+
+        blocks, text = [], [] if not numeric else None
+        while True:
+            lines = f.readlines(epo.RAW_CHUNK_BYTES)
+            if not lines:
+                break
+            if numeric:
+                block = np.loadtxt(lines, delimiter=",", usecols=usecols, dtype=np.float64, ndmin=2, comments=None)
+            else:
+                rows = list(csv.reader(line.decode("utf-8", "replace") for line in lines))
+                rows = [row for row in rows if len(row) >= len(HEADER_COLUMNS)]
+                block = np.array([[_float(row[i]) for i in usecols] for row in rows], dtype=np.float64).reshape(-1, len(usecols))
+            if len(block) == 0:
+                continue
+
+            keep = np.ones(len(block), dtype=bool)
+            if start is not None:
+                keep &= block[:, 0] >= start
+            if end is not None:
+                keep &= block[:, 0] <= end
+            blocks.append(block[keep])
+            if text is not None:
+                text.extend(",".join(row[len(HEADER_COLUMNS):]) for row, kept in zip(rows, keep) if kept)
+            if end is not None and block[:, 0].min() > end:
+                break
+
+    data = np.concatenate(blocks) if blocks else np.empty((0, len(columns)))
+    return StreamData(typetag, columns, np.asfortranarray(data), text)
+
+
+
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+
+
+def _load_npy(npy_path, typetag, start=None, end=None):
+    """Open a columnar .npy stream memory-mapped; a window is copied out of the mapping"""
+    array, columns = epo.load_stream_array(npy_path)
+    if start is None and end is None:
+        return StreamData(typetag, columns, array)
+    times = array[:, 0]
+    first = np.searchsorted(times, start, side="left") if start is not None else 0
+    last = np.searchsorted(times, end, side="right") if end is not None else len(times)
+    return StreamData(typetag, columns, np.array(array[first:last], order="F"))
+
+
+
+
+class Recording:
+    """One P#E#_W#D#_REC#-#_<date> folder; streams are discovered from file names and loaded on first access"""
+
+    def __init__(self, folder, cache=None):
+        self.folder = os.path.abspath(folder)
+        self.name = os.path.basename(self.folder)
+        self.cache = cache if cache is not None else _cache
+        match = epo.RECORDING_FOLDER_PATTERN.match(self.name)
+        if not match:
+            raise ValueError(f"{self.name} is not a P#E#_W#D#_REC#-#_<date> recording folder")
+        self.participant, self.emotibit, self.week, self.day, self.rec_index, self.rec_count = map(int, match.groups()[:6])
+        self.date = match.group(7)
+
+        # One directory listing; nothing is opened until a stream is accessed
+        self.prefix = None
+        self.files = {}
+        npy_files = set()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                name = entry.name
+                match = epo.PARSED_CSV_PATTERN.match(name)
+                if match and "_" not in match.group(2):
+                    self.prefix = match.group(1)
+                    self.files[match.group(2)] = entry.path
+                elif name.endswith(".npy"):
+                    npy_files.add(name)
+        self.npy_files = {tag: os.path.join(self.folder, f"{self.prefix}_{tag}.npy") for tag in self.files
+                          if f"{self.prefix}_{tag}.npy" in npy_files}
+        self.pyramid_files = {tag: os.path.join(self.folder, f"{self.prefix}_{tag}{epo.PYRAMID_SUFFIX}.npy")
+                              for tag in self.files if f"{self.prefix}_{tag}{epo.PYRAMID_SUFFIX}.npy" in npy_files}
+
+    @property
+    def streams(self):
+        """Typetags with a parsed file in this recording"""
+        return sorted(self.files)
+
+    @property
+    def start_time(self):
+        """Recording start (epoch seconds) from the raw file name; parsed LocalTimestamps count from here"""
+        if self.prefix is None:
+            return None
+        return datetime.strptime(self.prefix, "%Y-%m-%d_%H-%M-%S-%f").timestamp()
+
+    @property
+    def qc(self):
+        """The recording's qc_summary.json (written with --qc), or None"""
+        path = os.path.join(self.folder, epo.QC_SUMMARY_NAME + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def stream(self, typetag, start=None, end=None):
+        """Decoded stream, optionally only the rows with start <= LocalTimestamp <= end (epoch seconds or datetimes)"""
+        if typetag not in self.files:
+            raise KeyError(f"{self.name} has no {typetag} stream (has {', '.join(self.streams)})")
+        epo._require_numpy("Loading streams")
+        start, end = _timestamp(start), _timestamp(end)
+        path = self.files[typetag]
+        mtime = os.path.getmtime(path)
+
+        # A window of a stream that is already cached is sliced from it instead of read again
+        whole = self.cache.peek((path, mtime, None, None))
+        if whole is not None:
+            self.cache.hits += 1
+            return whole if start is None and end is None else whole.window(start, end)
+        if typetag in self.npy_files:
+            return self.cache.get((path, mtime, start, end), lambda: _load_npy(self.npy_files[typetag], typetag, start, end))
+        return self.cache.get((path, mtime, start, end), lambda: _load_csv(path, typetag, start, end))
+
+    def markers(self, label=marker_label):
+        """LSL marker times (epoch seconds) and labels, in time order; label maps a marker's payload text to its label"""
+        if MARKER_TYPETAG not in self.files:
+            return np.empty(0), np.empty(0, dtype=object)
+        lm = self.stream(MARKER_TYPETAG)
+        order = np.argsort(lm.time, kind="stable")
+        return lm.time[order], np.array([label(lm.text[i]) for i in order], dtype=object)
+
+    def epochs(self, typetags=None, pre=1.0, post=2.0, labels=None, label=marker_label):
+        """Windows of [marker - pre, marker + post) seconds around every LSL marker: {typetag: {label: Epochs}}
+
+        Each stream is loaded once (and cached); typetags defaults to all numeric streams, labels to all markers.
+        """
+        return _epoch_streams(self, typetags, pre, post, labels, label)
+
+    def envelope(self, typetag, start=None, end=None, width=1000):
+        """Rows of (LocalTimestamp, min, max, mean) to plot a stream over start..end at `width` pixels, and their factor.
+
+        Long ranges come from the stream's --pyramid output; ranges too short for its finest level (and streams
+        without a pyramid) come from the samples themselves, with factor 1 and min = max = mean.
+        """
+        start, end = _timestamp(start), _timestamp(end)
+        if typetag in self.pyramid_files:
+            factor, rows = epo.query_pyramid(self.pyramid_files[typetag], start, end, width)
+            if len(rows) >= width:
+                return factor, rows
+        samples = self.stream(typetag, start, end)
+        return 1, np.column_stack((samples.time, samples.values, samples.values, samples.values))
+
+    def __getitem__(self, typetag):
+        return self.stream(typetag)
+
+    def __contains__(self, typetag):
+        return typetag in self.files
+
+    def __repr__(self):
+        return f"<Recording {self.name}: {' '.join(self.streams)}>"
+
+
+
+
+class Session:
+    """The recordings of one P#E#_W#D# session in a Parsed folder, in REC order"""
+
+    def __init__(self, participant, emotibit, week, day, recordings):
+        self.participant, self.emotibit, self.week, self.day = participant, emotibit, week, day
+        self.recordings = sorted(recordings, key=lambda recording: recording.rec_index)
+
+    @property
+    def label(self):
+        return f"P{self.participant}E{self.emotibit}_W{self.week}D{self.day}"
+
+    @property
+    def streams(self):
+        """Typetags present in any of the session's recordings"""
+        return sorted(set(tag for recording in self.recordings for tag in recording.streams))
+
+    def stream(self, typetag, start=None, end=None):
+        """One stream across all recordings that have it, concatenated in time order"""
+        parts = [recording.stream(typetag, start, end) for recording in self.recordings if typetag in recording]
+        if not parts:
+            raise KeyError(f"{self.label} has no {typetag} stream")
+        text = None if parts[0].text is None else [payload for part in parts for payload in part.text]
+        return StreamData(typetag, parts[0].columns, np.concatenate([part.data for part in parts]), text)
+
+    def markers(self, label=marker_label):
+        """LSL markers of all recordings, in time order"""
+        parts = [recording.markers(label) for recording in self.recordings]
+        return np.concatenate([times for times, _ in parts]), np.concatenate([names for _, names in parts])
+
+    def epochs(self, typetags=None, pre=1.0, post=2.0, labels=None, label=marker_label):
+        """Epochs around the markers of the whole session, on each stream concatenated across recordings"""
+        return _epoch_streams(self, typetags, pre, post, labels, label)
+
+    def __iter__(self):
+        return iter(self.recordings)
+
+    def __len__(self):
+        return len(self.recordings)
+
+    def __getitem__(self, index):
+        return self.recordings[index]
+
+    def __repr__(self):
+        return f"<Session {self.label}: {len(self.recordings)} recordings>"
+
+
+
+
+def find_recordings(parsed_folders, participant=None, emotibit=None, week=None, day=None, cache=None):
+    """Recordings in one or more Parsed folders, filtered by P/E/W/D (a value or a list of values each)"""
+    if isinstance(parsed_folders, (str, os.PathLike)):
+        parsed_folders = [parsed_folders]
+    wanted = {"participant": participant, "emotibit": emotibit, "week": week, "day": day}
+    wanted = {field: set(value) if isinstance(value, (list, tuple, set)) else {value}
+              for field, value in wanted.items() if value is not None}
+
+    recordings = []
+    for parsed_folder in parsed_folders:
+        with os.scandir(parsed_folder) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                match = epo.RECORDING_FOLDER_PATTERN.match(entry.name)
+                if not match or not entry.is_dir():
+                    continue
+                # Filter on the folder name before listing the folder
+                fields = dict(zip(("participant", "emotibit", "week", "day"), map(int, match.groups()[:4])))
+                if all(fields[field] in values for field, values in wanted.items()):
+                    recordings.append(Recording(entry.path, cache))
+    return recordings
+
+
+
+
+def find_sessions(parsed_folders, participant=None, emotibit=None, week=None, day=None, cache=None):
+    """Recordings grouped into Sessions, ordered by P/E/W/D"""
+    groups = {}
+    for recording in find_recordings(parsed_folders, participant, emotibit, week, day, cache):
+        key = (recording.participant, recording.emotibit, recording.week, recording.day)
+        groups.setdefault(key, []).append(recording)
+    return [Session(*key, recordings) for key, recordings in sorted(groups.items())]
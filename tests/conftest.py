@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import emotibit_parse_organize as epo
+
+
+
+
+RECORDING_NAMES = ["2025-07-21_09-00-00-123456", "2025-07-21_09-07-00-123456"]
+
+
+
+
+def write_raw_file(path, seconds=20):
+    """Small raw EmotiBit CSV: EA/PG/T1 data packets at 5 Hz after the RB start packet"""
+    name = os.path.splitext(os.path.basename(path))[0]
+    lines = [f"1000,0,1,RB,1,100,{name}"]
+    packet = 0
+    for step in range(seconds * 5):
+        timestamp = 1100 + step * 200
+        for tag, count in (("EA", 3), ("PG", 5), ("T1", 1)):
+            packet += 1
+            values = ",".join(f"{(step * count + i) % 97 / 10:.3f}" for i in range(count))
+            lines.append(f"{timestamp},{packet},{count},{tag},1,100,{values}")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+
+
+@pytest.fixture(autouse=True)
+def fresh_run_state():
+    """Each test gets its own run log and a scheduler without retry delays"""
+    epo._run_log = epo.RunLog()
+    epo._scheduler = epo.ParserScheduler(retries=0, retry_backoff=0)
+    yield
+
+
+
+
+@pytest.fixture
+def make_session(tmp_path):
+    """Create a source folder with raw recordings and return a session for it"""
+    def make(name="src", participant=1, recordings=RECORDING_NAMES, output="out"):
+        source_dir = tmp_path / name
+        source_dir.mkdir(exist_ok=True)
+        for recording in recordings:
+            write_raw_file(str(source_dir / f"{recording}.csv"))
+            (source_dir / f"{recording}_info.json").write_text("{}")
+        return {"source_dir": str(source_dir), "output_dir": str(tmp_path / output), "participant": participant,
+                "emotibit": 1, "week": 1, "day": 1}
+    return make
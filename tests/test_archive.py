@@ -0,0 +1,74 @@
+import hashlib
+import os
+from functools import partial
+
+import pytest
+
+import emotibit_parse_organize as epo
+from conftest import RECORDING_NAMES
+
+
+
+
+def sha256_of(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+
+
+def raw_folder_of(output_dir):
+    return next(os.path.join(root, "Raw") for root, dirs, _ in os.walk(output_dir) if "Raw" in dirs)
+
+
+
+
+@pytest.fixture
+def no_rehashing(monkeypatch):
+    """Fail the test if anything reads a whole file just to hash it"""
+    def file_sha256(path):
+        raise AssertionError(f"{path} was hashed again")
+    monkeypatch.setattr(epo, "file_sha256", file_sha256)
+
+
+
+
+@pytest.mark.parametrize("runner", ["batch", "pipeline"])
+def test_hardlink_mode_reuses_the_preflight_checksum(make_session, no_rehashing, runner):
+    pytest.importorskip("numpy")
+    session = make_session()
+
+    if runner == "batch":
+        parse_func = partial(epo.parse_raw_file, split_workers=1, streams=None)
+        report = epo.run_batch([session], parse_func, archive_mode="hardlink")
+    else:
+        report = epo.run_pipeline([session], "builtin", None, archive_mode="hardlink")
+
+    assert report[0]["status"] == "ok"
+    raw_folder = raw_folder_of(session["output_dir"])
+    for name in RECORDING_NAMES:
+        with open(os.path.join(raw_folder, name + ".csv.sha256")) as f:
+            assert f.read() == f"{sha256_of(os.path.join(session['source_dir'], name + '.csv'))}  {name}.csv\n"
+        # Nothing was hashed for the _info.json files, so their sidecars wait until they are needed
+        assert not os.path.exists(os.path.join(raw_folder, name + "_info.json.sha256"))
+
+
+
+
+def test_link_without_checksum_writes_the_sidecar_on_first_use(tmp_path):
+    source = tmp_path / "2025-07-21_09-00-00-123456.csv"
+    source.write_text("1000,0,1,RB,1,100,x\n")
+    raw_folder = tmp_path / "Raw"
+    raw_folder.mkdir()
+    # A sidecar from an earlier version of the file must not survive
+    (raw_folder / (source.name + ".sha256")).write_text("0" * 64 + f"  {source.name}\n")
+
+    assert epo.archive_file(str(source), str(raw_folder / source.name), "hardlink") == "hardlink"
+    assert not (raw_folder / (source.name + ".sha256")).exists()
+    lines = []
+    assert epo.verify_raw_files(str(raw_folder), log=lines.append) == []
+    assert f"  ? {source.name}: no sidecar yet" in lines
+
+    assert epo.archived_sha256(str(raw_folder), source.name) == sha256_of(source)
+    assert (raw_folder / (source.name + ".sha256")).read_text() == f"{sha256_of(source)}  {source.name}\n"
+    assert epo.verify_raw_files(str(raw_folder), log=lines.append) == []
@@ -0,0 +1,81 @@
+import json
+import os
+from functools import partial
+
+import emotibit_parse_organize as epo
+
+
+
+
+def builtin_parser():
+    return partial(epo.parse_raw_file, split_workers=1, streams=None)
+
+
+
+
+def test_catalog_failure_is_a_session_warning(make_session, tmp_path, capsys):
+    run_log = tmp_path / "runs.jsonl"
+    epo._run_log = epo.RunLog(str(run_log))
+    session = make_session()
+    # A directory cannot be opened as a SQLite database
+    catalog = tmp_path / "catalog.db"
+    catalog.mkdir()
+
+    report = epo.run_batch([session], builtin_parser(), catalog=str(catalog))
+    epo._run_log.close()
+
+    assert report[0]["status"] == "ok"
+    assert len(report[0]["warnings"]) == 1
+    assert report[0]["warnings"][0].startswith(f"WARNING: Could not update the catalog {catalog}")
+    assert report[0]["warnings"][0] in capsys.readouterr().out
+    records = [json.loads(line) for line in run_log.read_text().splitlines()]
+    assert [record.get("error") is not None for record in records if record.get("stage") == "catalog"] == [True]
+
+
+
+
+def test_linked_duplicate_gets_its_own_qc_summary(make_session, tmp_path):
+    store = str(tmp_path / "dedup.db")
+    post_parse = [("qc", epo.summarize_recording)]
+    first = make_session("a", participant=1, output="out_a")
+    second = make_session("b", participant=2, output="out_b")
+    epo.run_batch([first], builtin_parser(), post_parse=post_parse, dedup=store)
+
+    report = epo.run_batch([second], builtin_parser(), post_parse=post_parse, dedup=store)
+
+    recordings = report[0]["recordings"]
+    assert all(result.get("duplicate_of") for result in recordings)
+    for result in recordings:
+        folder = tmp_path / "out_b" / "Parsed" / result["folder_name"]
+        original = os.path.join(result["duplicate_of"], "qc_summary.json")
+        with open(folder / "qc_summary.json") as f:
+            summary = json.load(f)
+        assert summary["recording"] == result["folder_name"]
+        assert summary["raw"]["file"] == result["csv_file"]
+        assert not os.path.samefile(folder / "qc_summary.json", original)
+        with open(original) as f:
+            assert summary["streams"] == json.load(f)["streams"]
+
+
+
+
+def test_staging_folder_is_removed_after_the_session(make_session, tmp_path):
+    session = make_session()
+
+    report = epo.run_batch([session], builtin_parser())
+
+    assert report[0]["status"] == "ok"
+    parsed_folder = tmp_path / "out" / "Parsed"
+    assert sorted(os.listdir(parsed_folder)) == sorted(result["folder_name"] for result in report[0]["recordings"])
+    assert not (parsed_folder / epo.STAGING_FOLDER).exists()
+
+
+
+
+def test_pipeline_removes_the_staging_folder(make_session, tmp_path):
+    session = make_session()
+
+    report = epo.run_pipeline([session], "builtin", None)
+
+    assert report[0]["status"] == "ok"
+    assert not (tmp_path / "out" / "Parsed" / epo.STAGING_FOLDER).exists()
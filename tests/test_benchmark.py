@@ -0,0 +1,22 @@
+import importlib.util
+
+import pytest
+
+import emotibit_benchmark
+import emotibit_parse_organize as epo
+
+
+
+
+@pytest.mark.parametrize("archive_mode", epo.ARCHIVE_MODES)
+def test_benchmark_runs_in_every_archive_mode(tmp_path, archive_mode):
+    if archive_mode == "zstd" and importlib.util.find_spec("zstandard") is None:
+        pytest.skip("zstd archives need zstandard")
+
+    report = emotibit_benchmark.run_benchmarks([0.1], 1, str(tmp_path), archive_mode=archive_mode)
+
+    stages = report[0]["stages"]
+    assert [stage["stage"] for stage in stages] == ["find_raw_files", "copy_raw_files", "run_parser",
+                                                    "organize_parsed_files"]
+    # Parser throughput is measured on the original size, also when Raw holds a compressed archive
+    assert stages[2]["mb"] == pytest.approx(stages[1]["mb"], rel=0.05)
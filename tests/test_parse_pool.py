@@ -0,0 +1,74 @@
+import os
+import signal
+from functools import partial
+
+import pytest
+
+import emotibit_parse_organize as epo
+
+pytestmark = pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs SIGKILL")
+
+
+
+
+@pytest.fixture
+def killing_parser(monkeypatch, tmp_path):
+    """Built-in parser whose worker process SIGKILLs itself the first time it parses the given recording"""
+    marker = tmp_path / "killed"
+    parse_raw_file = epo.parse_raw_file
+
+    def install(victim):
+        def parse(csv_file_path, output_folder, **kwargs):
+            if victim in os.path.basename(csv_file_path) and not marker.exists():
+                marker.touch()
+                os.kill(os.getpid(), signal.SIGKILL)
+            return parse_raw_file(csv_file_path, output_folder, **kwargs)
+        # Worker processes are forked from the test process, so they see the patched module
+        monkeypatch.setattr(epo, "parse_raw_file", parse)
+        return partial(epo.parse_raw_file, split_workers=1, streams=None)
+    return install
+
+
+
+
+def test_killed_worker_fails_only_its_recording(make_session, killing_parser):
+    sessions = [make_session("a", output="out_a"), make_session("b", output="out_b")]
+    parse_func = killing_parser("09-07-00")
+
+    report = epo.run_batch(sessions, parse_func, max_workers=1)
+
+    assert [entry["status"] for entry in report] == ["partial", "ok"]
+    failed = [result for result in report[0]["recordings"] if not result["success"]]
+    assert [(result["csv_file"], result["failure"]) for result in failed] == \
+        [("2025-07-21_09-07-00-123456.csv", "out-of-memory")]
+    # The rest of the batch still ran and was recorded
+    assert all(result["success"] for result in report[1]["recordings"])
+    manifest = epo.load_processing_manifest(sessions[1]["output_dir"])
+    assert len(manifest["recordings"]) == 2
+
+
+
+
+def test_killed_worker_is_retried_on_a_fresh_pool(make_session, killing_parser):
+    epo._scheduler = epo.ParserScheduler(retries=1, retry_backoff=0)
+    session = make_session()
+    parse_func = killing_parser("09-00-00")
+
+    report = epo.run_batch([session], parse_func, max_workers=2)
+
+    assert report[0]["status"] == "ok"
+    attempts = {result["csv_file"]: result["attempts"] for result in report[0]["recordings"]}
+    assert attempts["2025-07-21_09-00-00-123456.csv"] == 2
+
+
+
+
+def test_pipeline_replaces_a_killed_worker(make_session, killing_parser):
+    sessions = [make_session("a", output="out_a"), make_session("b", output="out_b")]
+    killing_parser("09-00-00")
+
+    report = epo.run_pipeline(sessions, "builtin", None, max_workers=1)
+
+    assert [entry["status"] for entry in report] == ["partial", "ok"]
+    failures = {result["csv_file"]: result["failure"] for result in report[0]["recordings"] if not result["success"]}
+    assert failures == {"2025-07-21_09-00-00-123456.csv": "out-of-memory"}
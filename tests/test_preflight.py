@@ -0,0 +1,54 @@
+import pytest
+
+import emotibit_parse_organize as epo
+from conftest import write_raw_file
+
+np = pytest.importorskip("numpy")
+
+
+
+
+FIELDS = ["7", "1234", "12345678", "123456789", "000000012", "123456789012345", "1234567890123456",
+          "12.5", "0.125", ".5", "5.", "", ".", "1.2.3", "12a4", "-12", " 12", "9" * 20, "9" * 21]
+
+
+
+
+def reference_parse(field, width):
+    """What _parse_number_fields should return for one field: unsigned decimal, at most width characters"""
+    valid = 0 < len(field) <= width and field.count(".") <= 1 and field.replace(".", "").isdigit()
+    return (float(field) if valid else None), valid
+
+
+
+
+@pytest.mark.parametrize("width", [10, 15, 20])
+def test_number_fields_match_a_per_field_parse(width):
+    # The first field starts the block, so it has no whole word before its end
+    buf = np.frombuffer(",".join(FIELDS).encode() + b",", dtype=np.uint8)
+    ends = np.flatnonzero(buf == 44)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    values, valid = epo._parse_number_fields(buf, starts, ends, width=width)
+
+    for field, value, ok in zip(FIELDS, values, valid):
+        expected, expected_ok = reference_parse(field, width)
+        assert ok == expected_ok, field
+        if ok:
+            assert value == pytest.approx(expected, rel=1e-15), field
+
+
+
+
+@pytest.mark.parametrize("block_bytes", [64, 1000, epo.PREFLIGHT_BLOCK_BYTES])
+def test_check_raw_file_finds_a_dropped_packet(tmp_path, block_bytes):
+    path = tmp_path / "2025-07-21_09-00-00-123456.csv"
+    write_raw_file(str(path))
+    lines = path.read_text().splitlines(keepends=True)
+    path.write_text("".join(lines[:50] + lines[51:]))
+
+    qc = epo.check_raw_file(str(path), block_bytes=block_bytes)
+
+    assert (qc["packets"], qc["malformed_lines"]) == (len(lines) - 1, 0)
+    assert (qc["packet_gaps"], qc["missing_packets"], qc["timestamp_reversals"]) == (1, 1, 0)
+    assert qc["status"] == "warning"
@@ -0,0 +1,32 @@
+import pytest
+
+import emotibit_parse_organize as epo
+
+pytest.importorskip("numpy")
+
+
+
+
+def write_parsed_stream(path, rows):
+    with open(path, "w") as f:
+        f.write(epo.PARSED_HEADER + ",EA\n")
+        f.write("".join(row + "\n" for row in rows))
+
+
+
+
+@pytest.mark.parametrize("empty_row", ["1000.600,1600.000,7,0,EA,1,100", "1000.600,1600.000,7,0,EA,1,100,"])
+def test_packet_without_payload_is_counted_as_empty(tmp_path, empty_row):
+    rows = [f"{1000 + i / 10:.3f},{1000 + i * 100:.3f},{i},1,EA,1,100,{i / 10:.3f}" for i in range(6)]
+    rows += [empty_row]
+    rows += [f"{1000.7 + i / 10:.3f},{1700 + i * 100:.3f},{8 + i},1,EA,1,100,{0.6 + i / 10:.3f}" for i in range(4)]
+    path = tmp_path / "2025-07-21_09-00-00-123456_EA.csv"
+    write_parsed_stream(path, rows)
+
+    summary = epo.summarize_stream(str(path))
+
+    assert summary["samples"] == 10
+    assert summary["empty_packets"] == 1
+    assert summary["min"] == pytest.approx(0.0)
+    assert summary["max"] == pytest.approx(0.9)
+    assert summary["mean"] == pytest.approx(0.45)